@@ -0,0 +1,67 @@
+"""
+Crossover between the direct all-pairs kernel and the Barnes-Hut octree.
+
+Usage (from the root of the project):
+  $ python3 -m benchmarks.barnes_hut --theta 0.5 -n 16 -n 64 -n 256 -n 1024
+"""
+import time
+import click
+import numpy as np
+
+from src.body import (Body, BodySystem)
+from src.edo import n_body_dpdt
+from src.octree import BarnesHut
+
+def random_bodies(n, rng):
+  """
+  Sun-like central mass surrounded by n - 1 light bodies on a disk of ~ 30 AU
+  """
+  radius = 30 * np.sqrt(rng.random(n))
+  angle = 2 * np.pi * rng.random(n)
+  positions = np.stack([radius * np.cos(angle), radius * np.sin(angle), 0.01 * radius * rng.normal(size=n)], axis=1)
+  positions[0] = 0
+  masses = np.full(n, 1e-6)
+  masses[0] = 1
+
+  bodies = [Body(name=f"body-{i}", initial_positions=positions[i], initial_impulsions=np.zeros(3), mass=masses[i], color="k", marker=",", marker_anim="o", markersize=1) for i in range(n)]
+  return BodySystem(bodies), positions.flatten()
+
+def best_time(dpdt, qk, bodies, repeat):
+  timings = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    dpdt(qk, None, bodies)
+    timings.append(time.perf_counter() - start)
+  return min(timings)
+
+@click.command()
+@click.option("--n-bodies", "-n", type=int, multiple=True, default=[4, 16, 64, 256, 1024, 2048], show_default=True, help="Number of bodies")
+@click.option("--theta", type=float, default=0.5, show_default=True, help="Opening angle of the octree")
+@click.option("--repeat", "-r", type=int, default=5, show_default=True, help="Number of timings per point (the best one is kept)")
+def main(n_bodies, theta, repeat):
+  rng = np.random.default_rng(0)
+  barnes_hut = BarnesHut(theta=theta)
+
+  print(f"{'N':>6} {'direct [ms]':>12} {'barnes-hut [ms]':>16} {'max rel. error':>15}")
+  crossover = None
+  for n in sorted(n_bodies):
+    bodies, qk = random_bodies(n, rng)
+
+    direct_time = best_time(n_body_dpdt, qk, bodies, repeat)
+    tree_time = best_time(barnes_hut, qk, bodies, repeat)
+
+    exact = n_body_dpdt(qk, None, bodies).reshape([-1, 3])
+    approx = barnes_hut(qk, None, bodies).reshape([-1, 3])
+    error = np.max(np.linalg.norm(approx - exact, axis=1) / np.linalg.norm(exact, axis=1))
+
+    print(f"{n:>6} {direct_time * 1e3:>12.3f} {tree_time * 1e3:>16.3f} {error:>15.2e}")
+    if crossover is None and tree_time < direct_time:
+      crossover = n
+
+  if crossover is None:
+    print("the direct kernel is faster for every tested N")
+  else:
+    print(f"Barnes-Hut is faster from N = {crossover} (theta = {theta})")
+
+if __name__ == "__main__":
+  main()
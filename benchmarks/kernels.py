@@ -0,0 +1,212 @@
+"""
+Timings of the hot paths: force kernel, diagnostics kernels, one step of each solver
+and whole runs of each solver, across a range of body counts and step counts.
+Results can be saved as JSON and compared with the ones of another commit.
+
+Usage (from the root of the project):
+  $ python3 -m benchmarks.kernels -o before.json
+  $ python3 -m benchmarks.kernels -o after.json --compare before.json
+"""
+import sys
+import json
+import time
+import platform
+import subprocess
+import click
+import numpy as np
+
+from consts import (G, sun_position0, sun_impulsion0, jupiter_position0, jupiter_impulsion0, saturn_position0, saturn_impulsion0, earth_position0, earth_impulsion0, M_sun, M_jup, M_sat, M_earth)
+from src.body import (Body, BodySystem)
+from src.edo import (hamiltonian, compute_angular_momentum, n_body_dqdt, n_body_dpdt)
+from src.solvers import (heun, euler_symp, stormer_verlet, yoshida4, yoshida6, forest_ruth, wisdom_holman)
+from src.solvers import (heun_step, euler_symp_step, stormer_verlet_step, yoshida4_step, yoshida6_step, forest_ruth_step, wisdom_holman_step, dormand_prince_step)
+from .barnes_hut import random_bodies
+
+# same initial conditions as index.py
+PRESET_BODIES = {
+  "Sun": (sun_position0, sun_impulsion0, M_sun),
+  "Jupiter": (jupiter_position0, jupiter_impulsion0, M_jup),
+  "Saturn": (saturn_position0, saturn_impulsion0, M_sat),
+  "Earth": (earth_position0, earth_impulsion0, M_earth)
+}
+
+PRESETS = {
+  "sun-jupiter": ["Sun", "Jupiter"],
+  "sun-jupiter-saturn": ["Sun", "Jupiter", "Saturn"],
+  "sun-jupiter-saturn-earth": ["Sun", "Jupiter", "Saturn", "Earth"]
+}
+
+KERNELS = {
+  "n_body_dpdt": n_body_dpdt,
+  "hamiltonian": hamiltonian,
+  "compute_angular_momentum": compute_angular_momentum
+}
+
+STEPS = {
+  "heun": heun_step,
+  "euler_symp": euler_symp_step,
+  "stormer_verlet": stormer_verlet_step,
+  "yoshida4": yoshida4_step,
+  "yoshida6": yoshida6_step,
+  "forest_ruth": forest_ruth_step,
+  "wisdom_holman": wisdom_holman_step,
+  "dormand_prince": None
+}
+
+SOLVERS = {
+  "heun": heun,
+  "euler_symp": euler_symp,
+  "stormer_verlet": stormer_verlet,
+  "yoshida4": yoshida4,
+  "yoshida6": yoshida6,
+  "forest_ruth": forest_ruth,
+  "wisdom_holman": wisdom_holman
+}
+
+def preset_system(names):
+  bodies = BodySystem([Body(name=name, initial_positions=PRESET_BODIES[name][0], initial_impulsions=PRESET_BODIES[name][1], mass=PRESET_BODIES[name][2], color="k", marker=",", marker_anim="o", markersize=1) for name in names])
+  return bodies, bodies.q0, bodies.p0
+
+def random_system(n, rng):
+  """
+  Central mass and n - 1 light bodies on circular orbits (see barnes_hut.random_bodies)
+  """
+  bodies, qk = random_bodies(n, rng)
+  positions = bodies.initial_positions[1:]
+  r = np.linalg.norm(positions[:, :2], axis=1)
+  direction = np.stack([-positions[:, 1], positions[:, 0], np.zeros(n - 1)], axis=1) / r[:, np.newaxis]
+  bodies.initial_impulsions[1:] = (bodies.masses[1:] * np.sqrt(G * bodies.masses[0] / r))[:, np.newaxis] * direction
+  return bodies, qk, bodies.p0
+
+def best_time(call, repeat, min_time=0.02):
+  """
+  :return: best time of one call over `repeat` timings, each timing running the call
+  enough times to last at least `min_time` seconds
+  """
+  number = 1
+  while True:
+    start = time.perf_counter()
+    for _ in range(number):
+      call()
+    elapsed = time.perf_counter() - start
+    if elapsed >= min_time:
+      break
+    number *= 2
+
+  timings = [elapsed / number]
+  for _ in range(repeat - 1):
+    start = time.perf_counter()
+    for _ in range(number):
+      call()
+    timings.append((time.perf_counter() - start) / number)
+  return min(timings)
+
+def step_call(name, qk, pk, dt, bodies):
+  if name == "dormand_prince":
+    kq, kp = n_body_dqdt(qk, pk, bodies), n_body_dpdt(qk, pk, bodies)
+    return lambda: dormand_prince_step(n_body_dqdt, n_body_dpdt, qk, pk, dt, bodies, kq, kp)
+  return lambda: STEPS[name](n_body_dqdt, n_body_dpdt, qk, pk, dt, bodies)
+
+def run_call(name, qk, pk, dt, nt, bodies):
+  q, p = np.zeros((nt, len(qk))), np.zeros((nt, len(pk)))
+  q[0], p[0] = qk, pk
+
+  def call():
+    SOLVERS[name](dqdt=n_body_dqdt, dpdt=n_body_dpdt, q=q, p=p, dt=dt, nt=nt, bodies=bodies)
+  return call
+
+def scaling_exponent(n_bodies, timings):
+  """
+  Slope of log(time) versus log(N) (least squares): time ~ N^slope
+  """
+  if len(n_bodies) < 2:
+    return None
+  return float(np.polyfit(np.log(n_bodies), np.log(timings), 1)[0])
+
+def git_commit():
+  try:
+    return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+def compare(results, baseline):
+  """
+  Print the speedup of each timing with respect to the same timing of a previous run.
+  """
+  previous = {(entry["benchmark"], entry["system"], entry["n_steps"]): entry["time"] for entry in baseline["results"]}
+
+  print(f"\ncompared to {baseline['commit'] or 'baseline'}")
+  print(f"{'benchmark':<34} {'system':<26} {'steps':>6} {'speedup':>8}")
+  for entry in results:
+    key = (entry["benchmark"], entry["system"], entry["n_steps"])
+    if key in previous:
+      print(f"{entry['benchmark']:<34} {entry['system']:<26} {entry['n_steps'] or '':>6} {previous[key] / entry['time']:>8.2f}")
+
+@click.command()
+@click.option("--n-bodies", "-n", type=int, multiple=True, default=[2, 4, 8, 16, 32, 64, 128, 256], show_default=True, help="Number of bodies of the random systems (scaling versus N)")
+@click.option("--n-steps", "-s", type=int, multiple=True, default=[100, 1000, 5000], show_default=True, help="Number of steps of the whole runs (on the sun-jupiter-saturn-earth preset)")
+@click.option("--dt", type=float, default=30, show_default=True, help="Time step (in days)")
+@click.option("--repeat", "-r", type=int, default=5, show_default=True, help="Number of timings per point (the best one is kept)")
+@click.option("--output", "-o", type=click.Path(dir_okay=False), default=None, help="Save the results in this JSON file")
+@click.option("--compare", "-c", "baseline", type=click.File(), default=None, help="JSON file of a previous run to compare with")
+def main(n_bodies, n_steps, dt, repeat, output, baseline):
+  rng = np.random.default_rng(0)
+  n_bodies = sorted(n_bodies)
+
+  systems = [(name, *preset_system(names)) for (name, names) in PRESETS.items()]
+  systems += [(f"random-{n}", *random_system(n, rng)) for n in n_bodies]
+
+  results = []
+  def record(benchmark, system, n, timing, n_steps=None):
+    entry = {"benchmark": benchmark, "system": system, "n_bodies": n, "n_steps": n_steps, "time": timing}
+    if benchmark.startswith("step/") or benchmark.startswith("run/"):
+      entry["steps_per_second"] = (n_steps or 1) / timing
+    results.append(entry)
+    rate = f"{entry['steps_per_second']:>14.0f}" if "steps_per_second" in entry else f"{'':>14}"
+    print(f"{benchmark:<34} {system:<26} {n:>4} {n_steps or '':>6} {timing * 1e6:>12.2f} {rate}")
+
+  print(f"{'benchmark':<34} {'system':<26} {'N':>4} {'steps':>6} {'time [us]':>12} {'steps/s':>14}")
+
+  # kernels and one step of each solver
+  for (system, bodies, qk, pk) in systems:
+    for (name, kernel) in KERNELS.items():
+      record(name, system, len(bodies), best_time(lambda: kernel(qk, pk, bodies), repeat))
+    for name in STEPS:
+      record(f"step/{name}", system, len(bodies), best_time(step_call(name, qk, pk, dt, bodies), repeat))
+
+  # whole runs (step loop included) versus the number of steps
+  system, bodies, qk, pk = systems[len(PRESETS) - 1]
+  for nt in sorted(n_steps):
+    for name in SOLVERS:
+      record(f"run/{name}", system, len(bodies), best_time(run_call(name, qk, pk, dt, nt, bodies), max(1, repeat // 2), min_time=0), n_steps=nt - 1)
+
+  # time ~ N^exponent on the random systems
+  exponents = {}
+  print(f"\n{'benchmark':<34} {'scaling exponent (N = ' + ', '.join(map(str, n_bodies)) + ')'}")
+  for benchmark in list(KERNELS) + [f"step/{name}" for name in STEPS]:
+    entries = [entry for entry in results if entry["benchmark"] == benchmark and entry["system"].startswith("random-")]
+    exponents[benchmark] = scaling_exponent([entry["n_bodies"] for entry in entries], [entry["time"] for entry in entries])
+    if exponents[benchmark] is not None:
+      print(f"{benchmark:<34} {exponents[benchmark]:.2f}")
+
+  report = {
+    "commit": git_commit(),
+    "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    "python": sys.version.split()[0],
+    "numpy": np.__version__,
+    "platform": platform.platform(),
+    "processor": platform.processor(),
+    "dt": dt,
+    "results": results,
+    "scaling_exponents": exponents
+  }
+
+  if output is not None:
+    with open(output, "w") as f:
+      json.dump(report, f, indent=2)
+
+  if baseline is not None:
+    compare(results, json.load(baseline))
+
+if __name__ == "__main__":
+  main()
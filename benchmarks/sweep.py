@@ -0,0 +1,72 @@
+"""
+Work-precision sweep: every solver of a grid of solvers x time steps x horizons x systems is run
+(across a pool of worker processes) and measured => wall time, steps per second,
+largest relative drift of the energy and of the angular momentum.
+Results can be saved as CSV / JSON and as a work-precision diagram, and the cheapest configuration
+meeting an accuracy budget is picked for each system and horizon.
+
+Usage (from the root of the project):
+  $ python3 -m benchmarks.sweep -s stormer-verlet -s yoshida-4 -s wisdom-holman --dt 1 --dt 5 --dt 20 -t 100 -j 4 --budget 1e-6 --plot sweep.png
+"""
+import sys
+import time
+import platform
+import click
+
+from src.body import Body
+from src.sweep import (SWEEP_SOLVERS, sweep_cells, run_sweep, cheapest, write_csv, write_json, plot_work_precision)
+from .kernels import (PRESET_BODIES, PRESETS, git_commit)
+
+def preset_bodies(names):
+  return [Body(name=name, initial_positions=PRESET_BODIES[name][0], initial_impulsions=PRESET_BODIES[name][1], mass=PRESET_BODIES[name][2], color="k", marker=",", marker_anim="o", markersize=1) for name in names]
+
+def format_row(row):
+  tolerance = f"{row['tolerance']:.0e}" if row["tolerance"] is not None else ""
+  return f"{row['bodies']:<26} {row['horizon']:>8g} {row['solver']:<18} {row['dt']:>7g} {tolerance:>7} {row['steps']:>9} {row['wall_time']:>9.3f} {row['steps_per_second']:>11.0f} {row['energy_drift']:>12.3e} {row['angular_momentum_drift']:>12.3e}"
+
+@click.command()
+@click.option("--system", "-cb", type=click.Choice(list(PRESETS)), multiple=True, default=["sun-jupiter-saturn"], show_default=True, help="Systems of bodies")
+@click.option("--solver", "-s", type=click.Choice(list(SWEEP_SOLVERS)), multiple=True, default=["euler-symplectic", "stormer-verlet", "yoshida-4", "wisdom-holman"], show_default=True, help="Solvers")
+@click.option("--dt", type=float, multiple=True, default=[1, 5, 20], show_default=True, help="Time steps (in days), the initial one of the adaptive schemes being the smallest")
+@click.option("--time", "-t", "horizons", type=float, multiple=True, default=[100], show_default=True, help="Times of integration (in years)")
+@click.option("--tolerance", type=float, multiple=True, default=[1e-8, 1e-10, 1e-12], show_default=True, help="Tolerances of the adaptive schemes (dormand-prince), swept instead of the time step")
+@click.option("--backend", type=click.Choice(["numpy", "numba"]), default="numpy", show_default=True, help="Execution engine of the fixed step solvers")
+@click.option("--samples", type=int, default=2000, show_default=True, help="Number of recorded states of a fixed step run, on which the drifts are measured")
+@click.option("--jobs", "-j", type=int, default=1, show_default=True, help="Number of worker processes (one run per task). Keep it below the number of cores for the wall times to be comparable")
+@click.option("--budget", type=float, default=None, help="Largest relative energy drift allowed => print the cheapest configuration meeting it")
+@click.option("--csv", "csv_path", type=click.Path(dir_okay=False), default=None, help="Save the results in this CSV file")
+@click.option("--json", "json_path", type=click.Path(dir_okay=False), default=None, help="Save the results in this JSON file")
+@click.option("--plot", "plot_path", type=click.Path(dir_okay=False), default=None, help="Save the work-precision diagram in this file (.png, .pdf,...)")
+def main(system, solver, dt, horizons, tolerance, backend, samples, jobs, budget, csv_path, json_path, plot_path):
+  body_sets = {name: preset_bodies(PRESETS[name]) for name in system}
+  cells = sweep_cells(body_sets, horizons, solver, dt, tolerance, backend=backend, samples=samples)
+
+  print(f"{'system':<26} {'years':>8} {'solver':<18} {'dt':>7} {'tol':>7} {'steps':>9} {'time [s]':>9} {'steps/s':>11} {'energy':>12} {'ang. mom.':>12}")
+  rows = run_sweep(cells, jobs=jobs)
+  for row in rows:
+    print(format_row(row))
+
+  if budget is not None:
+    print(f"\ncheapest configuration with a relative energy drift <= {budget:g}")
+    for ((bodies, horizon), row) in cheapest(rows, budget).items():
+      print(format_row(row) if row is not None else f"{bodies:<26} {horizon:>8g} none")
+
+  if csv_path is not None:
+    write_csv(rows, csv_path)
+
+  if json_path is not None:
+    write_json(rows, json_path,
+      commit=git_commit(),
+      date=time.strftime("%Y-%m-%dT%H:%M:%S"),
+      python=sys.version.split()[0],
+      platform=platform.platform(),
+      jobs=jobs,
+      samples=samples,
+      budget=budget
+    )
+
+  if plot_path is not None:
+    plot_work_precision(rows, plot_path)
+
+if __name__ == "__main__":
+  main()
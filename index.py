@@ -1,12 +1,17 @@
 #!/usr/bin/env python3.9
+import os
 import click
 from click.decorators import option
 from click.types import Choice
 import matplotlib.pyplot as plt
 import pyfiglet # ascii art
 
-from src.nbody import NBodySimulation
-from src.body import Body
+from src.nbody import (NBodySimulation, DEFAULT_SCHEMES)
+from src.body import (Body, main_belt)
+from src.cache import (ResultCache, DEFAULT_CACHE_DIR)
+from src.render import (FIGURES, render_figures)
+from src.encounters import CENTRAL_RADIUS
+from src.solvers import wisdom_holman_applies
 
 from consts import (sun_position0, sun_impulsion0, jupiter_position0, earth_position0, jupiter_impulsion0, saturn_position0, saturn_impulsion0, earth_impulsion0, M_sun, M_jup, M_sat, M_earth)
 from consts import (t0, tN, dt)
@@ -51,10 +56,18 @@ bodies = {
 )
 @click.option(
   "--solver", "-s",
-  type=click.Choice(["heun", "euler-symplectic", "stormer-verlet"]),
+  type=click.Choice(["heun", "euler-symplectic", "stormer-verlet", "yoshida-4", "yoshida-6", "forest-ruth", "wisdom-holman", "dormand-prince"]),
   default="stormer-verlet",
   show_default=True,
-  help="Only needed for animation. Type of numerical scheme. Euler symplectic and Stormer-Verlet are symplectic schemes. For static plot, all the scheme are used at once to compute 4 subplots."
+  help="Only needed for animation. Type of numerical scheme. Euler symplectic, Stormer-Verlet, the Yoshida / Forest-Ruth compositions (4th and 6th order) and Wisdom-Holman (Sun must be the first body) are symplectic schemes, Dormand-Prince 5(4) adapts its time step to --tolerance. For static plot, see --schemes."
+)
+@click.option(
+  "--schemes", "-sc",
+  type=click.Choice(["heun", "euler-symplectic", "stormer-verlet", "yoshida-4", "yoshida-6", "forest-ruth", "wisdom-holman", "dormand-prince"]),
+  multiple=True,
+  default=DEFAULT_SCHEMES,
+  show_default=True,
+  help="Only for static plot. Schemes used at once to compute one subplot each. You can add multiple schemes typing multiples -sc (wisdom-holman is skipped if the Sun is not the first body)"
 )
 @click.option(
   "--time", "-t",
@@ -62,45 +75,271 @@ bodies = {
   multiple=True,
   default=[5000],
   show_default=True,
-  help="Time of integration (in years). You can add multiples times typing multiples -t"
+  help="Time of integration (in years). You can add multiples times typing multiples -t (only the longest one is integrated)"
+)
+@click.option(
+  "--dt",
+  "time_step",
+  type=float,
+  default=dt,
+  show_default=True,
+  help="Time step (in days). Wisdom-Holman allows a sizeable fraction of the shortest orbital period"
 )
 @click.option(
   "--save", "-sa",
   is_flag=True,
   help="Save plot or animation"
 )
-def main(body, dimensions, plot, solver, time, save):
+@click.option(
+  "--record-every", "-re",
+  type=click.IntRange(min=1),
+  default=1,
+  show_default=True,
+  help="Only store one time step out of N (the integration still runs at dt)"
+)
+@click.option(
+  "--samples", "-n",
+  type=click.IntRange(min=2),
+  default=None,
+  help="Number of states to store over the whole integration. Overrides --record-every"
+)
+@click.option(
+  "--output-dir", "-o",
+  type=click.Path(file_okay=False),
+  default=None,
+  help="Stream the trajectories to this folder (.npy memmaps + metadata.json) instead of keeping them in memory"
+)
+@click.option(
+  "--diagnostics-every", "-de",
+  type=click.IntRange(min=1),
+  default=1,
+  show_default=True,
+  help="Only compute energy, angular momentum and area swept on one stored state out of N"
+)
+@click.option(
+  "--jobs", "-j",
+  type=click.IntRange(min=1),
+  default=1,
+  show_default=True,
+  help="Only for static plot. Number of worker processes running the schemes concurrently"
+)
+@click.option(
+  "--force", "-f",
+  type=click.Choice(["direct", "barnes-hut"]),
+  default="direct",
+  show_default=True,
+  help="Force engine: exact all-pairs forces or Barnes-Hut octree (O(N log N), for many bodies)"
+)
+@click.option(
+  "--theta",
+  type=float,
+  default=0.5,
+  show_default=True,
+  help="Only for Barnes-Hut. Opening angle of the octree (0 gives exact forces)"
+)
+@click.option(
+  "--backend", "-b",
+  type=click.Choice(["numpy", "numba"]),
+  default="numpy",
+  show_default=True,
+  help="Backend running the step loops. numba (optional dependency) JIT-compiles them, falls back to numpy if not installed"
+)
+@click.option(
+  "--checkpoint-every", "-ce",
+  type=click.IntRange(min=1),
+  default=4096,
+  show_default=True,
+  help="Only with --output-dir. Number of stored states between two flushes to disk and checkpoints of the solver state"
+)
+@click.option(
+  "--resume",
+  is_flag=True,
+  help="Only with --output-dir. Continue the runs from their last checkpoint (same options needed), the trajectory is the same as an uninterrupted run"
+)
+@click.option(
+  "--no-cache",
+  is_flag=True,
+  help="Always integrate, without reading or storing results in the cache (~/.cache/celestial-mechanics)"
+)
+@click.option(
+  "--clear-cache",
+  is_flag=True,
+  help="Empty the cache of results before running"
+)
+@click.option(
+  "--cache-size",
+  type=click.IntRange(min=0),
+  default=2048,
+  show_default=True,
+  help="Size cap of the cache (in MB), the least recently used results are evicted first"
+)
+@click.option(
+  "--batch",
+  is_flag=True,
+  help="Render the static figures of every --time without displaying them, over --jobs worker processes, into slides/figures and report/figures"
+)
+@click.option(
+  "--figure", "-fg",
+  type=click.Choice(list(FIGURES)),
+  multiple=True,
+  default=list(FIGURES),
+  show_default=True,
+  help="Only for --batch. Figures to render. You can add multiple figures typing multiples -fg"
+)
+@click.option(
+  "--tolerance", "-tol",
+  type=float,
+  default=1e-10,
+  show_default=True,
+  help="Only for Dormand-Prince. Relative local error allowed per step (--dt is then only the initial time step)"
+)
+@click.option(
+  "--storage-dtype",
+  type=click.Choice(["float64", "float32"]),
+  default="float64",
+  show_default=True,
+  help="Precision of the stored trajectories, the solvers always integrate in float64. float32 halves the memory and disk used, the energy, angular momentum and area swept being then computed in full precision during the integration"
+)
+@click.option(
+  "--profile",
+  is_flag=True,
+  help="Print the time spent in each phase of the solver loops (forces, stores, flushes, diagnostics), the step rate and the memory high-water mark of each run (long runs also print their progress every few seconds)"
+)
+@click.option(
+  "--asteroids", "-a",
+  type=click.IntRange(min=0),
+  default=0,
+  show_default=True,
+  help="Number of massless test particles (main asteroid belt, 2.1 to 3.3 AU from the Sun) following the bodies. They are attracted by the bodies but do not attract anything: each step costs bodies x particles force terms, so that 10000 particles make a run of the Sun, Jupiter and Saturn 40 to 60 times slower. Only their last positions are plotted, they are not animated"
+)
+@click.option(
+  "--asteroids-every", "-ae",
+  type=click.IntRange(min=0),
+  default=0,
+  show_default=True,
+  help="Store the test particles on one stored state out of N (0: only their last state, their history taking particles x 6 values per stored state). Needed to plot them at the shorter horizons of --batch"
+)
+@click.option(
+  "--encounters",
+  type=click.Choice(["record", "stop", "refine"]),
+  default=None,
+  help="Only for static plot. Check the close encounters (distance below the Hill radius of a body) after each step and print them. Then either go on (record), stop the run at the next stored state (stop) or redo the steps spent in an encounter in smaller steps (refine, fixed step schemes)"
+)
+@click.option(
+  "--encounter-radius",
+  type=click.FloatRange(min=0, min_open=True),
+  default=None,
+  help="Only with --encounters. Encounter distance of every body (in AU) instead of their Hill radius"
+)
+@click.option(
+  "--hill-factor",
+  type=click.FloatRange(min=0, min_open=True),
+  default=1.,
+  show_default=True,
+  help="Only with --encounters. Encounter distance in Hill radii"
+)
+@click.option(
+  "--central-radius",
+  type=click.FloatRange(min=0, min_open=True),
+  default=CENTRAL_RADIUS,
+  show_default=True,
+  help="Only with --encounters, without --encounter-radius. Encounter distance of the first body (in AU), which has no Hill radius: a test particle passing closer is a sun-grazer"
+)
+@click.option(
+  "--encounter-substeps",
+  type=click.IntRange(min=1),
+  default=10,
+  show_default=True,
+  help="Only with --encounters refine. Number of smaller steps of a step spent in an encounter"
+)
+@click.option(
+  "--events", "-ev",
+  type=click.Choice(["apsides", "conjunctions", "nodes"]),
+  multiple=True,
+  help="Only for static plot. Events found while the runs stream and printed: perihelion / aphelion passages (apsides) and crossings of the reference plane (nodes) of each body around the first one, conjunctions / oppositions of each pair of bodies. Their times are refined between the time steps. With --output-dir, they are also written to events.csv as they are found. You can add multiple events typing multiples -ev"
+)
+@click.option(
+  "--events-only",
+  is_flag=True,
+  help="Only with --events. Do not store the trajectories (only the initial and final states) nor plot them: constant memory whatever the number of steps"
+)
+def main(body, dimensions, plot, solver, schemes, time, time_step, save, record_every, samples, output_dir, diagnostics_every, jobs, force, theta, backend, checkpoint_every, resume, no_cache, clear_cache, cache_size, batch, figure, tolerance, storage_dtype, profile, asteroids, asteroids_every, encounters, encounter_radius, hill_factor, central_radius, encounter_substeps, events, events_only):
+  if resume and output_dir is None:
+    raise click.UsageError("--resume needs the --output-dir of the interrupted runs")
+  if events_only and not events:
+    raise click.UsageError("--events-only needs the --events to find")
+
+  if batch:
+    # no display needed
+    plt.switch_backend("Agg")
+
+  if clear_cache:
+    ResultCache(DEFAULT_CACHE_DIR).clear()
+
   # clear terminal (even history)
   print('\033c', end=None)
   # ascii art - for fun.
   print(pyfiglet.print_figlet("CELESTIAL"))
 
-  options = {"save": save}
-
   # possibility to perform multiple simulations
-  # if multiples times given
-  for t in time:
-    nbody = NBodySimulation(
-      bodies=[bodies[b] for b in body],
-      t0=t0,
-      tN=t * 365.25,
-      dt=dt,
-      options=options
-    )
-
-    if plot == "static":
-      nbody.simulate()
-
-      if dimensions == 2:
-        nbody.plot2D()
-      elif dimensions == 3:
-        nbody.plot3D()
-
-      nbody.plot_energy()
-      nbody.plot_angular_momentum()
-      nbody.plot_area_swept()
-    elif plot == "animated":
-      nbody.animate(solver)
+  # if multiples times given: the shorter ones are the beginning of the longest one,
+  # which is the only one integrated
+  times = sorted(set(time), reverse=True)
+
+  options = {"save": save, "record_every": record_every, "samples": samples, "output_dir": None, "diagnostics_every": diagnostics_every, "jobs": jobs, "force": force, "theta": theta, "backend": backend, "checkpoint_every": checkpoint_every, "resume": resume, "tolerance": tolerance, "storage_dtype": storage_dtype, "profile": profile,
+    "encounters": encounters, "encounter_radius": encounter_radius, "hill_factor": hill_factor, "central_radius": central_radius, "encounter_substeps": encounter_substeps,
+    "events": list(events), "schemes": list(schemes), "particles_every": asteroids_every,
+    "cache_dir": None if no_cache else DEFAULT_CACHE_DIR, "cache_size": cache_size * 1024 ** 2}
+  if output_dir is not None:
+    options["output_dir"] = os.path.join(output_dir, f"{times[0]}_years")
+  if batch:
+    options.update({"batch": True, "save": True, "report": True})
+  if events_only:
+    options["samples"] = 2
+
+  simulation = NBodySimulation(
+    bodies=[bodies[b] for b in body] + main_belt(asteroids, central=Sun),
+    t0=t0,
+    tN=times[0] * 365.25,
+    dt=time_step,
+    options=options
+  )
+
+  if plot == "animated" and not (batch or events_only) and solver == "wisdom-holman" and not wisdom_holman_applies(simulation.bodies):
+    raise click.UsageError("--solver wisdom-holman needs the first body (-cb) to hold most of the mass of the system, e.g. -cb Sun first")
+
+  if plot == "static" or batch or events_only:
+    simulation.simulate()
+
+    if simulation.encounter_report() is not None:
+      print(simulation.encounter_report())
+    if simulation.event_report() is not None:
+      print(simulation.event_report())
+
+  if events_only:
+    # no trajectory to plot
+    pass
+  elif batch:
+    render_figures(simulation, times=[t * 365.25 for t in times], figures=figure, jobs=jobs)
+  else:
+    for t in times:
+      nbody = simulation if t == times[0] else simulation.horizon(t * 365.25)
+
+      if plot == "static":
+        if dimensions == 2:
+          nbody.plot2D()
+        elif dimensions == 3:
+          nbody.plot3D()
+
+        nbody.plot_energy()
+        nbody.plot_angular_momentum()
+        nbody.plot_area_swept()
+      elif plot == "animated":
+        nbody.animate(solver)
+
+  # runs timed (results read from the cache are not)
+  if profile and simulation.profile_report() is not None:
+    print(simulation.profile_report())
 
 if __name__ == "__main__":
   main()
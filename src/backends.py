@@ -0,0 +1,184 @@
+import warnings
+import numpy as np
+
+from consts import G
+from .edo import (n_body_dqdt, n_body_dpdt)
+from .hooks import RunHooks
+
+# numba is an optional dependency: without it, the compiled backend
+# transparently falls back to the reference one.
+try:
+  import numba
+except ImportError:
+  numba = None
+
+class NumpyBackend():
+  """
+  Reference backend: the solvers of src/solvers.py (Python loop, NumPy kernels).
+  """
+  name = "numpy"
+  available = True
+
+  def run(self, solver, dqdt, dpdt, q, p, dt, nt, bodies, record_every=1, hooks=None):
+    """
+    :param hooks: hooks of the run (hooks.RunHooks), see solvers.integrate
+    """
+    return solver(dqdt=dqdt, dpdt=dpdt, q=q, p=p, dt=dt, nt=nt, bodies=bodies, record_every=record_every, hooks=hooks)
+
+# index of each scheme in the compiled step loop
+COMPILED_SCHEMES = {"heun": 0, "euler_symp": 1, "stormer_verlet": 2}
+
+class NumbaBackend(NumpyBackend):
+  """
+  Compiled backend: the whole step loop of heun, euler_symp and stormer_verlet,
+  force evaluation included, is JIT-compiled with numba.
+  The loop runs in chunks of records, between which the recorded states are copied
+  to the output arrays (and flushed to the sink if any).
+
+  Only the direct kernels (n_body_dqdt, n_body_dpdt) on a single system are compiled:
+  other schemes, force engines, ensembles, systems with test particles or runs checking close encounters or events go through the reference solvers.
+  """
+  name = "numba"
+  available = numba is not None
+  chunk_size = 4096
+
+  def run(self, solver, dqdt, dpdt, q, p, dt, nt, bodies, record_every=1, hooks=None):
+    hooks = hooks if hooks is not None else RunHooks()
+    scheme = COMPILED_SCHEMES.get(solver.__name__)
+    if scheme is None or dqdt is not n_body_dqdt or dpdt is not n_body_dpdt or q.ndim != 2 or hooks.particles is not None or hooks.watched:
+      return super().run(solver, dqdt, dpdt, q, p, dt, nt, bodies, record_every, hooks)
+    sink, metrics, recorder = hooks.sink, hooks.metrics, hooks.recorder
+
+    masses = bodies.masses
+    # full precision initial state (q[0], p[0] are down-cast when stored in float32)
+    q0, p0 = (recorder.q0, recorder.p0) if recorder is not None else (q[0], p[0])
+    # k => number of steps qk, pk are advanced by
+    qk, pk, first, k = np.array(q0, dtype=np.float64), np.array(p0, dtype=np.float64), 1, 0
+    if sink is not None and sink.checkpoint is not None:
+      # resume an interrupted run from its last checkpoint
+      qk, pk, first, k = np.array(sink.checkpoint["q"]), np.array(sink.checkpoint["p"]), sink.checkpoint["n_written"], sink.checkpoint["step"]
+      if recorder is not None:
+        recorder.resume(first, qk)
+    k0 = k
+
+    n_records = len(q)
+    chunk_size = sink.chunk_size if sink is not None else self.chunk_size
+    q_buffer = np.empty((chunk_size, q.shape[1]))
+    p_buffer = np.empty((chunk_size, p.shape[1]))
+
+    def store(start, stop):
+      if recorder is not None:
+        # diagnostics of the chunk before the down-cast
+        recorder.record_chunk(start, q_buffer[:stop - start], p_buffer[:stop - start])
+      q[start:stop] = q_buffer[:stop - start]
+      p[start:stop] = p_buffer[:stop - start]
+
+    loop = compiled_loop
+    flush = sink.flush if sink is not None else None
+    if metrics is not None:
+      # the compiled loop is timed as a whole (forces included)
+      loop, store = metrics.timed("compiled loop", loop), metrics.timed("store", store)
+      flush = metrics.timed("flush", flush) if sink is not None else None
+      metrics.start()
+
+    for start in range(first, n_records, chunk_size):
+      stop = min(start + chunk_size, n_records)
+      # qk, pk are advanced in place
+      loop(scheme, qk, pk, masses, G, dt, record_every, q_buffer[:stop - start], p_buffer[:stop - start])
+      store(start, stop)
+      k = (stop - 1) * record_every
+
+      if sink is not None:
+        flush(stop, state=(k, qk, pk))
+      if metrics is not None:
+        metrics.progress((stop - first) * record_every)
+
+    if k < nt - 1:
+      # steps after the last recorded state (nt - 1 not a multiple of record_every), not stored:
+      # the final checkpoint holds the state at step nt - 1, as the one of solvers.integrate
+      loop(scheme, qk, pk, masses, G, dt, nt - 1 - k, q_buffer[:1], p_buffer[:1])
+      k = nt - 1
+
+    if recorder is not None:
+      recorder.flush()
+    if sink is not None:
+      flush(n_records, state=(k, qk, pk))
+    if metrics is not None:
+      metrics.stop(k - k0)
+
+    return q, p
+
+if numba is not None:
+  @numba.njit(cache=True)
+  def compiled_dpdt(qk, masses, G, dpdt):
+    n = masses.shape[0]
+    dpdt[:] = 0.
+    for i in range(n):
+      for j in range(i + 1, n):
+        dx = qk[3 * i] - qk[3 * j]
+        dy = qk[3 * i + 1] - qk[3 * j + 1]
+        dz = qk[3 * i + 2] - qk[3 * j + 2]
+        r2 = dx * dx + dy * dy + dz * dz
+        w = G * masses[i] * masses[j] / (r2 * np.sqrt(r2))
+
+        # Newton's third law
+        dpdt[3 * i] -= w * dx
+        dpdt[3 * i + 1] -= w * dy
+        dpdt[3 * i + 2] -= w * dz
+        dpdt[3 * j] += w * dx
+        dpdt[3 * j + 1] += w * dy
+        dpdt[3 * j + 2] += w * dz
+
+  @numba.njit(cache=True)
+  def compiled_loop(scheme, qk, pk, masses, G, dt, record_every, q_out, p_out):
+    n = masses.shape[0]
+    inv_mass = np.empty(3 * n)
+    for i in range(n):
+      inv_mass[3 * i:3 * i + 3] = 1. / masses[i]
+    dpdt = np.empty(3 * n)
+
+    for j in range(q_out.shape[0]):
+      for _ in range(record_every):
+        if scheme == 0:
+          # heun (see solvers.heun_step: both rk2 stages are equal for a separable hamiltonian)
+          compiled_dpdt(qk, masses, G, dpdt)
+          for k in range(3 * n):
+            qk[k] += dt * pk[k] * inv_mass[k]
+            pk[k] += dt * dpdt[k]
+        elif scheme == 1:
+          # symplectic euler
+          compiled_dpdt(qk, masses, G, dpdt)
+          for k in range(3 * n):
+            pk[k] += dt * dpdt[k]
+            qk[k] += dt * pk[k] * inv_mass[k]
+        else:
+          # stormer-verlet
+          compiled_dpdt(qk, masses, G, dpdt)
+          for k in range(3 * n):
+            pk[k] += (dt / 2) * dpdt[k]
+            qk[k] += dt * pk[k] * inv_mass[k]
+          compiled_dpdt(qk, masses, G, dpdt)
+          for k in range(3 * n):
+            pk[k] += (dt / 2) * dpdt[k]
+
+      q_out[j] = qk
+      p_out[j] = pk
+
+BACKENDS = {}
+
+def register_backend(backend):
+  BACKENDS[backend.name] = backend
+
+def get_backend(name):
+  """
+  :param name: name of a registered backend ("numpy", "numba",...)
+  :return: that backend, or the reference numpy backend if it cannot run here
+  """
+  backend = BACKENDS[name]
+  if not backend.available:
+    warnings.warn(f"the {name} backend is not available (missing dependency), falling back to the numpy backend")
+    return BACKENDS["numpy"]
+  return backend
+
+register_backend(NumpyBackend())
+register_backend(NumbaBackend())
@@ -1,4 +1,8 @@
 import numpy as np
+from functools import cached_property
+
+from .kepler import jacobi_matrices
+from consts import G
 
 class Body():
   """
@@ -14,3 +18,153 @@ class Body():
     self.markersize = markersize
 
     self.color = color
+
+class TestParticle():
+  """
+  Massless particle (asteroid, comet,...) in cartesian coordinates:
+  attracted by the bodies, it does not attract them (nor the other particles).
+  """
+  def __init__(self, name, initial_positions, initial_velocities, color="gray", markersize=1):
+    self.name = name
+    self.initial_positions = np.array(initial_positions)
+    # no mass => velocities instead of impulsions
+    self.initial_velocities = np.array(initial_velocities)
+    self.markersize = markersize # size of the point of the particle (static plot)
+
+    self.color = color
+
+def main_belt(n, central, inner=2.1, outer=3.3, max_inclination=0.2, seed=0):
+  """
+  Test particles on circular orbits around a central body, uniformly spread in semi-major axis
+  (main asteroid belt by default) with small random inclinations.
+
+  :param n: number of particles
+  :param central: central body (Body, e.g. the Sun)
+  :param inner, outer: range of the semi-major axes (in AU)
+  :param max_inclination: largest inclination (in radians)
+  :return: list of TestParticle
+  """
+  rng = np.random.default_rng(seed)
+  a = rng.uniform(inner, outer, n)
+  # argument of latitude, longitude of the ascending node and inclination
+  u = rng.uniform(0, 2 * np.pi, n)
+  node = rng.uniform(0, 2 * np.pi, n)
+  inclination = rng.uniform(0, max_inclination, n)
+
+  # unit vectors of the position and of the (circular) velocity
+  cos_u, sin_u, cos_node, sin_node, cos_i, sin_i = np.cos(u), np.sin(u), np.cos(node), np.sin(node), np.cos(inclination), np.sin(inclination)
+  radial = np.stack([cos_node * cos_u - sin_node * sin_u * cos_i, sin_node * cos_u + cos_node * sin_u * cos_i, sin_u * sin_i], axis=1)
+  tangential = np.stack([- cos_node * sin_u - sin_node * cos_u * cos_i, - sin_node * sin_u + cos_node * cos_u * cos_i, cos_u * sin_i], axis=1)
+
+  positions = central.initial_positions + a[:, np.newaxis] * radial
+  velocities = central.initial_impulsions / central.mass + np.sqrt(G * central.mass / a)[:, np.newaxis] * tangential
+  return [TestParticle(name=f"particle-{i}", initial_positions=positions[i], initial_velocities=velocities[i]) for i in range(n)]
+
+class BodySystem():
+  """
+  Set of bodies as contiguous arrays (structure of arrays), built once from a list of Body.
+  The kernels and the solvers take it instead of the list of Body,
+  so that no attribute of a Body is looked up during a step.
+
+  Test particles of the list are kept apart (particle_* arrays): they are not counted in len()
+  and do not take part in the masses, the pairs or the Jacobi coordinates of the bodies.
+  In the state vectors of the solvers, they follow the bodies => [x1,..., zN, xN+1,..., zN+M],
+  their impulsions being their velocities.
+  """
+  def __init__(self, bodies):
+    """
+    :param bodies: list of Body (and TestParticle)
+    """
+    particles = [body for body in bodies if isinstance(body, TestParticle)]
+    bodies = [body for body in bodies if not isinstance(body, TestParticle)]
+
+    self.names = [body.name for body in bodies]
+    # plot styles
+    self.colors = [body.color for body in bodies]
+    self.markers = [body.marker for body in bodies]
+    self.markers_anim = [body.marker_anim for body in bodies]
+    self.markersizes = [body.markersize for body in bodies]
+
+    self.masses = np.array([body.mass for body in bodies], dtype=np.float64)
+    self.inverse_masses = 1 / self.masses
+    # one per coordinate of the state vector [x1, y1, z1,..., xN, yN, zN]
+    self.coordinate_inverse_masses = np.repeat(self.inverse_masses, 3)
+    self.total_mass = np.sum(self.masses)
+
+    # initial conditions, shape (N, 3)
+    self.initial_positions = np.array([body.initial_positions for body in bodies], dtype=np.float64).reshape([-1, 3])
+    self.initial_impulsions = np.array([body.initial_impulsions for body in bodies], dtype=np.float64).reshape([-1, 3])
+
+    # test particles, shape (M, 3)
+    self.n_particles = len(particles)
+    self.particle_names = [particle.name for particle in particles]
+    self.particle_colors = [particle.color for particle in particles]
+    self.particle_markersizes = [particle.markersize for particle in particles]
+    self.particle_positions = np.array([particle.initial_positions for particle in particles], dtype=np.float64).reshape([-1, 3])
+    self.particle_velocities = np.array([particle.initial_velocities for particle in particles], dtype=np.float64).reshape([-1, 3])
+
+  def __len__(self):
+    return len(self.masses)
+
+  def to_barycentric_frame(self):
+    """
+    Shift the initial conditions so that the barycenter is at rest at the origin
+    (barycenter of the bodies only, the test particles being massless).
+
+    :return: position and velocity of the barycenter in the original frame
+    :rtype: (ndarray, ndarray)
+    """
+    mean_pos = self.masses @ self.initial_positions / self.total_mass
+    mean_vel = np.sum(self.initial_impulsions, axis=0) / self.total_mass
+
+    self.initial_positions -= mean_pos
+    self.initial_impulsions -= self.masses[:, np.newaxis] * mean_vel
+    self.particle_positions -= mean_pos
+    self.particle_velocities -= mean_vel
+    return mean_pos, mean_vel
+
+  @property
+  def q0(self):
+    """
+    :return: initial position state vector [x1, y1, z1,..., xN, yN, zN]
+    """
+    return self.initial_positions.flatten()
+
+  @property
+  def p0(self):
+    """
+    :return: initial impulsion state vector [px1, py1, pz1,..., pxN, pyN, pzN]
+    """
+    return self.initial_impulsions.flatten()
+
+  @property
+  def particles_q0(self):
+    """
+    :return: initial positions of the test particles, following the bodies in the state vector
+    """
+    return self.particle_positions.flatten()
+
+  @property
+  def particles_p0(self):
+    """
+    :return: initial velocities of the test particles, following the bodies in the state vector
+    """
+    return self.particle_velocities.flatten()
+
+  @cached_property
+  def pairs(self):
+    """
+    Pairs (i, j) with i < j and G m_i m_j of each pair
+    (computed on first use: O(N^2) memory, not needed by the Barnes-Hut engine).
+
+    :rtype: (ndarray, ndarray, ndarray)
+    """
+    i, j = np.triu_indices(len(self), k=1)
+    return i, j, G * self.masses[i] * self.masses[j]
+
+  @cached_property
+  def jacobi(self):
+    """
+    Jacobi coordinates of the system (see kepler.jacobi_matrices), the first body being the central mass.
+    """
+    return jacobi_matrices(tuple(self.masses))
@@ -0,0 +1,107 @@
+import os
+import json
+import shutil
+import hashlib
+
+from .storage import (load_trajectory, write_trajectory)
+
+# bump when the layout of the entries (or what they hold) changes
+CACHE_VERSION = 1
+
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "celestial-mechanics")
+
+class ResultCache():
+  """
+  Content-addressed on-disk cache of simulation results.
+
+  Each entry is a folder named after the hash of the configuration that produced it
+  (initial conditions, masses, G, dt, t0, tN, solver,...) and laid out as a TrajectorySink
+  (one .npy per array + metadata.json), so that a cached result is read back as memmaps.
+  The total size is capped: the least recently used entries are evicted first.
+  """
+  def __init__(self, directory=DEFAULT_CACHE_DIR, max_size=2 * 1024 ** 3):
+    """
+    :param directory: folder of the cache (created if it does not exist)
+    :param max_size: size cap of the cache (in bytes)
+    """
+    os.makedirs(directory, exist_ok=True)
+    self.directory = directory
+    self.max_size = max_size
+
+  @staticmethod
+  def key(config):
+    """
+    :param config: json serializable description of what produced the result
+    (floats are serialized with their shortest exact representation)
+    :return: hash of the configuration
+    :rtype: str
+    """
+    config = json.dumps({"version": CACHE_VERSION, **config}, sort_keys=True)
+    return hashlib.sha256(config.encode()).hexdigest()
+
+  def get(self, key):
+    """
+    :return: read-only memmaps of the arrays of the entry, None if it is not cached
+    :rtype: dict
+    """
+    entry = os.path.join(self.directory, key)
+    if not os.path.isfile(os.path.join(entry, "metadata.json")):
+      return None
+
+    # mark the entry as recently used
+    os.utime(entry)
+    metadata, arrays = load_trajectory(entry)
+    return arrays
+
+  def put(self, key, arrays, metadata):
+    """
+    Store the arrays of a result (all of the same length), then evict the least recently used entries
+    if the cache exceeds its size cap.
+
+    :param arrays: {"q": ..., "p": ..., "energy": ...}
+    """
+    entry = os.path.join(self.directory, key)
+    if os.path.isdir(entry):
+      return
+
+    # written aside then renamed, so that a reader never sees a partial entry
+    tmp = f"{entry}.tmp-{os.getpid()}"
+    write_trajectory(tmp, arrays, metadata)
+    try:
+      os.rename(tmp, entry)
+    except OSError:
+      # stored meanwhile by another process
+      shutil.rmtree(tmp, ignore_errors=True)
+
+    self.evict(keep=key)
+
+  def entries(self):
+    """
+    :return: key, size (in bytes) and last use of each entry, least recently used first
+    :rtype: list
+    """
+    entries = []
+    for key in os.listdir(self.directory):
+      entry = os.path.join(self.directory, key)
+      if ".tmp-" in key or not os.path.isdir(entry):
+        continue
+      size = sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+      entries.append((key, size, os.stat(entry).st_mtime))
+
+    return sorted(entries, key=lambda entry: entry[2])
+
+  def evict(self, keep=None):
+    entries = self.entries()
+    total_size = sum(size for (key, size, last_use) in entries)
+
+    for (key, size, last_use) in entries:
+      if total_size <= self.max_size:
+        break
+      if key == keep:
+        continue
+      shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+      total_size -= size
+
+  def clear(self):
+    for key in os.listdir(self.directory):
+      shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
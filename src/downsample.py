@@ -0,0 +1,44 @@
+import numpy as np
+
+def minmax_downsample(x, y, n_buckets):
+  """
+  Min/max (M4) decimation of a time series: x is cut into n_buckets intervals of equal width
+  and only the first, last, lowest and highest points of each interval are kept.
+  With one interval per pixel column, the line drawn is the same as with all the points.
+
+  :param x: increasing abscissas (time), shape (n,)
+  :param y: values, shape (n,)
+  :param n_buckets: number of intervals (width of the plot in pixels)
+  :return: indices of the points kept
+  :rtype: ndarray
+  """
+  n = len(x)
+  if n <= 4 * n_buckets:
+    return np.arange(n)
+
+  span = max(x[-1] - x[0], np.finfo(float).tiny)
+  bucket = np.minimum(((x - x[0]) / span * n_buckets).astype(int), n_buckets - 1)
+
+  # x is increasing => the points of a bucket are contiguous
+  starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+  ends = np.r_[starts[1:], n] - 1
+
+  # sorted by bucket then by value => same bucket boundaries, lowest point first
+  order = np.lexsort((y, bucket))
+  return np.unique(np.concatenate([starts, ends, order[starts], order[ends]]))
+
+def pixel_downsample(points, pixel_size):
+  """
+  Decimation of a path (orbit): a point is dropped if it falls in the same pixel as the point before it,
+  which does not change the path drawn at that resolution. Slow bodies (Sun) or densely sampled paths
+  shrink to about one point per pixel crossed.
+
+  :param points: path, shape (n, d)
+  :param pixel_size: size of a pixel in data units (scalar or one per axis)
+  :return: indices of the points kept (first and last always kept)
+  :rtype: ndarray
+  """
+  cells = np.floor(np.asarray(points) / pixel_size).astype(np.int64)
+  keep = np.r_[True, np.any(cells[1:] != cells[:-1], axis=1)]
+  keep[-1] = True
+  return np.flatnonzero(keep)
@@ -3,131 +3,340 @@ from numpy import linalg
 from numpy.linalg.linalg import norm
 from consts import (M_sun as m1, M_jup as m2, M_sat as m3, G)
 
+# every kernel below works on a single state vector [x1, y1, z1,..., xN, yN, zN]
+# or on a stack of them (e.g. an ensemble of M systems: shape (M, 3N)),
+# the bodies always being along the last axis.
+
 """
 Compute total energy of the N-Body system.
 """
 def hamiltonian(qk, pk, bodies):
-  qk = qk.reshape([-1, 3])
-  pk = pk.reshape([-1, 3])
+  qk = qk.reshape(qk.shape[:-1] + (-1, 3))
+  pk = pk.reshape(pk.shape[:-1] + (-1, 3))
 
-  p_sum = 0
-  for i, pi in enumerate(pk):
-    p_sum += (pi ** 2) / 2 * bodies[i].mass
+  # kinetic energy: \sum_i ||p_i||^2 / 2 m_i
+  p_sum = np.sum(np.sum(pk ** 2, axis=-1) * bodies.inverse_masses, axis=-1) / 2
 
-  q_sum = 0
-  for i in range(len(bodies)):
-    for j in range(len(bodies)):
-      if i != j:
-        # compute distance between mass i and mass j
-        r_ij = r_dist(qk[i], qk[j])
-        q_sum += ((G * bodies[i].mass * bodies[j].mass) / r_ij)
+  # potential energy: - \sum_{i < j} G m_i m_j / r_ij
+  i, j, gmm = bodies.pairs
+  r_ij = np.linalg.norm(qk[..., i, :] - qk[..., j, :], axis=-1)
+  q_sum = - np.sum(gmm / r_ij, axis=-1)
 
   # return hamiltonian (= energy)
-  return np.linalg.norm(p_sum + q_sum)
+  return p_sum + q_sum
 
 """
-Compute total angular momentum of the N-Body system.
+Compute total angular momentum vector of the N-Body system.
 """
 def compute_angular_momentum(qk, pk, bodies):
-  qk = qk.reshape([-1, 3])
-  pk = pk.reshape([-1, 3])
+  qk = qk.reshape(qk.shape[:-1] + (-1, 3))
+  pk = pk.reshape(pk.shape[:-1] + (-1, 3))
 
-  Lk = np.zeros(3)
+  # L(t_j) = \sum_{i=1}^{N} r_i x p_i
+  return np.sum(np.cross(qk, pk), axis=-2)
 
-  L_sum = 0
-  # L(t_j) = \sum_{i=1}^{N} l_i(t_j)
-  for i in range(len(bodies)):
-    pi, qi = pk[i], qk[i]
-    vi = pi / bodies[i].mass
+def compute_area_swept(qk, pk, qk_next, pk_next, bodies):
+  """
+  Area swept by each body between two states (summed over the bodies).
+  The angle swept in the (x, y) plane is taken between the two position vectors, whatever their quadrants,
+  so that the states may be far apart (up to half an orbit).
+  """
+  qk = qk.reshape(qk.shape[:-1] + (-1, 3))
+  qk_next = qk_next.reshape(qk_next.shape[:-1] + (-1, 3))
 
-    rdotv = np.dot(qi, vi)
-    rnorm = np.linalg.norm(qi)
-    vnorm = np.linalg.norm(vi)
+  # \Delta \theta = tan^{-1}((r_1 x r_2)_z / (r_1 . r_2)) in ]-pi, pi]
+  cross = qk[..., 0] * qk_next[..., 1] - qk[..., 1] * qk_next[..., 0]
+  dot = qk[..., 0] * qk_next[..., 0] + qk[..., 1] * qk_next[..., 1]
+  dtheta = np.abs(np.arctan2(cross, dot))
 
-    # r \cdot v = ||r|| ||v|| \cos(\theta)
-    theta = np.arccos(rdotv / (rnorm * vnorm))
-    # L = r x mv = m ||r|| ||v|| \sin(\theta)
-    l = bodies[i].mass * rnorm * vnorm * np.sin(theta)
-    L_sum += l
-    #Lk[i] = L
+  # compute delta area between two successive points q[i] and q[i+1]
+  # \Delta A = (1/2) ||r_1|| ||r_2|| \Delta theta
+  darea = 0.5 * dtheta * (np.linalg.norm(qk, axis=-1) * np.linalg.norm(qk_next, axis=-1))
 
-  return L_sum #Lk
+  return np.sum(darea, axis=-1)
 
-def compute_area_swept(qk, pk, qk_next, pk_next, bodies):
-  qk = qk.reshape([-1, 3])
-  pk = pk.reshape([-1, 3])
+def compute_diagnostics(q, p, bodies, chunk_size=65536):
+  """
+  Energy, total angular momentum and total area swept along a stored trajectory.
+  The trajectory is processed block by block (vectorized inside a block)
+  so that a trajectory memmapped from disk is never fully loaded in memory.
+
+  :param q: positions, shape (n, ..., 3N) (the first axis being the time)
+  :param p: impulsions, same shape as q
+  :param bodies: system of bodies (BodySystem)
+
+  :return: energy (n, ...), angular momentum vector (n, ..., 3), area swept (n, ...)
+  :rtype: (ndarray, ndarray, ndarray)
+  """
+  n = len(q)
+  energy = np.zeros(q.shape[:-1])
+  angular_momentum = np.zeros(q.shape[:-1] + (3,))
+  # area swept between two successive states
+  darea = np.zeros(q.shape[:-1])
+
+  for start in range(0, n, chunk_size):
+    stop = min(start + chunk_size, n)
+    qc, pc = np.asarray(q[start:stop]), np.asarray(p[start:stop])
+
+    energy[start:stop] = hamiltonian(qc, pc, bodies)
+    angular_momentum[start:stop] = compute_angular_momentum(qc, pc, bodies)
+
+    lo = max(start, 1)
+    darea[lo:stop] = compute_area_swept(np.asarray(q[lo - 1:stop - 1]), None, np.asarray(q[lo:stop]), None, bodies)
+
+  return energy, angular_momentum, np.cumsum(darea, axis=0)
+
+def diagnostics_fields(n_records):
+  """
+  :return: name and shape of each diagnostic of a trajectory of n_records states
+  :rtype: dict
+  """
+  return {"energy": (n_records,), "angular_momentum": (n_records, 3), "area_swept": (n_records,)}
+
+def downcast_trajectory(q, p, bodies, dtype):
+  """
+  Down-cast a full precision trajectory (e.g. the output of an adaptive scheme) for storage,
+  its diagnostics being computed before.
+
+  :return: q, p in dtype and diagnostics => {"energy": ..., "angular_momentum": ..., "area_swept": ...}
+  :rtype: (ndarray, ndarray, dict)
+  """
+  energy, angular_momentum, area_swept = compute_diagnostics(q, p, bodies)
+  diagnostics = {"energy": energy, "angular_momentum": angular_momentum, "area_swept": area_swept}
+  return q.astype(dtype), p.astype(dtype), diagnostics
+
+class DiagnosticsRecorder():
+  """
+  Same diagnostics as compute_diagnostics, computed in full precision while the solver runs,
+  i.e. before the recorded states are down-cast into lower precision output arrays (float32 storage).
+  The states are buffered and processed `chunk_size` at a time by the vectorized kernels.
+
+  The solvers also start from its initial state, q[0] and p[0] being already down-cast.
+  """
+  def __init__(self, bodies, q0, p0, n_records, arrays=None, chunk_size=4096):
+    """
+    :param bodies: system of bodies (BodySystem)
+    :param q0, p0: full precision initial state (record 0)
+    :param n_records: number of recorded states
+    :param arrays: output arrays (e.g. the ones of a TrajectorySink) holding the fields of diagnostics_fields,
+    allocated in memory if None
+    """
+    self.bodies = bodies
+    self.q0, self.p0 = np.array(q0, dtype=np.float64), np.array(p0, dtype=np.float64)
+    if arrays is None:
+      arrays = {name: np.zeros(shape) for (name, shape) in diagnostics_fields(n_records).items()}
+    self.arrays = {name: arrays[name] for name in diagnostics_fields(n_records)}
+
+    self.q_buffer = np.empty((chunk_size, len(self.q0)))
+    self.p_buffer = np.empty((chunk_size, len(self.p0)))
+    # index of the first buffered record and number of buffered records
+    self.start = 0
+    self.count = 0
+
+    # last processed state and area swept up to it (area swept between two chunks)
+    self.previous = None
+    self.area = 0.
+
+    self.record(0, self.q0, self.p0)
 
-  qk_next = qk_next.reshape([-1, 3])
-  pk_next = pk_next.reshape([-1, 3])
+  def resume(self, j, qk):
+    """
+    Continue an interrupted run from record j, the state of record j - 1 being qk (full precision).
+    """
+    self.start, self.count = j, 0
+    self.previous = np.array(qk, dtype=np.float64)
+    self.area = self.arrays["area_swept"][j - 1]
 
-  darea_sum = 0
-  for i in range(len(bodies)):
-    pi, qi = pk[i], qk[i]
-    pi_next, qi_next = pk_next[i], qk_next[i]
+  def record(self, j, qk, pk):
+    if self.count == 0:
+      self.start = j
+    self.q_buffer[self.count] = qk
+    self.p_buffer[self.count] = pk
+    self.count += 1
 
-    # \theta = tan^{-1}(y / x)
-    theta = np.arctan(abs(qi[1] / qi[0]))
-    theta_next = np.arctan(abs(qi_next[1] / qi_next[0]))
+    if self.count == len(self.q_buffer):
+      self.flush()
 
-    # r_moyen = (1/2) * (ri_norm + rinext_norm)
-    #rmoy = 0.5 * (np.linalg.norm(qi) + np.linalg.norm(qi_next))
+  def record_chunk(self, start, q, p):
+    """
+    Record the consecutive states q, p (records start, start + 1,...) at once.
+    """
+    self.flush()
+    self.process(start, q, p)
 
-    dtheta = np.abs(theta - theta_next)
+  def flush(self):
+    if self.count:
+      self.process(self.start, self.q_buffer[:self.count], self.p_buffer[:self.count])
+      self.count = 0
 
-    # compute delta area between two successive points q[i] and q[i+1]
-    # \Delta A = (1/2) ||r_1|| ||r_2|| \Delta theta
-    darea = 0.5 * dtheta * (np.linalg.norm(qi) * np.linalg.norm(qi_next))
-    darea_sum += darea
+  def process(self, start, q, p):
+    stop = start + len(q)
+    self.arrays["energy"][start:stop] = hamiltonian(q, p, self.bodies)
+    self.arrays["angular_momentum"][start:stop] = compute_angular_momentum(q, p, self.bodies)
 
-  return darea_sum
+    # area swept between each state and the one before it (none before the initial state)
+    darea = np.zeros(len(q))
+    if self.previous is None:
+      if len(q) > 1:
+        darea[1:] = compute_area_swept(q[:-1], None, q[1:], None, self.bodies)
+    else:
+      darea[:] = compute_area_swept(np.concatenate([self.previous[np.newaxis], q[:-1]]), None, q, None, self.bodies)
 
+    self.arrays["area_swept"][start:stop] = self.area + np.cumsum(darea)
+    self.area = self.arrays["area_swept"][stop - 1]
+    self.previous = np.array(q[-1])
+
+def test_particle_records(n_records, every=0):
+  """
+  :param every: stride between two stored states of the test particles, in records (0: only the last state is kept)
+  :return: number of stored states of the test particles of a trajectory of n_records states
+  (records 0, every, 2 every,... or the last one only)
+  """
+  return (n_records - 1) // every + 1 if every else 1
+
+def test_particle_fields(n_records, n_particles, every=0):
+  """
+  :return: name and shape of the arrays of the test particles of a trajectory of n_records states (see test_particle_records)
+  :rtype: dict
+  """
+  n = test_particle_records(n_records, every)
+  return {"particles_q": (n, n_particles, 3), "particles_p": (n, n_particles, 3)}
+
+def split_test_particles(q, p, bodies, every=0):
+  """
+  Split states of the bodies followed by test particles (e.g. the output of an adaptive scheme).
+
+  :param every: stride between two kept states of the particles (0: only the last one)
+  :return: q, p of the bodies and positions / velocities of the particles => {"particles_q": ..., "particles_p": ...}
+  :rtype: (ndarray, ndarray, dict)
+  """
+  n = 3 * len(bodies)
+  kept = slice(None, None, every) if every else slice(-1, None)
+  particles = {"particles_q": q[kept, n:].reshape((-1, bodies.n_particles, 3)), "particles_p": p[kept, n:].reshape((-1, bodies.n_particles, 3))}
+  return q[..., :n], p[..., :n], particles
+
+class TestParticleRecorder():
+  """
+  Test particles of a system integrated along with its bodies: the solvers advance the state of the bodies
+  followed by the one of the particles, the recorder stores the particles in their own compact arrays
+  (positions and velocities, shape (n, M, 3)) and hands the state of the bodies to the output arrays q, p,
+  whose layout is thus the same with or without particles.
+
+  The history of the particles is large (M x 6 values per record): by default only their last recorded state is kept
+  (one state, overwritten at each record), their history being stored every `every` records on demand.
+  """
+  def __init__(self, bodies, n_records, arrays=None, dtype=np.float64, every=0):
+    """
+    :param bodies: system of bodies (BodySystem) with test particles
+    :param n_records: number of recorded states
+    :param arrays: output arrays (e.g. the ones of a TrajectorySink) holding the fields of test_particle_fields,
+    allocated in memory if None
+    :param dtype: dtype of the arrays allocated in memory
+    :param every: stride between two stored states of the particles, in records (0: only the last state is kept)
+    """
+    fields = test_particle_fields(n_records, bodies.n_particles, every)
+    if arrays is None:
+      arrays = {name: np.zeros(shape, dtype=dtype) for (name, shape) in fields.items()}
+    self.arrays = {name: arrays[name] for name in fields}
+    self.n = 3 * len(bodies)
+    self.every = every
+
+    self.q0, self.p0 = bodies.particles_q0, bodies.particles_p0
+    self.arrays["particles_q"][0] = bodies.particle_positions
+    self.arrays["particles_p"][0] = bodies.particle_velocities
+
+  def state(self, qk, pk):
+    """
+    :return: state of the bodies qk, pk followed by the initial state of the particles
+    """
+    return np.concatenate([qk, self.q0], axis=-1), np.concatenate([pk, self.p0], axis=-1)
+
+  def record(self, j, qk, pk):
+    """
+    Store the particles of the state of record j (if it is one of their stored states).
+
+    :return: state of the bodies
+    """
+    if not self.every or j % self.every == 0:
+      i = j // self.every if self.every else 0
+      self.arrays["particles_q"][i] = qk[self.n:].reshape([-1, 3])
+      self.arrays["particles_p"][i] = pk[self.n:].reshape([-1, 3])
+    return qk[:self.n], pk[:self.n]
 
 def n_body_dqdt(qk, pk, bodies):
   """
   :param qk: n-body position state vector => qk: [x1, y1, z1, x2, y2, z2,..., xN, yN, zN]
   :param pk: n-body impulsion state vector => pk: [px1, py1, pz1,..., pxN, pyN, pzN]
-  :param bodies: set of bodies (Sun, Jupiter,...)
+  :param bodies: system of bodies (Sun, Jupiter,...)
   :type q_state: ndarray
   :type p_state: ndarray
-  :type bodies: ndarray
+  :type bodies: BodySystem
 
   :return: \dot{q} = dh/dp
   :rtype: ndarray
   """
-  # reshape impulsions vector as a list of 3D vectors
-  pk = pk.reshape([-1, 3])
-  dqdt = np.zeros(pk.shape)
-  for i, pi in enumerate(pk):
-    dqdt[i] = pi / bodies[i].mass
+  n = 3 * len(bodies)
+  if pk.shape[-1] == n:
+    # p_i / m_i on the unstructured vector (one inverse mass per coordinate)
+    return pk * bodies.coordinate_inverse_masses
 
-  # return the unstructured array of the same shape as before
-  return dqdt.flatten()
+  # test particles after the bodies: their impulsions are their velocities
+  dqdt = pk.copy()
+  dqdt[..., :n] *= bodies.coordinate_inverse_masses
+  return dqdt
 
 def n_body_dpdt(qk, pk, bodies):
   """
   :param qk: n-body position state vector at k * dt time => qk: [x1, y1, z1, x2, y2, z2,..., xN, yN, zN]
   :param pk: n-body impulsion state vector at k * dt time => pk: [px1, py1, pz1,..., pxN, pyN, pzN]
-  :param bodies: set of bodies (Sun, Jupiter,...)
+  :param bodies: system of bodies (Sun, Jupiter,...)
   :type qk: ndarray
   :type pk: ndarray
-  :type bodies: ndarray
+  :type bodies: BodySystem
 
   :return: \dot{p} = - dh/dr => \dot{p} = [\dot{px1}, \dot{py2}, \dot{pz1},..., \dot{pxN}, \dot{pyN}, \dot{pzN}]
   :rtype: ndarray
   """
   # reshape positions vector as a list of 3D vectors
-  qk = qk.reshape([-1, 3])
-  dpdt = np.zeros(qk.shape)
-  # loop each body
-  for i in range(len(bodies)):
-    for j in range(len(bodies)):
-      if i != j:
-        # compute distance between mass i and mass j
-        r_ij = r_dist(qk[i], qk[j])
-        dpdt[i] -= ((G * bodies[i].mass * bodies[j].mass) / r_ij ** 3) * (qk[i] - qk[j])
+  qk = qk.reshape(qk.shape[:-1] + (-1, 3))
+  # test particles (if any) follow the bodies
+  particles = qk[..., len(bodies):, :]
+  qk = qk[..., :len(bodies), :]
+
+  # each pair (i, j) with i < j is evaluated once,
+  # the force on j is the opposite of the force on i (Newton's third law)
+  i, j, gmm = bodies.pairs
+  r_ij = qk[..., i, :] - qk[..., j, :]
+  inv_r3 = np.sum(r_ij ** 2, axis=-1) ** -1.5
+
+  # w_ij = G * m_i * m_j / r_ij^3 (symmetric, zero on the diagonal)
+  w = np.zeros(qk.shape[:-2] + (len(bodies), len(bodies)))
+  w[..., i, j] = gmm * inv_r3
+  w += np.swapaxes(w, -1, -2)
+
+  # \dot{p}_i = - \sum_j w_ij (q_i - q_j) = - (q_i \sum_j w_ij - \sum_j w_ij q_j)
+  dpdt = w @ qk - np.sum(w, axis=-1)[..., np.newaxis] * qk
+
+  if particles.shape[-2]:
+    dpdt = np.concatenate([dpdt, test_particle_accelerations(qk, particles, bodies)], axis=-2)
 
   # return unstructured array
-  return dpdt.flatten()
+  return dpdt.reshape(dpdt.shape[:-2] + (-1,))
+
+def test_particle_accelerations(qk, particles, bodies):
+  """
+  Accelerations of the test particles (= derivative of their velocities), as one (particles x bodies) block:
+  O(N M) instead of O((N + M)^2), the particles attracting nothing.
+
+  :param qk: positions of the bodies, shape (..., N, 3)
+  :param particles: positions of the test particles, shape (..., M, 3)
+  :return: accelerations, shape (..., M, 3)
+  """
+  # a_k = - \sum_i G m_i (x_k - q_i) / ||x_k - q_i||^3
+  d = particles[..., :, np.newaxis, :] - qk[..., np.newaxis, :, :]
+  r2 = np.einsum("...c,...c->...", d, d)
+  w = (G * bodies.masses) / (r2 * np.sqrt(r2))
+  return - np.einsum("...kn,...knc->...kc", w, d)
 
 def r_dist(ri, rj):
   """
@@ -0,0 +1,180 @@
+import numpy as np
+from consts import G
+
+# offsets of the 27 cells around (and including) a cell of the grid
+NEIGHBOUR_CELLS = np.array([(x, y, z) for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1)], dtype=np.int64)
+
+# encounter distance of the central mass (it has no Hill radius), in AU: about 3 solar radii (1 R_sun = 0.00465 AU)
+CENTRAL_RADIUS = 0.014
+
+def hill_radii(bodies):
+  """
+  Hill radius of each body around the first one (central mass): r_H = a (m / 3 M)^(1/3),
+  a being the semi-major axis of its initial two-body orbit (initial distance if unbound).
+  The central mass has none (0).
+
+  :param bodies: system of bodies (BodySystem)
+  :rtype: ndarray
+  """
+  masses = bodies.masses
+  r = bodies.initial_positions[1:] - bodies.initial_positions[0]
+  v = bodies.initial_impulsions[1:] * bodies.inverse_masses[1:, np.newaxis] - bodies.initial_impulsions[0] * bodies.inverse_masses[0]
+  mu = G * (masses[0] + masses[1:])
+
+  distance = np.linalg.norm(r, axis=1)
+  energy = np.sum(v ** 2, axis=1) / 2 - mu / distance
+  a = np.where(energy < 0, - mu / (2 * np.where(energy < 0, energy, -1.)), distance)
+
+  return np.concatenate([[0.], a * np.cbrt(masses[1:] / (3 * masses[0]))])
+
+def spatial_hash(cells):
+  """
+  Hash of integer cell coordinates (Teschner et al., 2003), shape (..., 3) => (...).
+  Different cells may share a hash: they only add candidates to the narrow phase.
+  """
+  return (cells[..., 0] * 73856093) ^ (cells[..., 1] * 19349663) ^ (cells[..., 2] * 83492791)
+
+class EncounterDetector():
+  """
+  Close encounters of the bodies (and test particles) checked at every step of the solvers:
+  a pair is in encounter when its distance is below the radius of one of its two members
+  (Hill radius of each body times `hill_factor` and `central_radius` for the central mass, or the same `radius` for all of them).
+  Test particles have no radius of their own: they only encounter bodies.
+
+  The members with a radius (sources) are few => they are checked against every member in one vectorized block.
+  Beyond `direct_limit` sources, a broad phase keeps the cost sub-quadratic: the sources are hashed on a uniform grid
+  of cells as large as the largest radius, and each member is only checked against the sources of its 27 neighbouring cells.
+
+  An event is emitted when a pair enters an encounter => step time, pair, distance (and closest distance during the encounter).
+  Then, depending on `action`, the run goes on ("record"), stops at the next recorded state ("stop")
+  or redoes each step spent in an encounter in `substeps` smaller steps ("refine").
+  """
+  def __init__(self, bodies, radius=None, hill_factor=1., central_radius=CENTRAL_RADIUS, action="record", substeps=10, direct_limit=32, t0=0.):
+    """
+    :param bodies: system of bodies (BodySystem), test particles included
+    :param radius: encounter distance (in AU), Hill radii if None
+    :param hill_factor: encounter distance in Hill radii
+    :param central_radius: encounter distance of the central mass (first body) with Hill radii, e.g. sun-grazing comets (in AU)
+    :param action: "record", "stop" or "refine"
+    :param substeps: number of substeps of a refined step
+    :param direct_limit: largest number of sources checked without the broad phase
+    :param t0: time of step 0
+    """
+    self.action = action
+    self.substeps = substeps
+    self.direct_limit = direct_limit
+    self.t0 = t0
+    self.n_members = len(bodies) + bodies.n_particles
+
+    self.radii = np.zeros(self.n_members)
+    if radius is not None:
+      self.radii[:len(bodies)] = radius
+    else:
+      self.radii[:len(bodies)] = hill_factor * hill_radii(bodies)
+      self.radii[0] = central_radius
+    self.sources = np.flatnonzero(self.radii > 0)
+    self.cell_size = np.max(self.radii) if len(self.sources) else 1.
+
+    # pairs in encounter at the last check => index of their event
+    self.active = {}
+    self.time, self.i, self.j, self.distance, self.min_distance = [], [], [], [], []
+
+  @property
+  def stopped(self):
+    return self.action == "stop" and len(self.time) > 0
+
+  @property
+  def events(self):
+    """
+    :return: encounters => {"time": ..., "i": ..., "j": ..., "distance": ..., "min_distance": ...} (one value per event, i < j)
+    :rtype: dict
+    """
+    return {
+      "time": np.array(self.time, dtype=np.float64),
+      "i": np.array(self.i, dtype=np.int64),
+      "j": np.array(self.j, dtype=np.int64),
+      "distance": np.array(self.distance, dtype=np.float64),
+      "min_distance": np.array(self.min_distance, dtype=np.float64)
+    }
+
+  def checkpoint_state(self):
+    """
+    :return: state of the detector saved with a checkpoint of the run (see storage.TrajectorySink.flush):
+    encounters found so far and pairs in encounter (pair, index of their event)
+    :rtype: dict
+    """
+    active = np.array(list(self.active.items()), dtype=np.int64).reshape(-1, 2)
+    return dict({f"encounters_{name}": array for (name, array) in self.events.items()}, encounters_active=active)
+
+  def resume(self, checkpoint):
+    """
+    Continue from the state saved with a checkpoint: the encounters found before it are kept,
+    and a pair still in encounter there is not reported again.
+    """
+    self.time, self.i, self.j, self.distance, self.min_distance = (checkpoint[f"encounters_{name}"].tolist() for name in ["time", "i", "j", "distance", "min_distance"])
+    self.active = {pair: event for (pair, event) in checkpoint["encounters_active"].tolist()}
+
+  def candidates(self, positions):
+    """
+    Broad phase.
+
+    :param positions: positions of all the members, shape (n_members, 3)
+    :return: (member, source) pairs that may be in encounter
+    :rtype: (ndarray, ndarray)
+    """
+    if len(self.sources) <= self.direct_limit:
+      members = np.repeat(np.arange(self.n_members), len(self.sources))
+      return members, np.tile(self.sources, self.n_members)
+
+    cells = np.floor(positions / self.cell_size).astype(np.int64)
+    keys = spatial_hash(cells[self.sources])
+    order = np.argsort(keys)
+    keys = keys[order]
+
+    # sources hashed in the neighbouring cells of each member: keys[lo:hi]
+    neighbours = spatial_hash(cells[:, np.newaxis, :] + NEIGHBOUR_CELLS).ravel()
+    lo = np.searchsorted(keys, neighbours, side="left")
+    counts = np.searchsorted(keys, neighbours, side="right") - lo
+
+    members = np.repeat(np.arange(self.n_members).repeat(len(NEIGHBOUR_CELLS)), counts)
+    first = np.repeat(lo - (np.cumsum(counts) - counts), counts)
+    sources = self.sources[order[np.arange(len(members)) + first]]
+    return members, sources
+
+  def check(self, t, qk):
+    """
+    Narrow phase: exact distances of the candidate pairs at time t.
+
+    :param qk: state vector of the positions (bodies followed by the test particles)
+    :return: whether some pair is in encounter
+    :rtype: bool
+    """
+    positions = qk.reshape([-1, 3])
+    members, sources = self.candidates(positions)
+
+    # a pair of two sources is seen from both of them
+    keep = (members < sources) | (self.radii[members] == 0)
+    i, j = np.minimum(members[keep], sources[keep]), np.maximum(members[keep], sources[keep])
+    distance = np.linalg.norm(positions[i] - positions[j], axis=1)
+
+    inside = distance < np.maximum(self.radii[i], self.radii[j])
+    # hash collisions may give the same pair twice
+    pairs, index = np.unique(i[inside] * self.n_members + j[inside], return_index=True)
+    distance = distance[inside][index]
+
+    active = {}
+    for (pair, d) in zip(pairs.tolist(), distance.tolist()):
+      event = self.active.get(pair)
+      if event is None:
+        event = len(self.time)
+        self.time.append(t)
+        self.i.append(pair // self.n_members)
+        self.j.append(pair % self.n_members)
+        self.distance.append(d)
+        self.min_distance.append(d)
+      else:
+        self.min_distance[event] = min(self.min_distance[event], d)
+      active[pair] = event
+
+    self.active = active
+    return len(active) > 0
@@ -0,0 +1,240 @@
+import os
+import csv
+import itertools
+import numpy as np
+
+from .edo import n_body_dpdt
+
+# kind of each event => its code in the event table
+EVENT_KINDS = ["perihelion", "aphelion", "conjunction", "opposition", "ascending node", "descending node"]
+
+def hermite(s, h, x0, v0, x1, v1):
+  """
+  Cubic Hermite interpolation inside a step of length h, at the fraction s of the step:
+  matches the values (x0, x1) and the derivatives (v0, v1) at both ends => error ~ h^4.
+  """
+  s2, s3 = s * s, s * s * s
+  return (2 * s3 - 3 * s2 + 1) * x0 + (s3 - 2 * s2 + s) * h * v0 + (3 * s2 - 2 * s3) * x1 + (s3 - s2) * h * v1
+
+class Apsides():
+  """
+  Perihelion and aphelion passages of members around a central body:
+  zeros of their radial velocity (r - r_c).(v - v_c), increasing at a perihelion and decreasing at an aphelion.
+  """
+  def __init__(self, members, central=0):
+    self.i = np.array(members, dtype=np.int64)
+    self.j = np.full(len(self.i), central)
+
+  def value(self, positions, velocities):
+    return np.einsum("ij,ij->i", positions[self.i] - positions[self.j], velocities[self.i] - velocities[self.j])
+
+  def kind(self, index, increasing, positions):
+    return EVENT_KINDS.index("perihelion" if increasing else "aphelion")
+
+class Conjunctions():
+  """
+  Conjunctions and oppositions of pairs of members seen from a central body (projected on the reference plane):
+  zeros of the z component of (r_i - r_c) x (r_j - r_c), a conjunction if both are on the same side of the central body.
+  """
+  def __init__(self, pairs, central=0):
+    self.i, self.j = np.array(pairs, dtype=np.int64).reshape(-1, 2).T
+    self.central = central
+
+  def value(self, positions, velocities):
+    r_i, r_j = positions[self.i] - positions[self.central], positions[self.j] - positions[self.central]
+    return r_i[:, 0] * r_j[:, 1] - r_i[:, 1] * r_j[:, 0]
+
+  def kind(self, index, increasing, positions):
+    r_i, r_j = positions[self.i[index]] - positions[self.central], positions[self.j[index]] - positions[self.central]
+    return EVENT_KINDS.index("conjunction" if np.dot(r_i, r_j) > 0 else "opposition")
+
+class Nodes():
+  """
+  Crossings of the reference plane (z = 0 around a central body) by members: ascending and descending nodes.
+  """
+  def __init__(self, members, central=0):
+    self.i = np.array(members, dtype=np.int64)
+    self.j = np.full(len(self.i), central)
+
+  def value(self, positions, velocities):
+    return positions[self.i, 2] - positions[self.j, 2]
+
+  def kind(self, index, increasing, positions):
+    return EVENT_KINDS.index("ascending node" if increasing else "descending node")
+
+# name (as the --events of index.py) => detector
+DETECTORS = {"apsides": Apsides, "conjunctions": Conjunctions, "nodes": Nodes}
+
+def body_detectors(bodies, names):
+  """
+  Detectors of the events of every body around the first one (central mass): apsides and nodes of each body,
+  conjunctions of each pair of bodies (the test particles are not watched).
+
+  :param names: names of the detectors => ["apsides", "conjunctions", "nodes"]
+  :rtype: list
+  """
+  members = list(range(1, len(bodies)))
+  return [DETECTORS[name](list(itertools.combinations(members, 2)) if name == "conjunctions" else members) for name in names]
+
+class EventDetector():
+  """
+  Events of a run (perihelion / aphelion passages, conjunctions, node crossings,...) found while it streams,
+  so that they do not need the stored trajectory: each detector gives one function of the state per watched member (or pair),
+  an event being a zero of that function.
+
+  After each step, a sign change of a function between the start and the end of the step brackets an event.
+  Its time is then refined inside the step (regula falsi, Illinois variant) on a cubic Hermite interpolation of the state:
+  positions from the positions and velocities at both ends, velocities from the velocities and accelerations
+  (only computed for the steps holding an event).
+  Each event => time, kind (index in EVENT_KINDS), pair (i, j) and distance of the pair, one row of a compact table,
+  also streamed to a CSV file if a path is given.
+  """
+  def __init__(self, bodies, detectors, dpdt=n_body_dpdt, t0=0., path=None, tolerance=1e-12, max_iterations=60):
+    """
+    :param bodies: system of bodies (BodySystem), test particles included
+    :param detectors: event functions (Apsides, Conjunctions, Nodes,...)
+    :param dpdt: force engine of the run (accelerations of the refinement)
+    :param t0: time of step 0
+    :param path: CSV file the events are written to as they are found (None: kept in memory only)
+    :param tolerance: precision of the refined times, in fraction of the step
+    """
+    self.bodies = bodies
+    self.detectors = detectors
+    self.dpdt = dpdt
+    self.t0 = t0
+    self.path = path
+    self.tolerance = tolerance
+    self.max_iterations = max_iterations
+
+    self.names = bodies.names + bodies.particle_names
+    # the functions of all the detectors are concatenated => those of detector d start at offsets[d]
+    self.offsets = np.cumsum([0] + [len(detector.i) for detector in detectors])
+    # p is m v for the bodies, v for the test particles
+    self.inverse_masses = np.concatenate([bodies.inverse_masses, np.ones(bodies.n_particles)])[:, np.newaxis]
+
+    # values of the event functions at the end of the last step
+    self.values = None
+    self.file = None
+    self.time, self.event, self.i, self.j, self.distance = [], [], [], [], []
+
+  @property
+  def events(self):
+    """
+    :return: events => {"time": ..., "event": ..., "i": ..., "j": ..., "distance": ...} (one value per event, in time order)
+    :rtype: dict
+    """
+    return {
+      "time": np.array(self.time, dtype=np.float64),
+      "event": np.array(self.event, dtype=np.int64),
+      "i": np.array(self.i, dtype=np.int64),
+      "j": np.array(self.j, dtype=np.int64),
+      "distance": np.array(self.distance, dtype=np.float64)
+    }
+
+  def open(self, resume=None):
+    """
+    Start (or continue) the CSV file of the events.
+
+    :param resume: time of the checkpoint a run continues from => the events found up to it are read back,
+    the later ones (found before the interruption, after the checkpoint) are found again
+    """
+    self.values = None
+    if self.path is None:
+      return
+
+    rows = []
+    if resume is not None and os.path.isfile(self.path):
+      with open(self.path, newline="") as f:
+        rows = [row for row in csv.DictReader(f) if float(row["time"]) <= resume]
+      for row in rows:
+        self.add(float(row["time"]), EVENT_KINDS.index(row["event"]), int(row["i"]), int(row["j"]), float(row["distance"]))
+
+    os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+    # line buffered => each event is on disk as soon as it is found
+    self.file = open(self.path, "w", newline="", buffering=1)
+    self.writer = csv.DictWriter(self.file, fieldnames=["time", "event", "i", "j", "body_i", "body_j", "distance"])
+    self.writer.writeheader()
+    self.writer.writerows(rows)
+
+  def close(self):
+    if self.file is not None:
+      self.file.close()
+      self.file = None
+
+  def add(self, t, kind, i, j, distance):
+    self.time.append(t)
+    self.event.append(kind)
+    self.i.append(i)
+    self.j.append(j)
+    self.distance.append(distance)
+
+  def state(self, qk, pk):
+    positions = qk.reshape([-1, 3])
+    return positions, pk.reshape([-1, 3]) * self.inverse_masses
+
+  def value(self, qk, pk):
+    positions, velocities = self.state(qk, pk)
+    return np.concatenate([detector.value(positions, velocities) for detector in self.detectors])
+
+  def check(self, t, qk, pk, t_next, q_next, p_next):
+    """
+    Events of the step from (t, qk, pk) to (t_next, q_next, p_next).
+
+    :param qk, pk: state vectors (bodies followed by the test particles) of a single system
+    """
+    start = self.values if self.values is not None else self.value(qk, pk)
+    end = self.values = self.value(q_next, p_next)
+
+    crossings = np.flatnonzero((start < 0) != (end < 0))
+    if not len(crossings):
+      return
+
+    h = t_next - t
+    (x0, v0), (x1, v1) = self.state(qk, pk), self.state(q_next, p_next)
+    a0 = self.dpdt(qk, pk, self.bodies).reshape([-1, 3]) * self.inverse_masses
+    a1 = self.dpdt(q_next, p_next, self.bodies).reshape([-1, 3]) * self.inverse_masses
+
+    def interpolate(s):
+      return hermite(s, h, x0, v0, x1, v1), hermite(s, h, v0, a0, v1, a1)
+
+    found = []
+    for k in crossings:
+      d = np.searchsorted(self.offsets, k, side="right") - 1
+      detector, index, g0 = self.detectors[d], k - self.offsets[d], start[k]
+      s = self.refine(lambda s: detector.value(*interpolate(s))[index], g0, end[k])
+      positions, velocities = interpolate(s)
+      i, j = int(detector.i[index]), int(detector.j[index])
+      found.append((t + s * h, detector.kind(index, g0 < 0, positions), i, j, float(np.linalg.norm(positions[i] - positions[j]))))
+
+    for event in sorted(found):
+      self.add(*event)
+      if self.file is not None:
+        (time, kind, i, j, distance) = event
+        self.writer.writerow({"time": time, "event": EVENT_KINDS[kind], "i": i, "j": j, "body_i": self.names[i], "body_j": self.names[j], "distance": distance})
+
+  def refine(self, g, g0, g1):
+    """
+    Zero of g inside the step, g(0) = g0 and g(1) = g1 being of opposite signs.
+
+    :return: fraction of the step
+    :rtype: float
+    """
+    a, b, ga, gb = 0., 1., g0, g1
+    side = 0
+    for _ in range(self.max_iterations):
+      s = (a * gb - b * ga) / (gb - ga)
+      gs = g(s)
+      if gs == 0 or b - a < self.tolerance:
+        break
+      # Illinois: the value kept at the same end twice in a row is halved
+      if (gs < 0) == (gb < 0):
+        b, gb = s, gs
+        if side == -1:
+          ga /= 2
+        side = -1
+      else:
+        a, ga = s, gs
+        if side == 1:
+          gb /= 2
+        side = 1
+    return s
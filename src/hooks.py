@@ -0,0 +1,40 @@
+class RunHooks():
+  """
+  Everything a solver run feeds besides its output arrays, grouped so that it is passed once
+  through the drivers (solvers.integrate, solvers.dormand_prince), the backends and the worker processes.
+  Each hook is optional (None: not used, nothing to pay).
+  """
+  def __init__(self, sink=None, metrics=None, recorder=None, particles=None, encounters=None, events=None):
+    """
+    :param sink: on-disk store of the trajectory (storage.TrajectorySink), flushed and checkpointed during the run
+    :param metrics: instrumentation of the run (metrics.Metrics)
+    :param recorder: full precision diagnostics of a trajectory stored in a lower precision (edo.DiagnosticsRecorder)
+    :param particles: recorder of the test particles (edo.TestParticleRecorder)
+    :param encounters: close encounter detector (encounters.EncounterDetector)
+    :param events: event detector (events.EventDetector)
+    """
+    self.sink = sink
+    self.metrics = metrics
+    self.recorder = recorder
+    self.particles = particles
+    self.encounters = encounters
+    self.events = events
+
+  @property
+  def watched(self):
+    """
+    :return: whether the run checks each step (close encounters or events)
+    """
+    return self.encounters is not None or self.events is not None
+
+  def found(self):
+    """
+    :return: close encounters and events found by the detectors of the run (small tables => pickled back by the workers)
+    :rtype: dict
+    """
+    found = {}
+    if self.encounters is not None:
+      found["encounters"] = self.encounters.events
+    if self.events is not None:
+      found["events"] = self.events.events
+    return found
@@ -0,0 +1,112 @@
+import numpy as np
+from functools import lru_cache
+
+@lru_cache(maxsize=16)
+def jacobi_matrices(masses):
+  """
+  Linear maps between barycentric and Jacobi coordinates (body 0 being the central mass):
+  r'_0 = center of mass of all the bodies, r'_i = x_i - (center of mass of bodies 0..i-1).
+  Positions and velocities transform as r' = A x, generalized forces and momenta as p' = B^T p (B = A^{-1}).
+
+  :param masses: masses of the bodies (tuple, so that the matrices are cached)
+  :return: A, B, Jacobi masses m'_i = m_i eta_{i-1} / eta_i (m'_0 = total mass) and interior masses eta_i = m_0 + ... + m_i
+  :rtype: (ndarray, ndarray, ndarray, ndarray)
+  """
+  masses = np.array(masses)
+  n = len(masses)
+  eta = np.cumsum(masses)
+
+  A = np.zeros((n, n))
+  A[0] = masses / eta[-1]
+  for i in range(1, n):
+    A[i, :i] = - masses[:i] / eta[i - 1]
+    A[i, i] = 1
+
+  jacobi_masses = np.empty(n)
+  jacobi_masses[0] = eta[-1]
+  jacobi_masses[1:] = masses[1:] * eta[:-1] / eta[1:]
+
+  return A, np.linalg.inv(A), jacobi_masses, eta
+
+def stumpff(z):
+  """
+  Stumpff functions c0, c1, c2, c3 of z (vectorized), using their series close to z = 0.
+  """
+  small = np.abs(z) < 0.1
+  # avoid evaluating the closed forms at (or around) 0
+  zs = np.where(small, 1., z)
+
+  sqrt_z = np.sqrt(np.abs(zs))
+  c0 = np.where(zs > 0, np.cos(sqrt_z), np.cosh(sqrt_z))
+  c1 = np.where(zs > 0, np.sin(sqrt_z), np.sinh(sqrt_z)) / sqrt_z
+  c2 = (1 - c0) / zs
+  c3 = (1 - c1) / zs
+
+  # series: c_k(z) = \sum_n (-z)^n / (2n + k)!
+  z2, z3, z4 = z ** 2, z ** 3, z ** 4
+  c0_s = 1 - z / 2 + z2 / 24 - z3 / 720 + z4 / 40320 - z ** 5 / 3628800
+  c1_s = 1 - z / 6 + z2 / 120 - z3 / 5040 + z4 / 362880 - z ** 5 / 39916800
+  c2_s = 1 / 2 - z / 24 + z2 / 720 - z3 / 40320 + z4 / 3628800 - z ** 5 / 479001600
+  c3_s = 1 / 6 - z / 120 + z2 / 5040 - z3 / 362880 + z4 / 39916800 - z ** 5 / 6227020800
+
+  return (np.where(small, c0_s, c0), np.where(small, c1_s, c1), np.where(small, c2_s, c2), np.where(small, c3_s, c3))
+
+def kepler_drift(r0, v0, mu, dt, tolerance=1e-15, max_iterations=50):
+  """
+  Advance two-body (Kepler) orbits by dt using universal variables (Danby, 1988),
+  valid for elliptic, parabolic and hyperbolic orbits and vectorized over any number of orbits.
+
+  :param r0: relative positions, shape (..., 3)
+  :param v0: relative velocities, shape (..., 3)
+  :param mu: G * (central mass), shape (...)
+  :param dt: time step
+  :return: positions and velocities after dt
+  :rtype: (ndarray, ndarray)
+  """
+  r0_norm = np.linalg.norm(r0, axis=-1)
+  eta0 = np.sum(r0 * v0, axis=-1)
+  # beta = mu / a
+  beta = 2 * mu / r0_norm - np.sum(v0 ** 2, axis=-1)
+
+  # whole periods of bound orbits are removed
+  bound = beta > 0
+  sqrt_beta = np.sqrt(np.abs(beta))
+  period = 2 * np.pi * mu / np.where(bound, sqrt_beta ** 3, 1.)
+  dt = np.where(bound, np.fmod(dt, period), dt)
+
+  # initial guess: s = dt / r0 for unbound orbits,
+  # for bound orbits s = (E1 - E0) / sqrt(beta) with E1 a guess of the eccentric anomaly after dt (Danby)
+  e_cos = 1 - r0_norm * beta / mu
+  e_sin = eta0 * sqrt_beta / mu
+  e = np.sqrt(e_cos ** 2 + e_sin ** 2)
+  E0 = np.arctan2(e_sin, e_cos)
+  M1 = E0 - e_sin + dt * np.where(bound, sqrt_beta ** 3, 0.) / mu
+  E1 = M1 + 0.85 * e * np.sign(np.sin(M1))
+  s = np.where(bound, (E1 - E0) / np.where(bound, sqrt_beta, 1.), dt / r0_norm)
+
+  # solve r0 s c1 + eta0 s^2 c2 + mu s^3 c3 = dt for s
+  # Laguerre-Conway iterations (converge from any reasonable guess, unlike Newton)
+  n = 5
+  for _ in range(max_iterations):
+    c0, c1, c2, c3 = stumpff(beta * s ** 2)
+    f = r0_norm * s * c1 + eta0 * s ** 2 * c2 + mu * s ** 3 * c3 - dt
+    # f' = r, f'' = dr/ds
+    r = r0_norm * c0 + eta0 * s * c1 + mu * s ** 2 * c2
+    dr = eta0 * c0 + (mu - beta * r0_norm) * s * c1
+    ds = - n * f / (r + np.sign(r) * np.sqrt(np.abs((n - 1) ** 2 * r ** 2 - n * (n - 1) * f * dr)))
+    s = s + ds
+    if np.all(np.abs(ds) <= tolerance * np.abs(s)):
+      break
+
+  c0, c1, c2, c3 = stumpff(beta * s ** 2)
+  r = r0_norm * c0 + eta0 * s * c1 + mu * s ** 2 * c2
+
+  # Gauss f and g functions
+  f = 1 - mu * s ** 2 * c2 / r0_norm
+  g = dt - mu * s ** 3 * c3
+  f_dot = - mu * s * c1 / (r * r0_norm)
+  g_dot = 1 - mu * s ** 2 * c2 / r
+
+  r1 = f[..., np.newaxis] * r0 + g[..., np.newaxis] * v0
+  v1 = f_dot[..., np.newaxis] * r0 + g_dot[..., np.newaxis] * v0
+  return r1, v1
@@ -0,0 +1,152 @@
+import sys
+import time
+from contextlib import contextmanager
+
+# not available on Windows => no memory high-water mark
+try:
+  import resource
+except ImportError:
+  resource = None
+
+def peak_memory():
+  """
+  :return: memory high-water mark of the process (in bytes), None if unknown
+  """
+  if resource is None:
+    return None
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # kilobytes on Linux, bytes on macOS
+  return peak if sys.platform == "darwin" else peak * 1024
+
+class Metrics():
+  """
+  Instrumentation of one solver run: time spent in each phase (force evaluation, stores, flushes to disk,...),
+  step rate and memory high-water mark.
+
+  The solvers only instrument their loop when the hooks of the run hold a Metrics object (none costs nothing):
+  the kernels are then wrapped (see timed) and the loop reports its progress after each stored state.
+  """
+  def __init__(self, name, callback=None, interval=1.):
+    """
+    :param name: name of the run (solver)
+    :param callback: called with the metrics (self) at most every `interval` seconds during the run
+    :param interval: seconds between two calls of the callback
+    """
+    self.name = name
+    self.callback = callback
+    self.interval = interval
+
+    # phase => [seconds, calls]
+    self.phases = {}
+    # other counters (rejected steps,...)
+    self.counters = {}
+    self.steps = 0
+    self.elapsed = 0.
+    self.memory_peak = None
+
+    self.started = None
+    self.last_callback = 0.
+
+  def add(self, phase, seconds, calls=1):
+    counter = self.phases.setdefault(phase, [0., 0])
+    counter[0] += seconds
+    counter[1] += calls
+
+  def count(self, name, value=1):
+    self.counters[name] = self.counters.get(name, 0) + value
+
+  @contextmanager
+  def phase(self, name):
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.add(name, time.perf_counter() - start)
+
+  def timed(self, phase, function):
+    """
+    :return: function, timing each of its calls in `phase`
+    """
+    def wrapper(*args, **kwargs):
+      start = time.perf_counter()
+      try:
+        return function(*args, **kwargs)
+      finally:
+        self.add(phase, time.perf_counter() - start)
+    return wrapper
+
+  def start(self):
+    self.started = time.perf_counter()
+    self.last_callback = self.started
+
+  def progress(self, steps):
+    """
+    :param steps: number of steps done since start
+    """
+    self.steps = steps
+    now = time.perf_counter()
+    self.elapsed = now - self.started
+
+    if self.callback is not None and now - self.last_callback >= self.interval:
+      self.last_callback = now
+      self.memory_peak = peak_memory()
+      self.callback(self)
+
+  def stop(self, steps):
+    self.progress(steps)
+    self.memory_peak = peak_memory()
+
+  @property
+  def step_rate(self):
+    return self.steps / self.elapsed if self.elapsed > 0 else 0.
+
+  def merge(self, other):
+    """
+    Add the counters of another run (e.g. a worker process) to these ones.
+    """
+    for (phase, (seconds, calls)) in other.phases.items():
+      self.add(phase, seconds, calls)
+    for (name, value) in other.counters.items():
+      self.count(name, value)
+    self.steps += other.steps
+    self.elapsed += other.elapsed
+    if other.memory_peak is not None:
+      self.memory_peak = max(self.memory_peak or 0, other.memory_peak)
+
+  def __getstate__(self):
+    # the callback is not sent back from the worker processes
+    return dict(self.__dict__, callback=None)
+
+def print_progress(metrics):
+  """
+  Callback of Metrics: one line on stderr with the progress of the run (what the progress bars of the solvers showed).
+  """
+  print(f"{metrics.name}: {metrics.steps} steps in {metrics.elapsed:.1f} s => {metrics.step_rate:.0f} steps/s", file=sys.stderr)
+
+def format_metrics(metrics):
+  """
+  Summary table of several runs: time per phase (share of the run and time per call),
+  step rate and memory high-water mark.
+
+  :param metrics: list of Metrics
+  :rtype: str
+  """
+  lines = [f"{'solver':<22} {'phase':<14} {'calls':>10} {'total [s]':>10} {'share':>7} {'per call [us]':>14}"]
+  for run in metrics:
+    phases = sorted(run.phases.items(), key=lambda phase: - phase[1][0])
+    # time of the loop outside the instrumented phases (step arithmetic,...)
+    rest = run.elapsed - sum(seconds for (phase, (seconds, calls)) in phases if phase != "diagnostics")
+    if rest > 0:
+      phases.append(("other", (rest, 0)))
+
+    total = run.elapsed + run.phases.get("diagnostics", [0.])[0]
+    for (phase, (seconds, calls)) in phases:
+      per_call = f"{seconds / calls * 1e6:>14.2f}" if calls else f"{'':>14}"
+      lines.append(f"{run.name:<22} {phase:<14} {calls:>10} {seconds:>10.3f} {seconds / max(total, 1e-12):>7.1%} {per_call}")
+
+    memory = f"{run.memory_peak / 1024 ** 2:.1f} MB" if run.memory_peak is not None else "unknown"
+    counters = "".join(f", {name}: {value}" for (name, value) in run.counters.items())
+    lines.append(f"{run.name:<22} {run.steps} steps in {run.elapsed:.3f} s => {run.step_rate:.0f} steps/s, peak memory {memory}{counters}")
+    lines.append("")
+
+  return "\n".join(lines)
@@ -1,185 +1,875 @@
 import os
+import copy
+import warnings
+import contextlib
+import shutil
+import queue
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
 import matplotlib.gridspec as gridspec
 
 from mpl_toolkits.mplot3d import Axes3D
 
-from .edo import (hamiltonian, compute_angular_momentum, n_body_dqdt, n_body_dpdt)
-from .solvers import (heun, euler_symp, stormer_verlet)
-from consts import (au_to_meter, day_to_second)
+from .body import BodySystem
+from .edo import (compute_diagnostics, diagnostics_fields, downcast_trajectory, DiagnosticsRecorder, test_particle_records, test_particle_fields, split_test_particles, TestParticleRecorder, n_body_dqdt, n_body_dpdt)
+from .solvers import (heun, euler_symp, stormer_verlet, yoshida4, yoshida6, forest_ruth, wisdom_holman, dormand_prince, wisdom_holman_applies)
+from .solvers import (heun_step, euler_symp_step, stormer_verlet_step, yoshida4_step, yoshida6_step, forest_ruth_step, wisdom_holman_step)
+from .storage import (TrajectorySink, load_trajectory, write_trajectory)
+from .parallel import (create_shared_array, solve_in_worker, solve_adaptive_in_worker)
+from .octree import BarnesHut
+from .backends import get_backend
+from .cache import ResultCache
+from .stream import (RingBuffer, Producer, trajectory_chunks, array_chunks)
+from .downsample import (minmax_downsample, pixel_downsample)
+from .metrics import (Metrics, format_metrics, print_progress)
+from .hooks import RunHooks
+from .encounters import (EncounterDetector, CENTRAL_RADIUS)
+from .events import (EVENT_KINDS, EventDetector, body_detectors)
+from consts import (G, au_to_meter, day_to_second, DATA_PLOT_REFRESH, DATA_SUB_INTERVAL_LENGTH)
 
 from utils import (set_size, set_size_square_plot)
 
+# schemes run in static mode unless others are given (the higher order and adaptive ones cost several times more)
+DEFAULT_SCHEMES = ["heun", "euler-symplectic", "stormer-verlet"]
+
 class NBodySimulation():
   def __init__(self, bodies, t0, tN, dt, options):
     self.options = options
-    self.bodies = bodies
+    # contiguous arrays of the bodies, taken by the kernels and the solvers
+    # (list of Body, or a BodySystem already built, e.g. in a worker process)
+    self.bodies = bodies if isinstance(bodies, BodySystem) else BodySystem(bodies)
     self.t0 = t0
     self.tN = tN
     self.dt = dt
 
-    self.total_mass = sum(body.mass for body in self.bodies)
-    self.mean_pos = sum(body.initial_positions * body.mass for body in self.bodies) / self.total_mass
-    self.mean_vel = sum(body.initial_impulsions for body in self.bodies) / self.total_mass
-
-    # shift the coordinate frame so that the barycenter is at rest.
-    for body in self.bodies:
-      body.initial_positions -= self.mean_pos
-      body.initial_impulsions -= body.mass * self.mean_vel
+    self.total_mass = self.bodies.total_mass
+    # shift the coordinate frame so that the barycenter is at rest
+    # (test particles are massless: they do not move the barycenter).
+    self.mean_pos, self.mean_vel = self.bodies.to_barycentric_frame()
 
     # number of time step
     self.nt = int((self.tN - self.t0) / self.dt)
-    self.time_mesh = np.linspace(start=self.t0, stop=self.tN, num=self.nt)
-    self.legends = ["Heun (RK2)", "Euler Symplectique", "Stormer-Verlet"]
+    self.set_record_every(record_every=self.options.get("record_every", 1), samples=self.options.get("samples"))
 
-    self.solvers = [
-      {"call": heun, "name": "Heun (RK2)", "color": "teal", "bodies": self.bodies},
-      {"call": euler_symp, "name": "Euler Symplectique", "color": "darkorange", "bodies": self.bodies},
-      {"call": stormer_verlet, "name": "Stormer Verlet", "color": "crimson", "bodies": self.bodies}
-    ]
+    # force engine: exact all-pairs forces or Barnes-Hut tree forces
+    if self.options.get("force", "direct") == "barnes-hut":
+      self.dpdt = BarnesHut(theta=self.options.get("theta", 0.5))
+    else:
+      self.dpdt = n_body_dpdt
+
+    # numpy (reference) or compiled backend running the step loops
+    self.backend_name = self.options.get("backend", "numpy")
+    self.backend = get_backend(self.backend_name)
+    # error tolerance of the adaptive scheme
+    self.tolerance = self.options.get("tolerance", 1e-10)
+    # close encounters checked at each step: None (not checked), "record", "stop" or "refine"
+    self.encounters = self.options.get("encounters")
+    # events found while the runs stream => names of their detectors ("apsides", "conjunctions", "nodes")
+    self.events = list(self.options.get("events") or [])
+    # precision of the stored trajectories (the solvers always integrate in float64)
+    self.storage_dtype = np.dtype(self.options.get("storage_dtype", "float64"))
+    # stride between two stored states of the test particles, in records (0: only their last state)
+    self.particles_every = self.options.get("particles_every", 0)
+    self.legends = ["Heun (RK2)", "Euler Symplectique", "Stormer-Verlet", "Yoshida 4", "Yoshida 6", "Forest-Ruth", "Wisdom-Holman", "Dormand-Prince 5(4)"]
 
     self.solvers2 = {
       "heun": {
         "call": heun,
+        "step": heun_step,
         "name": "Heun (RK2)",
         "color": "teal",
         "bodies": self.bodies
       },
       "euler-symplectic": {
         "call": euler_symp,
+        "step": euler_symp_step,
         "name": "Euler Symplectique",
         "color": "darkorange",
         "bodies": self.bodies
       },
       "stormer-verlet": {
         "call": stormer_verlet,
+        "step": stormer_verlet_step,
         "name": "Stormer Verlet",
         "color": "crimson",
         "bodies": self.bodies
+      },
+      "yoshida-4": {
+        "call": yoshida4,
+        "step": yoshida4_step,
+        "name": "Yoshida 4",
+        "color": "mediumpurple",
+        "bodies": self.bodies
+      },
+      "yoshida-6": {
+        "call": yoshida6,
+        "step": yoshida6_step,
+        "name": "Yoshida 6",
+        "color": "navy",
+        "bodies": self.bodies
+      },
+      "forest-ruth": {
+        "call": forest_ruth,
+        "step": forest_ruth_step,
+        "name": "Forest-Ruth",
+        "color": "forestgreen",
+        "bodies": self.bodies
+      },
+      "wisdom-holman": {
+        "call": wisdom_holman,
+        "step": wisdom_holman_step,
+        "name": "Wisdom-Holman",
+        "color": "slategray",
+        "bodies": self.bodies
+      },
+      "dormand-prince": {
+        "call": dormand_prince,
+        "name": "Dormand-Prince 5(4)",
+        "color": "olive",
+        "bodies": self.bodies,
+        "adaptive": True
       }
     }
 
-    script_dir = os.path.dirname(__file__)
-    self.figures_dir = os.path.join(script_dir, f"../slides/figures/{int(self.tN / 365.25)}_years")
+    # schemes of the static mode (one result each)
+    self.solvers = []
+    for name in self.options.get("schemes", DEFAULT_SCHEMES):
+      if name == "wisdom-holman" and not wisdom_holman_applies(self.bodies):
+        warnings.warn("wisdom-holman skipped: its Kepler drifts need the first body to hold most of the mass (the Sun first)")
+        continue
+      self.solvers.append(self.solvers2[name])
 
-    print(script_dir, self.figures_dir)
-
-    # create figures folder if does not exist
-    if not os.path.isdir(self.figures_dir):
-      os.makedirs(self.figures_dir)
+    self.set_figures_dir()
 
     if self.options["save"]:
       self.figure_options = set_size(width="full-size", subplots=(1,3))
     else:
       self.figure_options = 8,8
 
+    # cache of the results of previous runs (None => always recompute)
+    self.cache = None
+    if self.options.get("cache_dir"):
+      self.cache = ResultCache(directory=self.options["cache_dir"], max_size=self.options.get("cache_size", 2 * 1024 ** 3))
+
     self.results = []
+    # shared memory blocks backing the results of the parallel mode
+    self.shared_memory = []
 
-  def solve(self, solver, dt, nt, bodies):
-    # positions and impulsions state vectors
-    # each body is in \R^3 (3D space x, y, z)
-    q = np.zeros((self.nt, len(self.bodies) * 3))
-    p = np.zeros((self.nt, len(self.bodies) * 3))
+  def set_figures_dir(self):
+    script_dir = os.path.dirname(__file__)
+    self.figures_dir = os.path.join(script_dir, f"../slides/figures/{int(self.tN / 365.25)}_years")
+    # the figures are also copied in the report ones
+    self.figures_dirs = [self.figures_dir]
+    if self.options.get("report"):
+      self.figures_dirs.append(os.path.join(script_dir, f"../report/figures/{int(self.tN / 365.25)}_years"))
 
-    # energy mesh -- computed from the hamiltonian
-    energy = np.zeros(self.nt)
-    # angular momentum mesh
-    angular_momentum = np.zeros(self.nt)
-    # total area swept mesh
-    area_swept = np.zeros(self.nt)
+    # create figures folder if does not exist
+    for figures_dir in self.figures_dirs:
+      if not os.path.isdir(figures_dir):
+        os.makedirs(figures_dir)
+
+  def save_figure(self, name, **kwargs):
+    # rendered once, then copied
+    self.fig.savefig(f"{self.figures_dir}/{name}", **kwargs)
+    for figures_dir in self.figures_dirs[1:]:
+      shutil.copyfile(f"{self.figures_dir}/{name}", f"{figures_dir}/{name}")
+
+  def show(self):
+    # batch mode: no display, the figure is only saved
+    if self.options.get("batch"):
+      plt.close(self.fig)
+    else:
+      plt.show()
+
+  def set_record_every(self, record_every=1, samples=None):
+    """
+    Only one state out of `record_every` is stored (the solvers still step at dt).
+    If a target number of samples is given instead, the stride is chosen so that
+    at most `samples` states are stored.
+    """
+    if samples is not None:
+      record_every = max(1, int(np.ceil((self.nt - 1) / max(samples - 1, 1))))
+
+    self.record_every = record_every
+    # number of recorded states (initial conditions included)
+    self.n_records = (self.nt - 1) // self.record_every + 1
+    self.time_mesh = self.t0 + np.arange(self.n_records) * self.record_every * self.dt
+
+  def metadata(self, solver, bodies):
+    metadata = {
+      "solver": solver.__name__,
+      "bodies": [{"name": name, "mass": mass} for (name, mass) in zip(bodies.names, bodies.masses.tolist())],
+      "t0": self.t0,
+      "tN": self.tN,
+      "dt": self.dt,
+      "nt": self.nt,
+      "record_every": self.record_every,
+      "units": {"time": "day", "q": "AU", "p": "M_sun.AU/day", "mass": "M_sun"}
+    }
+    if self.encounters is not None:
+      metadata["encounters"] = self.encounter_config()
+    if self.events:
+      metadata["events"] = self.events
+    if bodies.n_particles:
+      metadata["test_particles"] = bodies.n_particles
+      metadata["particles_every"] = self.particles_every
+      metadata["units"].update({"particles_q": "AU", "particles_p": "AU/day"})
+    if self.storage_dtype != np.float64:
+      metadata["storage_dtype"] = self.storage_dtype.name
+    return metadata
+
+  def encounter_config(self):
+    return {
+      "action": self.encounters,
+      "radius": self.options.get("encounter_radius"),
+      "hill_factor": self.options.get("hill_factor", 1.),
+      "central_radius": self.options.get("central_radius", CENTRAL_RADIUS),
+      "substeps": self.options.get("encounter_substeps", 10)
+    }
+
+  def encounter_detector(self, bodies):
+    """
+    :return: new close encounter detector of a run, None if the encounters are not checked
+    """
+    if self.encounters is None:
+      return None
+    return EncounterDetector(bodies, t0=self.t0, **self.encounter_config())
+
+  def event_detector(self, bodies, output_dir=None):
+    """
+    :return: new event detector of a run (streaming its events to output_dir/events.csv if any), None if no event is watched
+    """
+    if not self.events:
+      return None
+    path = os.path.join(output_dir, "events.csv") if output_dir is not None else None
+    return EventDetector(bodies, body_detectors(bodies, self.events), dpdt=self.dpdt, t0=self.t0, path=path)
+
+  def worker_hooks(self, output_dir):
+    """
+    :return: hooks sent to a worker process (parallel mode) => detectors of the run, the worker adding its store, recorders and metrics
+    """
+    return RunHooks(encounters=self.encounter_detector(self.bodies), events=self.event_detector(self.bodies, output_dir))
+
+  def output_dir(self, solver):
+    if not self.options.get("output_dir"):
+      return None
+    return os.path.join(self.options["output_dir"], solver.__name__)
+
+  def sink_options(self, solver, bodies, output_dir):
+    fields = {"q": (self.n_records, len(bodies) * 3), "p": (self.n_records, len(bodies) * 3)}
+    if self.storage_dtype != np.float64:
+      # diagnostics computed in full precision during the integration, stored along the trajectory
+      fields.update(diagnostics_fields(self.n_records))
+    if bodies.n_particles:
+      fields.update(test_particle_fields(self.n_records, bodies.n_particles, self.particles_every))
+
+    return {
+      "directory": output_dir,
+      "fields": fields,
+      "metadata": self.metadata(solver, bodies),
+      "chunk_size": self.options.get("checkpoint_every", 4096),
+      # continue from the last checkpoint of the store, if any
+      "resume": self.options.get("resume", False),
+      "dtypes": {"q": self.storage_dtype, "p": self.storage_dtype, "particles_q": self.storage_dtype, "particles_p": self.storage_dtype}
+    }
+
+  def solve(self, solver, dt, nt, bodies, output_dir=None, hooks=None):
+    """
+    :param hooks: hooks of the run (hooks.RunHooks) => metrics, close encounter and event detectors,
+    the on-disk store and the recorders of the run being added to it
+    :return: q, p and the other arrays recorded during the integration => diagnostics (if stored in a lower precision
+    than float64) and test particles (if any): {"energy": ..., "particles_q": ...,...}
+    (only the states recorded before the run stopped on an encounter)
+    """
+    sink = None
+    if output_dir is not None:
+      # stream the trajectory to disk instead of keeping it in memory
+      sink = TrajectorySink(**self.sink_options(solver, bodies, output_dir))
+      q, p = sink.arrays["q"], sink.arrays["p"]
+    else:
+      # positions and impulsions state vectors
+      # each body is in \R^3 (3D space x, y, z)
+      q = np.zeros((self.n_records, len(bodies) * 3), dtype=self.storage_dtype)
+      p = np.zeros((self.n_records, len(bodies) * 3), dtype=self.storage_dtype)
 
     # set initial conditions
-    q[0] = np.concatenate(np.array([body.initial_positions for body in bodies]))
-    p[0] = np.concatenate(np.array([body.initial_impulsions for body in bodies]))
+    q[0] = bodies.q0
+    p[0] = bodies.p0
+
+    # lower precision storage: diagnostics from the full precision states, before the down-cast
+    recorder = None
+    if self.storage_dtype != np.float64:
+      recorder = DiagnosticsRecorder(bodies, bodies.q0, bodies.p0, self.n_records, arrays=sink.arrays if sink is not None else None)
+
+    # test particles: integrated along with the bodies, stored in their own arrays
+    particles = None
+    if bodies.n_particles:
+      particles = TestParticleRecorder(bodies, self.n_records, arrays=sink.arrays if sink is not None else None, dtype=self.storage_dtype, every=self.particles_every)
+
+    hooks = hooks if hooks is not None else RunHooks()
+    hooks.sink, hooks.recorder, hooks.particles = sink, recorder, particles
+    q, p = self.backend.run(solver=solver, dqdt=n_body_dqdt, dpdt=self.dpdt, q=q, p=p, dt=dt, nt=nt, bodies=bodies, record_every=self.record_every, hooks=hooks)
+    recorded = {name: array[:len(q)] for (name, array) in (recorder.arrays if recorder is not None else {}).items()}
+    # the test particles are cut to the length of the run by attach_particles
+    return q, p, dict(recorded, **(particles.arrays if particles is not None else {}))
+
+  def solve_adaptive(self, solver, bodies, output_dir=None, hooks=None):
+    """
+    Same as solve for an adaptive scheme (dormand_prince): the number of steps is not known beforehand,
+    so the trajectory is written to the on-disk store (if any) once the integration is done.
+
+    :return: non-uniform time mesh, q, p and the other recorded arrays (diagnostics, test particles) as solve
+    """
+    # test particles after the bodies in the state
+    q0, p0 = np.concatenate([bodies.q0, bodies.particles_q0]), np.concatenate([bodies.p0, bodies.particles_p0])
+    time, q, p = solver(dqdt=n_body_dqdt, dpdt=self.dpdt, q0=q0, p0=p0, t0=self.t0, tN=self.tN, dt=self.dt, bodies=bodies, tolerance=self.tolerance, record_every=self.record_every, hooks=hooks)
+
+    recorded = {}
+    if bodies.n_particles:
+      q, p, recorded = split_test_particles(q, p, bodies, self.particles_every)
+    if self.storage_dtype != np.float64:
+      q, p, diagnostics = downcast_trajectory(q, p, bodies, self.storage_dtype)
+      recorded = dict(diagnostics, **{name: array.astype(self.storage_dtype) for (name, array) in recorded.items()})
+
+    if output_dir is not None:
+      metadata = dict(self.metadata(solver, bodies), tolerance=self.tolerance)
+      write_trajectory(output_dir, {"time": time, "q": q, "p": p, **recorded}, metadata)
+
+    return time, q, p, recorded
+
+  def simulate(self, record_every=None, samples=None, jobs=None):
+    if record_every is not None or samples is not None:
+      self.set_record_every(record_every=record_every or 1, samples=samples)
+
+    if jobs is None:
+      jobs = self.options.get("jobs", 1)
+
+    # the results already in the cache are read back instead of being recomputed
+    self.results = [self.load_cached(solver) for solver in self.solvers]
+    missing = [index for (index, result) in enumerate(self.results) if result is None]
+
+    if jobs > 1:
+      computed = self.simulate_parallel(jobs, [self.solvers[index] for index in missing])
+    else:
+      computed = [self.simulate_solver(self.solvers[index]) for index in missing]
+
+    for (index, result) in zip(missing, computed):
+      self.store_cached(self.solvers[index], result)
+      self.results[index] = result
+
+  def simulate_solver(self, solver):
+    output_dir = self.output_dir(solver["call"])
+    # per-phase timings of the run (--profile)
+    metrics = Metrics(solver["name"], callback=print_progress, interval=5.) if self.options.get("profile") else None
+    encounters = self.encounter_detector(self.bodies)
+    events = self.event_detector(self.bodies, output_dir)
+    hooks = RunHooks(metrics=metrics, encounters=encounters, events=events)
+
+    if solver.get("adaptive"):
+      time, q, p, recorded = self.solve_adaptive(solver=solver["call"], bodies=self.bodies, output_dir=output_dir, hooks=hooks)
+    else:
+      q, p, recorded = self.solve(solver=solver["call"], dt=self.dt, nt=self.nt, bodies=self.bodies, output_dir=output_dir, hooks=hooks)
+      # shorter if stopped on an encounter
+      time = self.time_mesh[:len(q)]
+
+    if output_dir is not None:
+      # plots read the trajectory back from disk (read-only memmaps)
+      metadata, recorded = load_trajectory(output_dir)
+      q, p = recorded["q"], recorded["p"]
+
+    result = {"solver": solver["name"], "color": solver["color"], "time": time, "q": q, "p": p}
+    if "energy" in recorded:
+      self.attach_diagnostics(result, recorded)
+    self.attach_particles(result, recorded)
+    if encounters is not None:
+      result["encounters"] = encounters.events
+    if events is not None:
+      result["events"] = events.events
+    if metrics is not None:
+      result["metrics"] = metrics
+    return result
+
+  def attach_diagnostics(self, result, diagnostics):
+    """
+    Diagnostics computed during the integration (lower precision storage), kept for one stored state
+    out of `diagnostics_every` as the ones of compute_diagnostics.
+    The ones of every stored state (recorded_diagnostics, the strided ones are views on them) are what the cache stores.
+    """
+    every = self.options.get("diagnostics_every", 1)
+    result["recorded_diagnostics"] = {name: diagnostics[name] for name in diagnostics_fields(0)}
+    result.update({name: diagnostics[name][::every] for name in diagnostics_fields(0)})
+    result["diagnostics_time"] = result["time"][::every]
+
+  def attach_particles(self, result, arrays):
+    """
+    Positions and velocities of the test particles (if any): their last recorded state,
+    or one state every `particles_every` stored states of q and p.
+    """
+    n = test_particle_records(len(result["q"]), self.particles_every)
+    result.update({name: arrays[name][:n] for name in test_particle_fields(0, 0) if name in arrays})
+
+  def encounter_report(self):
+    """
+    :return: close encounters of each run (one line per event), None if they are not checked
+    :rtype: str
+    """
+    if self.encounters is None:
+      return None
+
+    names = self.bodies.names + self.bodies.particle_names
+    lines = []
+    for result in self.results:
+      events = result["encounters"]
+      lines.append(f"{result['solver']}: {len(events['time'])} close encounter(s)")
+      for (t, i, j, distance, min_distance) in zip(*(events[key] for key in ["time", "i", "j", "distance", "min_distance"])):
+        lines.append(f"  {t / 365.25:10.3f} years  {names[i]} - {names[j]}  distance {distance:.3e} AU (closest {min_distance:.3e} AU)")
+    return "\n".join(lines)
+
+  def event_report(self):
+    """
+    :return: events of each run (one line per event), None if no event is watched
+    :rtype: str
+    """
+    if not self.events:
+      return None
+
+    names = self.bodies.names + self.bodies.particle_names
+    lines = []
+    for result in self.results:
+      events = result["events"]
+      lines.append(f"{result['solver']}: {len(events['time'])} event(s)")
+      for (t, kind, i, j, distance) in zip(*(events[key] for key in ["time", "event", "i", "j", "distance"])):
+        lines.append(f"  {t / 365.25:12.6f} years  {EVENT_KINDS[kind]:<15} {names[i]} - {names[j]}  distance {distance:.6e} AU")
+    return "\n".join(lines)
+
+  def profile_report(self):
+    """
+    :return: table of the per-phase timings of the runs (--profile), None if no run was timed
+    (results read from the cache are not)
+    :rtype: str
+    """
+    metrics = [result["metrics"] for result in self.results if "metrics" in result]
+    return format_metrics(metrics) if len(metrics) else None
+
+  def cache_key(self, solver):
+    """
+    Hash of everything the result of a solver depends on.
+    """
+    config = {
+      "solver": solver["call"].__name__,
+      "initial_positions": self.bodies.initial_positions.tolist(),
+      "initial_impulsions": self.bodies.initial_impulsions.tolist(),
+      "masses": self.bodies.masses.tolist(),
+      "G": G,
+      "t0": self.t0,
+      "tN": self.tN,
+      "dt": self.dt,
+      "record_every": self.record_every,
+      "force": self.options.get("force", "direct"),
+      "backend": self.backend.name
+    }
+    if isinstance(self.dpdt, BarnesHut):
+      config["theta"] = self.dpdt.theta
+    if solver.get("adaptive"):
+      config["tolerance"] = self.tolerance
+    if self.storage_dtype != np.float64:
+      config["storage_dtype"] = self.storage_dtype.name
+    if self.bodies.n_particles:
+      config["particle_positions"] = self.bodies.particle_positions.tolist()
+      config["particle_velocities"] = self.bodies.particle_velocities.tolist()
+      config["particles_every"] = self.particles_every
+    if self.encounters is not None:
+      # "stop" and "refine" change the trajectory
+      config["encounters"] = self.encounter_config()
+
+    return ResultCache.key(config)
+
+  def diagnostics_cache_config(self, key, every):
+    if self.storage_dtype != np.float64:
+      # diagnostics recorded during the run, at every stored state => same entry for any diagnostics_every
+      return {"result": key, "recorded_diagnostics": True}
+    return {"result": key, "diagnostics_every": every}
+
+  def encounters_cache_config(self, key):
+    return {"result": key, "encounters": True}
+
+  def events_cache_config(self, key):
+    return {"result": key, "events": self.events}
+
+  def load_cached(self, solver):
+    if self.cache is None:
+      return None
+
+    key = self.cache_key(solver)
+    arrays = self.cache.get(key)
+    if arrays is None:
+      return None
+
+    result = {"solver": solver["name"], "color": solver["color"], "time": arrays["time"], "q": arrays["q"], "p": arrays["p"], "cache_key": key}
+    self.attach_particles(result, arrays)
+    if self.encounters is not None:
+      # events of the run, in their own entry
+      events = self.cache.get(ResultCache.key(self.encounters_cache_config(key)))
+      if events is None:
+        return None
+      result["encounters"] = events
+    if self.events:
+      events = self.cache.get(ResultCache.key(self.events_cache_config(key)))
+      if events is None:
+        return None
+      result["events"] = events
+    if self.storage_dtype != np.float64:
+      # full precision diagnostics of a lower precision trajectory: they cannot be recomputed from it
+      diagnostics = self.cache.get(ResultCache.key(self.diagnostics_cache_config(key, None)))
+      if diagnostics is None:
+        return None
+      self.attach_diagnostics(result, diagnostics)
+    return result
+
+  def store_cached(self, solver, result):
+    if self.cache is None:
+      return
+
+    result["cache_key"] = self.cache_key(solver)
+    arrays = {name: result[name] for name in ["time", "q", "p", *test_particle_fields(0, 0)] if name in result}
+    self.cache.put(result["cache_key"], arrays, self.metadata(solver["call"], self.bodies))
+
+    if "encounters" in result:
+      config = self.encounters_cache_config(result["cache_key"])
+      self.cache.put(ResultCache.key(config), result["encounters"], config)
+
+    if "events" in result:
+      config = self.events_cache_config(result["cache_key"])
+      self.cache.put(ResultCache.key(config), result["events"], config)
+
+    if "recorded_diagnostics" in result:
+      # full precision diagnostics of a lower precision trajectory: they cannot be recomputed from it
+      config = self.diagnostics_cache_config(result["cache_key"], None)
+      self.cache.put(ResultCache.key(config), result["recorded_diagnostics"], config)
+
+  def simulate_parallel(self, jobs, solvers):
+    """
+    Same as simulate but each solver runs in its own worker process.
+    The workers write the trajectories in shared memory blocks (or in the on-disk store)
+    allocated here, so that the arrays do not have to be pickled back.
+
+    :return: result of each solver
+    :rtype: list
+    """
+    shape = (self.n_records, len(self.bodies) * 3)
+    profile = self.options.get("profile", False)
+    results = []
+    self.shared_memory = []
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+      futures = []
+      for solver in solvers:
+        output_dir = self.output_dir(solver["call"])
+        if solver.get("adaptive"):
+          metadata = dict(self.metadata(solver["call"], self.bodies), tolerance=self.tolerance)
+          future = executor.submit(solve_adaptive_in_worker, solver["call"], self.dpdt, self.bodies, self.t0, self.tN, self.dt, self.tolerance, self.record_every, output_dir=output_dir, metadata=metadata, profile=profile, dtype=self.storage_dtype, particles_every=self.particles_every, hooks=self.worker_hooks(output_dir))
+          arrays = None
+        elif output_dir is not None:
+          future = executor.submit(solve_in_worker, self.backend_name, solver["call"], self.dpdt, self.bodies, self.dt, self.nt, self.record_every, shape, sink_options=self.sink_options(solver["call"], self.bodies, output_dir), profile=profile, dtype=self.storage_dtype, particles_every=self.particles_every, hooks=self.worker_hooks(output_dir))
+          arrays = None
+        else:
+          (q_block, q), (p_block, p) = create_shared_array(shape, self.storage_dtype), create_shared_array(shape, self.storage_dtype)
+          self.shared_memory += [q_block, p_block]
+          arrays = {"q": q, "p": p}
+
+          # test particles in their own blocks
+          particle_names = None
+          if self.bodies.n_particles:
+            particle_names = []
+            for (name, field_shape) in test_particle_fields(self.n_records, self.bodies.n_particles, self.particles_every).items():
+              block, arrays[name] = create_shared_array(field_shape, self.storage_dtype)
+              self.shared_memory.append(block)
+              particle_names.append(block.name)
+
+          future = executor.submit(solve_in_worker, self.backend_name, solver["call"], self.dpdt, self.bodies, self.dt, self.nt, self.record_every, shape, shared_names=[q_block.name, p_block.name], profile=profile, dtype=self.storage_dtype, particle_names=particle_names, particles_every=self.particles_every, hooks=self.worker_hooks(None))
+
+        futures.append((solver, future, output_dir, arrays))
+
+      for (solver, future, output_dir, arrays) in futures:
+        # re-raise any exception of the worker
+        output, metrics = future.result()
+        encounters, events, n_records = None, None, None
+        if output is not None and "n_records" in output:
+          output = dict(output)
+          encounters, events, n_records = output.pop("encounters", None), output.pop("events", None), output.pop("n_records")
+
+        if output_dir is not None:
+          metadata, arrays = load_trajectory(output_dir)
+        elif output:
+          # trajectory of an adaptive scheme, or diagnostics of a fixed step one
+          arrays = dict(arrays or {}, **output)
+
+        # the preallocated blocks are longer than a run stopped on an encounter
+        arrays = {name: array[:n_records] for (name, array) in arrays.items()}
+        time = arrays["time"] if solver.get("adaptive") else self.time_mesh[:n_records]
+        results.append({"solver": solver["name"], "color": solver["color"], "time": time, "q": arrays["q"], "p": arrays["p"]})
+        if "energy" in arrays:
+          self.attach_diagnostics(results[-1], arrays)
+        self.attach_particles(results[-1], arrays)
+        if encounters is not None:
+          results[-1]["encounters"] = encounters
+        if events is not None:
+          results[-1]["events"] = events
+        if metrics is not None:
+          # named as in the serial mode
+          metrics.name = solver["name"]
+          results[-1]["metrics"] = metrics
+
+    # the blocks stay mapped in this process until it exits,
+    # only their names are removed
+    for block in self.shared_memory:
+      block.unlink()
+
+    return results
+
+  def compute_diagnostics(self, every=None):
+    """
+    Energy, angular momentum and area swept of each result, computed in one vectorized pass
+    over the stored trajectory (or one stored state out of `every`).
+    Only done once, when a plot needs them.
+    """
+    if every is None:
+      every = self.options.get("diagnostics_every", 1)
+
+    for result in self.results:
+      if "energy" in result:
+        continue
+
+      if self.storage_dtype != np.float64:
+        raise RuntimeError(f"{result['solver']}: no recorded diagnostics, they cannot be recomputed from a {self.storage_dtype.name} trajectory")
+
+      key = None
+      if self.cache is not None and "cache_key" in result:
+        key = ResultCache.key(self.diagnostics_cache_config(result["cache_key"], every))
+        diagnostics = self.cache.get(key)
+        if diagnostics is not None:
+          result.update(diagnostics)
+          continue
+
+      # timed with the run it belongs to (--profile)
+      with result["metrics"].phase("diagnostics") if "metrics" in result else contextlib.nullcontext():
+        energy, angular_momentum, area_swept = compute_diagnostics(q=result["q"][::every], p=result["p"][::every], bodies=self.bodies)
+
+      diagnostics = {"energy": energy, "angular_momentum": angular_momentum, "area_swept": area_swept, "diagnostics_time": result["time"][::every]}
+      result.update(diagnostics)
+
+      if key is not None:
+        self.cache.put(key, diagnostics, self.diagnostics_cache_config(result["cache_key"], every))
+
+  def horizon(self, tN):
+    """
+    Same simulation stopped at an earlier time: t0, the initial conditions and dt being shared,
+    its trajectories are the first states of the ones of this simulation.
+    The results (and diagnostics) of the returned simulation are views on those of this one, nothing is integrated again.
+
+    :param tN: final time (in days), not after self.tN
+    :return: simulation ending at tN (with its own figures folder)
+    :rtype: NBodySimulation
+    """
+    self.compute_diagnostics()
+
+    view = copy.copy(self)
+    view.tN = tN
+    view.nt = int((tN - self.t0) / self.dt)
+    view.n_records = (view.nt - 1) // self.record_every + 1
+    view.time_mesh = self.time_mesh[:view.n_records]
+    view.set_figures_dir()
+
+    every = self.options.get("diagnostics_every", 1)
+    # states up to the last time step of a run ending at tN (fixed step schemes => its first n_records states)
+    last = self.t0 + (view.nt - 1) * self.dt + self.dt / 2
+
+    view.results = []
+    for result in self.results:
+      n = np.searchsorted(result["time"], last, side="right")
+      n_diagnostics = (n - 1) // every + 1
+
+      # the cache key (and the diagnostics it stores) of the result does not describe the view
+      view_result = {key: value for (key, value) in result.items() if key not in ("cache_key", "recorded_diagnostics")}
+      view_result.update({key: result[key][:n] for key in ["time", "q", "p"]})
+      if "particles_q" in result:
+        if self.particles_every:
+          view_result.update({key: result[key][:test_particle_records(n, self.particles_every)] for key in test_particle_fields(0, 0)})
+        elif n < len(result["q"]):
+          # only the last state of the whole run is stored => no test particles at an earlier horizon
+          for key in test_particle_fields(0, 0):
+            del view_result[key]
+      view_result.update({key: result[key][:n_diagnostics] for key in ["energy", "angular_momentum", "area_swept", "diagnostics_time"] if key in result})
+      if "encounters" in result:
+        events = result["encounters"]
+        view_result["encounters"] = {key: values[events["time"] < last] for (key, values) in events.items()}
+      if "events" in result:
+        events = result["events"]
+        view_result["events"] = {key: values[events["time"] < last] for (key, values) in events.items()}
+      view.results.append(view_result)
+
+    return view
+
+  def solve_ensemble(self, solver, positions, impulsions, dt, nt, bodies, adaptive=False):
+    """
+    Integrate M systems (e.g. perturbed initial conditions) together.
+    The M members are stacked along a second axis so that each step of the solver
+    advances all of them at once in vectorized form.
+
+    :param positions: initial positions of each member, shape (M, N, 3)
+    :param impulsions: initial impulsions of each member, shape (M, N, 3)
+
+    :param adaptive: solver is an adaptive scheme (all the members then share the same time steps)
+    :return: time mesh, q, p of shape (M, n_records, 3N)
+    """
+    positions = np.array(positions, dtype=float)
+    impulsions = np.array(impulsions, dtype=float)
+    n_members = positions.shape[0]
+
+    # shift the coordinate frame of each member so that its barycenter is at rest.
+    masses = bodies.masses
+    mean_pos = np.sum(positions * masses[:, np.newaxis], axis=1) / self.total_mass
+    mean_vel = np.sum(impulsions, axis=1) / self.total_mass
+    positions -= mean_pos[:, np.newaxis]
+    impulsions -= masses[:, np.newaxis] * mean_vel[:, np.newaxis]
+
+    if adaptive:
+      time, q, p = solver(dqdt=n_body_dqdt, dpdt=self.dpdt, q0=positions.reshape([n_members, -1]), p0=impulsions.reshape([n_members, -1]), t0=self.t0, tN=self.tN, dt=dt, bodies=bodies, tolerance=self.tolerance, record_every=self.record_every)
+    else:
+      time = self.time_mesh
+      q = np.zeros((self.n_records, n_members, len(bodies) * 3))
+      p = np.zeros((self.n_records, n_members, len(bodies) * 3))
 
-    # set initial energy
-    #print(energy)
-    #print(hamiltonian(qk=q[0], pk=p[0], bodies=bodies))
-    energy[0] = hamiltonian(qk=q[0], pk=p[0], bodies=bodies)
-    angular_momentum[0] = compute_angular_momentum(qk=q[0], pk=p[0], bodies=bodies)
-    area_swept[0] = 0
+      # set initial conditions
+      q[0] = positions.reshape([n_members, -1])
+      p[0] = impulsions.reshape([n_members, -1])
 
-    return solver(dqdt=n_body_dqdt, dpdt=n_body_dpdt, q=q, p=p, dt=dt, nt=nt, bodies=bodies, energy=energy, angular_momentum=angular_momentum, area_swept=area_swept)
+      q, p = solver(dqdt=n_body_dqdt, dpdt=self.dpdt, q=q, p=p, dt=dt, nt=nt, bodies=bodies, record_every=self.record_every)
 
-  def simulate(self):
-    self.results = []
-    for solver in self.solvers:
-      q, p, energy, angular_momentum, area_swept = self.solve(solver=solver["call"], dt=self.dt, nt=self.nt, bodies=self.bodies)
-      self.results.append({"solver": solver["name"], "color": solver["color"], "q": q, "p": p, "energy": energy, "angular_momentum": angular_momentum, "area_swept": area_swept})
+    # member first: (nt, M, ...) => (M, nt, ...)
+    return time, np.moveaxis(q, 1, 0), np.moveaxis(p, 1, 0)
+
+  def simulate_ensemble(self, positions, impulsions, solver_name="stormer-verlet", diagnostics=True):
+    solver = self.solvers2[solver_name]
+    time, q, p = self.solve_ensemble(solver=solver["call"], positions=positions, impulsions=impulsions, dt=self.dt, nt=self.nt, bodies=self.bodies, adaptive=solver.get("adaptive", False))
+    result = {"solver": solver["name"], "color": solver["color"], "time": time, "q": q, "p": p}
+
+    if diagnostics:
+      # time first for the diagnostics pass: (M, nt, 3N) => (nt, M, 3N)
+      energy, angular_momentum, area_swept = compute_diagnostics(q=np.moveaxis(q, 0, 1), p=np.moveaxis(p, 0, 1), bodies=self.bodies)
+      result.update({"energy": energy.T, "angular_momentum": np.moveaxis(angular_momentum, 0, 1), "area_swept": area_swept.T})
+
+    return result
 
   def plot2D(self):
-    self.fig = plt.figure(figsize=(set_size_square_plot(width="full-size", subplots=(2,2))))
+    # two subplots per row
+    rows = max(2, int(np.ceil(len(self.results) / 2)))
+    self.fig = plt.figure(figsize=(set_size_square_plot(width="full-size", subplots=(rows,2))))
     # loop for each result (corresponding to a specific solving method)
     for (index, result) in enumerate(self.results):
       # create a 2D plot
-      ax = self.fig.add_subplot(2, 2, index + 1)
+      ax = self.fig.add_subplot(rows, 2, index + 1)
       # set plot parameters
       ax.set_title(result["solver"], fontsize=8)
       #ax.text(0.5, 1.05, f"({index + 1})", ha="center", transform=ax.transAxes, size=8)
 
+      max_range = self.limit_plot(result["q"])
+
+      ax.set_xlim(-max_range, max_range)
+      ax.set_ylim(-max_range, max_range)
+
+      # half a pixel, in AU
+      pixel_size = max_range / min(self.pixels(ax))
+
       # plotting each body
-      for (ind, body) in enumerate(self.bodies):
+      for ind in range(len(self.bodies)):
         x_index = (ind * 3)
         y_index = (ind * 3) + 1
 
-        x, y = result["q"][:,x_index], result["q"][:,y_index]
-        ax.plot(x, y, c=body.color, label=body.name, marker=body.marker)
+        # only the points that change the path drawn at the resolution of the figure
+        points = result["q"][:,[x_index, y_index]]
+        x, y = points[pixel_downsample(points, pixel_size)].T
+        ax.plot(x, y, c=self.bodies.colors[ind], label=self.bodies.names[ind], marker=self.bodies.markers[ind])
+
+      # test particles: last stored positions only (one point each)
+      if "particles_q" in result:
+        x, y = result["particles_q"][-1, :, :2].T
+        ax.scatter(x, y, c=self.bodies.particle_colors, s=self.bodies.particle_markersizes, marker=".", linewidths=0)
 
       # set labels
       ax.set_xlabel("x (AU)")
       ax.set_ylabel("y (AU)")
       #ax.legend()
 
-      max_range = self.limit_plot(result["q"])
-
-      ax.set_xlim(-max_range, max_range)
-      ax.set_ylim(-max_range, max_range)
-
     plt.tight_layout()
 
     if self.options["save"]:
-      self.fig.savefig(f"{self.figures_dir}/orbital-plot2d.png", dpi=600)
+      self.save_figure("orbital-plot2d.png", dpi=600)
 
-    plt.show()
+    self.show()
 
   def plot3D(self):
-    self.fig = plt.figure(figsize=(set_size_square_plot(width="full-size", subplots=(2,2))))
+    # two subplots per row
+    rows = max(2, int(np.ceil(len(self.results) / 2)))
+    self.fig = plt.figure(figsize=(set_size_square_plot(width="full-size", subplots=(rows,2))))
     # loop for each result (corresponding to a specific solving method)
     for (index, result) in enumerate(self.results):
       # create a 3D plot
-      ax = self.fig.add_subplot(2, 2, index + 1, projection="3d")
+      ax = self.fig.add_subplot(rows, 2, index + 1, projection="3d")
       # set plot parameters
       ax.set_title(result["solver"], fontsize=8)
 
+      max_range = self.limit_plot(result["q"])
+
+      ax.set_xlim(-max_range, max_range)
+      ax.set_ylim(-max_range, max_range)
+      ax.set_zlim(-max_range, max_range)
+
+      # half a pixel, in AU
+      pixel_size = max_range / min(self.pixels(ax))
+
       # plotting each body
-      for (ind, body) in enumerate(self.bodies):
-        x_index = (ind * 3)
-        y_index = (ind * 3) + 1
-        z_index = (ind * 3) + 2
+      for ind in range(len(self.bodies)):
+        # only the points that change the path drawn at the resolution of the figure
+        points = result["q"][:,(ind * 3):(ind * 3) + 3]
+        x, y, z = points[pixel_downsample(points, pixel_size)].T
+        ax.plot(xs=x, ys=y, zs=z, c=self.bodies.colors[ind], marker=self.bodies.markers[ind], label=self.bodies.names[ind])
 
-        x, y, z = result["q"][:,x_index], result["q"][:,y_index], result["q"][:,z_index]
-        ax.plot(xs=x, ys=y, zs=z, c=body.color, marker=body.marker, label=body.name)
+      # test particles: last stored positions only (one point each)
+      if "particles_q" in result:
+        x, y, z = result["particles_q"][-1].T
+        ax.scatter(xs=x, ys=y, zs=z, c=self.bodies.particle_colors, s=self.bodies.particle_markersizes, marker=".", linewidths=0)
 
       # set labels
       ax.set_xlabel("x (AU)", fontsize=6)
       ax.set_ylabel("y (AU)", fontsize=6)
       ax.set_zlabel("z (AU)", fontsize=6)
 
-      max_range = self.limit_plot(result["q"])
-
-      ax.set_xlim(-max_range, max_range)
-      ax.set_ylim(-max_range, max_range)
-      ax.set_zlim(-max_range, max_range)
-
 
     plt.tight_layout()
 
     if self.options["save"]:
-      self.fig.savefig(f"{self.figures_dir}/orbital-plot3d.png", dpi=600)
-
-    plt.show()
+      self.save_figure("orbital-plot3d.png", dpi=600)
+
+    self.show()
+
+  def pixels(self, ax):
+    """
+    :return: width and height of the axes in pixels, at the resolution the figure is shown or saved (600 dpi)
+    :rtype: (float, float)
+    """
+    dpi = 600 if self.options["save"] else self.fig.dpi
+    bbox = ax.get_window_extent()
+    return bbox.width * dpi / self.fig.dpi, bbox.height * dpi / self.fig.dpi
+
+  def downsample(self, ax, time, values):
+    """
+    Min/max decimation of a time series to the pixel columns of the axes (same curve, far fewer points).
+    """
+    indices = minmax_downsample(time, values, n_buckets=int(self.pixels(ax)[0]))
+    return time[indices], values[indices]
 
   def plot_energy(self):
     self.fig = plt.figure(figsize=(set_size(width="full-size")))
@@ -187,19 +877,22 @@ class NBodySimulation():
 
     ax.set_title(f"Energie du système à {len(self.bodies)}-corps", fontsize=10)
 
+    self.compute_diagnostics()
+
     for (index, result) in enumerate(self.results):
       #solver_name = result["solver"]
       # kg * au^2 / day^2 => kg * m^2 / s^2 => kJ
       energy = result["energy"] * ((au_to_meter ** 2) / (day_to_second ** 2)) / 1000
-      ax.plot(self.time_mesh / 365.25, energy, c=result["color"], label=result["solver"])
+      time, energy = self.downsample(ax, result["diagnostics_time"], energy)
+      ax.plot(time / 365.25, energy, c=result["color"], label=result["solver"])
       ax.set_xlabel("Temps [années]")
       ax.set_ylabel("Energie totale [$kJ$]")
       ax.legend()
 
     if self.options["save"]:
-      self.fig.savefig(f"{self.figures_dir}/orbital-energy.pdf")
+      self.save_figure("orbital-energy.pdf")
 
-    plt.show()
+    self.show()
 
   def plot_angular_momentum(self):
     self.fig = plt.figure(figsize=(set_size(width="full-size")))
@@ -207,13 +900,16 @@ class NBodySimulation():
 
     ax.set_title(f"Moment angulaire du système à {len(self.bodies)}-corps", fontsize=10)
 
+    self.compute_diagnostics()
+
     for (index, result) in enumerate(self.results):
       #ax = self.fig.add_subplot(2, 2, index + 1)
       #solver_name = result["solver"]
 
-      # kg * au^2 / day => kg * m^2 / s
-      angular_momentum = result["angular_momentum"] * ((au_to_meter ** 2) / (day_to_second))
-      ax.plot(self.time_mesh / 365.25, angular_momentum, c=result["color"], label=result["solver"])
+      # ||L|| -- kg * au^2 / day => kg * m^2 / s
+      angular_momentum = np.linalg.norm(result["angular_momentum"], axis=-1) * ((au_to_meter ** 2) / (day_to_second))
+      time, angular_momentum = self.downsample(ax, result["diagnostics_time"], angular_momentum)
+      ax.plot(time / 365.25, angular_momentum, c=result["color"], label=result["solver"])
 
       #for (ind, body) in enumerate(self.bodies):
       #  ax.plot(self.time_mesh / 365.25, angular_momentum[:,ind], c=body.color, label=body.name)
@@ -230,9 +926,9 @@ class NBodySimulation():
     plt.tight_layout()
 
     if self.options["save"]:
-      self.fig.savefig(f"{self.figures_dir}/orbital-angular-momentum.pdf")
+      self.save_figure("orbital-angular-momentum.pdf")
 
-    plt.show()
+    self.show()
 
   def plot_area_swept(self):
     self.fig = plt.figure(figsize=(set_size(width="full-size")))
@@ -240,9 +936,11 @@ class NBodySimulation():
 
     ax.set_title(f"Surface totale balayée pour le système à {len(self.bodies)}-corps", fontsize=10)
 
+    self.compute_diagnostics()
+
     for (index, result) in enumerate(self.results):
-      area_swept = result["area_swept"]
-      ax.plot(self.time_mesh / 365.25, area_swept, c=result["color"], label=result["solver"])
+      time, area_swept = self.downsample(ax, result["diagnostics_time"], result["area_swept"])
+      ax.plot(time / 365.25, area_swept, c=result["color"], label=result["solver"])
 
       #ax.tick_params(axis='both', which='major', labelsize=8)
       #ax.tick_params(axis='both', which='minor', labelsize=6)
@@ -254,27 +952,26 @@ class NBodySimulation():
     plt.tight_layout()
 
     if self.options["save"]:
-      self.fig.savefig(f"{self.figures_dir}/orbital-total_area_swept.pdf")
+      self.save_figure("orbital-total_area_swept.pdf")
 
-    plt.show()
+    self.show()
+
+  def update(self, time):
+    # portion of the path (ring buffer of the last states), head first
+    trail = self.trail.latest()
 
-  def update(self, index):
     for i in range(len(self.bodies)):
       x_index = (i * 3)
       y_index = (i * 3) + 1
       z_index = (i * 3) + 2
 
-      # show a portion of the path
-      trail = 40
-      beginning = max(1, index - trail)
-
-      x = self.q[index:beginning:-1,x_index]
-      y = self.q[index:beginning:-1,y_index]
-      z = self.q[index:beginning:-1,z_index]
+      x = trail[:,x_index]
+      y = trail[:,y_index]
+      z = trail[:,z_index]
 
       # update elapsed time
-      #print(f"Temps écoulé: {round(self.time_mesh[index] / 365.25, 1)} ans")
-      self.elapsed_text.set_text(f"Temps écoulé: {round(self.time_mesh[index] / 365.25, 1)} ans")
+      #print(f"Temps écoulé: {round(time / 365.25, 1)} ans")
+      self.elapsed_text.set_text(f"Temps écoulé: {round(time / 365.25, 1)} ans")
 
       self.lines[i].set_data_3d(x, y, z)
 
@@ -283,6 +980,51 @@ class NBodySimulation():
 
     return tuple(self.lines) + (self.elapsed_text,) #+ self.points
 
+  def frames(self):
+    """
+    Consumer side of the animation: push the states of each chunk handed over by the producer
+    in the trail and yield their time, one frame per state.
+    Runs on the GUI thread => never blocks: while the producer is behind, the current frame is kept.
+    """
+    t = self.t0
+    while True:
+      try:
+        chunk = self.producer.get(timeout=0.01)
+      except queue.Empty:
+        yield t
+        continue
+      if chunk is None:
+        return
+
+      (time, q, p) = chunk
+      for (t, state) in zip(time, q):
+        self.trail.append(state)
+        yield t
+
+  def trajectory_chunks(self, solver):
+    """
+    Producer side of the animation: chunks of DATA_SUB_INTERVAL_LENGTH days of trajectory,
+    with one state every DATA_PLOT_REFRESH days.
+    Read from the cache if the run is there, integrated on the fly otherwise
+    (the adaptive scheme has no fixed step to stream and is integrated first).
+    Generator => all of this runs in the producer thread.
+    """
+    chunk_length = int(DATA_SUB_INTERVAL_LENGTH / DATA_PLOT_REFRESH)
+
+    result = self.load_cached(solver)
+    if result is None and solver.get("adaptive"):
+      result = self.simulate_solver(solver)
+      self.store_cached(solver, result)
+
+    if result is not None:
+      # fixed step schemes: one stored state every DATA_PLOT_REFRESH days
+      stride = 1 if solver.get("adaptive") else max(1, int(round(DATA_PLOT_REFRESH / (self.record_every * self.dt))))
+      yield from array_chunks(result["time"][::stride], result["q"][::stride], result["p"][::stride], chunk_length=chunk_length)
+      return
+
+    stride = max(1, int(round(DATA_PLOT_REFRESH / self.dt)))
+    yield from trajectory_chunks(solver["step"], n_body_dqdt, self.dpdt, self.bodies.q0, self.bodies.p0, self.t0, self.dt, self.nt, self.bodies, stride=stride, chunk_length=chunk_length)
+
   def init(self):
     for line in self.lines: #line, point in zip(self.lines, self.points):
       line.set_data_3d([], [], [])
@@ -293,6 +1035,9 @@ class NBodySimulation():
     return tuple(self.lines) + (self.elapsed_text,) #+ self.points
 
   def animate(self, solver_name):
+    if solver_name == "wisdom-holman" and not wisdom_holman_applies(self.bodies):
+      raise ValueError("wisdom-holman: its Kepler drifts need the first body to hold most of the mass (the Sun first)")
+
     self.fig = plt.figure(figsize=(8, 8))
     self.axes = self.fig.add_subplot(projection="3d")
 
@@ -309,15 +1054,15 @@ class NBodySimulation():
     self.lines = sum([
       self.axes.plot(
         [], [], [],
-        body.marker_anim,
+        marker_anim,
         #'-',
-        color=body.color,
+        color=color,
         linewidth=2,
         markevery=10000,
-        markersize=body.markersize,
-        markerfacecolor=body.color,
-        label=body.name
-      ) for body in self.bodies
+        markersize=markersize,
+        markerfacecolor=color,
+        label=name
+      ) for (name, color, marker_anim, markersize) in zip(self.bodies.names, self.bodies.colors, self.bodies.markers_anim, self.bodies.markersizes)
     ], [])
 
     # self.points = sum([
@@ -335,11 +1080,15 @@ class NBodySimulation():
 
     self.axes.legend()
 
-    # solve for that specific solver
+    # the trajectory of that specific solver is integrated on a background thread
+    # while the frames are drawn, only the last states (trail) are kept
     solver = self.solvers2[solver_name]
-    self.q, self.p, energy, angular_momentum, area_swept = self.solve(solver=solver["call"], dt=self.dt, nt=self.nt, bodies=self.bodies)
+    self.trail = RingBuffer(capacity=40, size=len(self.bodies) * 3)
+    self.producer = Producer(self.trajectory_chunks(solver))
+    self.fig.canvas.mpl_connect("close_event", lambda event: self.producer.stop())
 
-    max_range = self.limit_plot(self.q)
+    # the whole trajectory is not known beforehand => size of the orbits
+    max_range = 1.05 * self.orbits_extent()
 
     # limiting plot
     self.axes.set_xlim([-max_range,max_range])
@@ -360,27 +1109,32 @@ class NBodySimulation():
       fig=self.fig,
       func=self.update,
       init_func=self.init,
-      frames=4000,
+      frames=self.frames,
       interval=5,
-      blit=True
+      blit=True,
+      cache_frame_data=False
     )
 
     plt.show()
 
-  def limit_plot(self, q):
-    max_range = 0
-
-    for (ind, body) in enumerate(self.bodies):
-      x_index = (ind * 3)
-      y_index = (ind * 3) + 1
-      z_index = (ind * 3) + 2
-
-      x, y, z = q[:,x_index], q[:,y_index], q[:,z_index]
+  def orbits_extent(self):
+    """
+    Largest distance to the barycenter reached by the bodies, estimated from the initial conditions
+    (apocenter of the two-body orbit of each body around the total mass, initial distance for unbound orbits).
+    """
+    positions = self.bodies.initial_positions
+    velocities = self.bodies.initial_impulsions * self.bodies.inverse_masses[:, np.newaxis]
+    mu = G * self.total_mass
 
-      max_dim = max(max(x), max(y), max(z))
-      if max_dim > max_range:
-        max_range = max_dim
-
-    return max_range
+    r = np.linalg.norm(positions, axis=1)
+    energy = np.sum(velocities ** 2, axis=1) / 2 - mu / r
+    h = np.linalg.norm(np.cross(positions, velocities), axis=1)
 
+    bound = energy < 0
+    a = - mu / (2 * np.where(bound, energy, -1.))
+    e = np.sqrt(np.maximum(1 + 2 * energy * h ** 2 / mu ** 2, 0.))
+    return np.max(np.where(bound, a * (1 + e), r))
 
+  def limit_plot(self, q):
+    # largest coordinate of all the bodies (one vectorized pass instead of a max() per column)
+    return np.max(q)
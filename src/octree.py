@@ -0,0 +1,146 @@
+import numpy as np
+from consts import G
+from .edo import test_particle_accelerations
+
+class Octree():
+  """
+  Barnes-Hut octree of a set of point masses.
+
+  The tree is built level by level: at each level, the bodies of every node holding
+  more than one body are dispatched in the 8 octants of that node (vectorized over all the nodes of the level).
+  Nodes are stored as flat arrays, the children of a node being contiguous => child_start, child_count.
+  """
+  def __init__(self, positions, masses, max_depth=64):
+    """
+    :param positions: positions of the bodies, shape (N, 3)
+    :param masses: masses of the bodies, shape (N,)
+    """
+    n_bodies = len(masses)
+
+    lower, upper = positions.min(axis=0), positions.max(axis=0)
+    self.center = ((lower + upper) / 2)[np.newaxis]
+    self.size = np.array([max(np.max(upper - lower), np.finfo(float).tiny)])
+    self.mass = np.array([np.sum(masses)])
+    self.com = (np.sum(positions * masses[:, np.newaxis], axis=0) / self.mass[0])[np.newaxis]
+    self.child_start = np.zeros(1, dtype=int)
+    self.child_count = np.zeros(1, dtype=int)
+
+    # node holding each body at the current level
+    body_node = np.zeros(n_bodies, dtype=int)
+    active = np.arange(n_bodies)
+
+    for depth in range(max_depth):
+      n_nodes = len(self.mass)
+
+      # only nodes holding several bodies are split
+      counts = np.bincount(body_node[active], minlength=n_nodes)
+      active = active[counts[body_node[active]] > 1]
+      if len(active) == 0:
+        break
+
+      parents = body_node[active]
+      octants = np.sum((positions[active] > self.center[parents]) * [1, 2, 4], axis=1)
+
+      # one child per (parent, octant) actually holding bodies
+      keys, inverse = np.unique(parents * 8 + octants, return_inverse=True)
+      child_parents, child_octants = keys // 8, keys % 8
+
+      offsets = ((child_octants[:, np.newaxis] >> [0, 1, 2]) & 1) - 0.5
+      child_size = self.size[child_parents] / 2
+      child_mass = np.bincount(inverse, weights=masses[active])
+      child_com = np.stack([np.bincount(inverse, weights=masses[active] * positions[active, axis]) for axis in range(3)], axis=1) / child_mass[:, np.newaxis]
+
+      # children of a same parent are contiguous (keys are sorted)
+      unique_parents, first, n_children = np.unique(child_parents, return_index=True, return_counts=True)
+      self.child_start[unique_parents] = n_nodes + first
+      self.child_count[unique_parents] = n_children
+
+      self.center = np.concatenate([self.center, self.center[child_parents] + offsets * child_size[:, np.newaxis]])
+      self.size = np.concatenate([self.size, child_size])
+      self.mass = np.concatenate([self.mass, child_mass])
+      self.com = np.concatenate([self.com, child_com])
+      self.child_start = np.concatenate([self.child_start, np.zeros(len(keys), dtype=int)])
+      self.child_count = np.concatenate([self.child_count, np.zeros(len(keys), dtype=int)])
+
+      body_node[active] = n_nodes + inverse
+
+    # body held by each leaf (-1 for internal nodes)
+    self.body = np.full(len(self.mass), -1)
+    self.body[body_node] = np.arange(n_bodies)
+
+  def accelerations(self, positions, theta):
+    """
+    Gravitational acceleration of each body.
+    All the (body, node) interactions of a tree level are evaluated at once:
+    a node is accepted if it is a leaf or if it is seen under an angle size / d < theta
+    (and does not contain the body), otherwise it is replaced by its children.
+
+    :param positions: positions of the bodies the tree was built from, shape (N, 3)
+    :param theta: opening angle
+    :return: accelerations, shape (N, 3)
+    """
+    acc = np.zeros(positions.shape)
+
+    targets = np.arange(len(positions))
+    nodes = np.zeros(len(positions), dtype=int)
+
+    while len(targets):
+      d = self.com[nodes] - positions[targets]
+      r2 = np.sum(d ** 2, axis=1)
+
+      leaf = self.child_count[nodes] == 0
+      inside = np.all(np.abs(positions[targets] - self.center[nodes]) <= self.size[nodes, np.newaxis] / 2, axis=1)
+      far = (self.size[nodes] ** 2 < (theta ** 2) * r2) & ~inside
+      accepted = leaf | far
+
+      # a body does not attract itself
+      interacting = accepted & (self.body[nodes] != targets) & (r2 > 0)
+      a = (G * self.mass[nodes[interacting]] * r2[interacting] ** -1.5)[:, np.newaxis] * d[interacting]
+      for axis in range(3):
+        acc[:, axis] += np.bincount(targets[interacting], weights=a[:, axis], minlength=len(positions))
+
+      # open the remaining nodes
+      opened_targets, opened_nodes = targets[~accepted], nodes[~accepted]
+      counts = self.child_count[opened_nodes]
+      first = np.repeat(np.cumsum(counts) - counts, counts)
+      targets = np.repeat(opened_targets, counts)
+      nodes = np.repeat(self.child_start[opened_nodes], counts) + np.arange(len(targets)) - first
+
+    return acc
+
+class BarnesHut():
+  """
+  Barnes-Hut force engine, O(N log N) alternative to edo.n_body_dpdt.
+  Can be used in place of n_body_dpdt by the solvers: dpdt = BarnesHut(theta=0.5).
+  The octree is rebuilt from the positions at every evaluation.
+  """
+  def __init__(self, theta=0.5):
+    self.theta = theta
+
+  def __call__(self, qk, pk, bodies):
+    """
+    :param qk: n-body position state vector => qk: [x1, y1, z1, x2, y2, z2,..., xN, yN, zN]
+    :param pk: n-body impulsion state vector => pk: [px1, py1, pz1,..., pxN, pyN, pzN]
+    :param bodies: system of bodies (BodySystem)
+
+    :return: \dot{p} = - dh/dr
+    :rtype: ndarray
+    """
+    masses = bodies.masses
+    n = 3 * len(bodies)
+
+    # stack of systems (e.g. ensemble): one tree per system
+    positions = qk[..., :n].reshape([-1, len(bodies), 3])
+    dpdt = np.zeros(positions.shape)
+    for (index, q) in enumerate(positions):
+      tree = Octree(q, masses)
+      dpdt[index] = masses[:, np.newaxis] * tree.accelerations(q, self.theta)
+    dpdt = dpdt.reshape(qk.shape[:-1] + (n,))
+
+    if qk.shape[-1] > n:
+      # test particles (after the bodies): direct (particles x bodies) block, they are not in the tree
+      bodies_positions = qk[..., :n].reshape(qk.shape[:-1] + (-1, 3))
+      particles = qk[..., n:].reshape(qk.shape[:-1] + (-1, 3))
+      dpdt = np.concatenate([dpdt, test_particle_accelerations(bodies_positions, particles, bodies).reshape(qk.shape[:-1] + (-1,))], axis=-1)
+
+    return dpdt
@@ -0,0 +1,163 @@
+import numpy as np
+from multiprocessing import shared_memory
+
+from .edo import (n_body_dqdt, downcast_trajectory, DiagnosticsRecorder, test_particle_fields, split_test_particles, TestParticleRecorder)
+from .storage import (TrajectorySink, write_trajectory)
+from .backends import get_backend
+from .metrics import (Metrics, print_progress)
+from .hooks import RunHooks
+
+def create_shared_array(shape, dtype=np.float64):
+  """
+  Allocate an array in a shared memory block that worker processes can attach to by name.
+
+  :return: the shared memory block (must be kept alive as long as the array is used) and the array
+  :rtype: (SharedMemory, ndarray)
+  """
+  block = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1))
+  return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+def solve_in_worker(backend, solver, dpdt, bodies, dt, nt, record_every, shape, shared_names=None, sink_options=None, profile=False, dtype=np.float64, particle_names=None, particles_every=0, hooks=None):
+  """
+  Worker entry point of the parallel mode of NBodySimulation.simulate.
+  The trajectory is written in place, either in the shared memory blocks (q, p) allocated
+  by the parent process or in an on-disk TrajectorySink, so that nothing big is pickled back.
+
+  :param backend: name of the backend running the step loop
+  :param dpdt: force engine (edo.n_body_dpdt, octree.BarnesHut,...)
+  :param shape: shape of q and p => (n_records, 3N)
+  :param shared_names: names of the shared memory blocks of q and p
+  :param sink_options: arguments of the TrajectorySink to write to (instead of shared memory)
+  :param profile: instrument the run
+  :param dtype: dtype of q and p (the integration is always done in float64)
+  :param particle_names: names of the shared memory blocks of the test particles (particles_q, particles_p), if any
+  :param particles_every: stride between two stored states of the test particles, in records (0: only their last state)
+  :param hooks: hooks of the run (hooks.RunHooks) holding its close encounter and event detectors, if any:
+  the sink, metrics and recorders, which live in the worker, are added to it
+  :return: diagnostics computed during the integration (None if stored in float64 or in the sink),
+  along with the close encounters and events found and the number of records of the run ({"encounters": ..., "events": ..., "n_records": ..., "energy": ...}) if watched,
+  and metrics of the run (None if not profiled)
+  """
+  hooks = hooks if hooks is not None else RunHooks()
+  sink, blocks = None, []
+  if sink_options is not None:
+    sink = TrajectorySink(**sink_options)
+    q, p = sink.arrays["q"], sink.arrays["p"]
+  else:
+    blocks = [shared_memory.SharedMemory(name=name) for name in shared_names]
+    q, p = (np.ndarray(shape, dtype=dtype, buffer=block.buf) for block in blocks)
+
+  particle_arrays = None
+  if sink is not None:
+    particle_arrays = sink.arrays
+  elif particle_names is not None:
+    particle_blocks = [shared_memory.SharedMemory(name=name) for name in particle_names]
+    blocks += particle_blocks
+    particle_arrays = {name: np.ndarray(field_shape, dtype=dtype, buffer=block.buf) for ((name, field_shape), block) in zip(test_particle_fields(shape[0], bodies.n_particles, particles_every).items(), particle_blocks)}
+
+  # set initial conditions
+  q[0] = bodies.q0
+  p[0] = bodies.p0
+
+  # lower precision storage: diagnostics from the full precision states (see NBodySimulation.solve)
+  recorder = None
+  if np.dtype(dtype) != np.float64:
+    recorder = DiagnosticsRecorder(bodies, bodies.q0, bodies.p0, shape[0], arrays=sink.arrays if sink is not None else None)
+
+  # test particles (see NBodySimulation.solve)
+  particles = None
+  if bodies.n_particles:
+    particles = TestParticleRecorder(bodies, shape[0], arrays=particle_arrays, every=particles_every)
+
+  hooks.sink, hooks.recorder, hooks.particles = sink, recorder, particles
+  hooks.metrics = Metrics(solver.__name__, callback=print_progress, interval=5.) if profile else None
+  q_run, p_run = get_backend(backend).run(solver=solver, dqdt=n_body_dqdt, dpdt=dpdt, q=q, p=p, dt=dt, nt=nt, bodies=bodies, record_every=record_every, hooks=hooks)
+  # shorter if stopped on an encounter
+  n_records = len(q_run)
+
+  # views on the blocks must be released before closing them
+  del q, p, q_run, p_run, particle_arrays, particles
+  hooks.particles = None
+  for block in blocks:
+    block.close()
+
+  # small arrays (one value per record) => pickled back
+  output = dict(recorder.arrays) if recorder is not None and sink is None else None
+  if hooks.watched:
+    output = dict(output or {}, **hooks.found(), n_records=n_records)
+  return output, hooks.metrics
+
+def solve_adaptive_in_worker(solver, dpdt, bodies, t0, tN, dt, tolerance, record_every, output_dir=None, metadata=None, profile=False, dtype=np.float64, particles_every=0, hooks=None):
+  """
+  Worker entry point for an adaptive scheme (dormand_prince).
+  The length of the trajectory is only known at the end, so it cannot be written in preallocated
+  shared memory: it is either stored in `output_dir` or pickled back to the parent process.
+
+  :return: time mesh, q, p, diagnostics if stored in a lower precision and test particles if any => {"time": ..., "q": ..., "p": ...}
+  (None if the trajectory was written to output_dir), close encounters and events if watched (as solve_in_worker)
+  and metrics of the run (None if not profiled)
+  """
+  hooks = hooks if hooks is not None else RunHooks()
+  # test particles after the bodies in the state
+  q0, p0 = np.concatenate([bodies.q0, bodies.particles_q0]), np.concatenate([bodies.p0, bodies.particles_p0])
+
+  hooks.metrics = metrics = Metrics(solver.__name__, callback=print_progress, interval=5.) if profile else None
+  time, q, p = solver(dqdt=n_body_dqdt, dpdt=dpdt, q0=q0, p0=p0, t0=t0, tN=tN, dt=dt, bodies=bodies, tolerance=tolerance, record_every=record_every, hooks=hooks)
+
+  arrays = {"time": time}
+  if bodies.n_particles:
+    q, p, particles = split_test_particles(q, p, bodies, particles_every)
+    arrays.update({name: array.astype(dtype) for (name, array) in particles.items()})
+  arrays.update(q=q, p=p)
+  if np.dtype(dtype) != np.float64:
+    q, p, diagnostics = downcast_trajectory(q, p, bodies, dtype)
+    arrays.update(diagnostics, q=q, p=p)
+
+  found = dict(hooks.found(), n_records=len(time)) if hooks.watched else {}
+  if output_dir is not None:
+    write_trajectory(output_dir, arrays, metadata)
+    return found or None, metrics
+
+  return dict(arrays, **found), metrics
+
+def share_results(results):
+  """
+  Copy the arrays of simulation results (q, p, energy,...) in shared memory blocks,
+  so that worker processes can read them without a copy (see attach_results).
+
+  :return: the blocks (to close and unlink when the workers are done) and a picklable description of the results
+  :rtype: (list, list)
+  """
+  blocks, shared = [], []
+  for result in results:
+    description = {"fields": {}, "arrays": {}}
+    for (name, value) in result.items():
+      if isinstance(value, np.ndarray):
+        block, array = create_shared_array(value.shape, value.dtype)
+        array[:] = value
+        blocks.append(block)
+        description["arrays"][name] = (block.name, value.shape, value.dtype.str)
+      elif name != "cache_key":
+        description["fields"][name] = value
+    shared.append(description)
+
+  return blocks, shared
+
+def attach_results(shared):
+  """
+  Worker side of share_results.
+
+  :return: the attached blocks (to close once the arrays are no longer used) and the results, as read-only arrays
+  :rtype: (list, list)
+  """
+  blocks, results = [], []
+  for description in shared:
+    result = dict(description["fields"])
+    for (name, (block_name, shape, dtype)) in description["arrays"].items():
+      block = shared_memory.SharedMemory(name=block_name)
+      blocks.append(block)
+      result[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+      result[name].flags.writeable = False
+    results.append(result)
+
+  return blocks, results
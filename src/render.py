@@ -0,0 +1,83 @@
+import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+
+from .nbody import NBodySimulation
+from .parallel import (share_results, attach_results)
+
+# figures of the batch mode => plotting method of NBodySimulation
+FIGURES = {
+  "orbits-2d": "plot2D",
+  "orbits-3d": "plot3D",
+  "energy": "plot_energy",
+  "angular-momentum": "plot_angular_momentum",
+  "area-swept": "plot_area_swept"
+}
+
+def render(simulation, tN, figure):
+  """
+  Render one figure of the simulation stopped at tN (see NBodySimulation.horizon).
+  """
+  nbody = simulation if tN == simulation.tN else simulation.horizon(tN)
+  getattr(nbody, FIGURES[figure])()
+
+def render_in_worker(arguments, shared, tN, figure, rc_params):
+  """
+  Worker entry point of render_figures: rebuild the simulation around the shared (read-only) results
+  and render one figure, nothing is integrated.
+
+  :param arguments: arguments of NBodySimulation
+  :param shared: description of the results in shared memory (see parallel.share_results)
+  :param rc_params: matplotlib settings of the parent process (style,...)
+  """
+  plt.switch_backend("Agg")
+  plt.rcParams.update(rc_params)
+
+  blocks, results = attach_results(shared)
+  simulation = NBodySimulation(**arguments)
+  simulation.results = results
+  render(simulation, tN, figure)
+
+  # views on the blocks must be released before closing them
+  del simulation, results
+  for block in blocks:
+    block.close()
+
+def render_figures(simulation, times, figures, jobs=1):
+  """
+  Batch mode: render the figures of a simulation and of its shorter horizons without displaying them
+  (Agg backend, options "batch" and "save"), one figure per worker process.
+  The workers read the results of the simulation from shared memory instead of recomputing them.
+
+  :param simulation: simulation integrated up to the longest time
+  :param times: final times (in days) of the figures, none after simulation.tN
+  :param figures: names of the figures (keys of FIGURES)
+  :param jobs: number of worker processes
+  """
+  # computed once, shared with the results
+  simulation.compute_diagnostics()
+  tasks = [(tN, figure) for tN in times for figure in figures]
+
+  if jobs == 1:
+    for (tN, figure) in tasks:
+      render(simulation, tN, figure)
+    return
+
+  arguments = {
+    "bodies": simulation.bodies,
+    "t0": simulation.t0,
+    "tN": simulation.tN,
+    "dt": simulation.dt,
+    "options": dict(simulation.options, record_every=simulation.record_every, samples=None, cache_dir=None)
+  }
+
+  blocks, shared = share_results(simulation.results)
+  try:
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+      futures = [executor.submit(render_in_worker, arguments, shared, tN, figure, dict(plt.rcParams)) for (tN, figure) in tasks]
+      for future in futures:
+        # re-raise any exception of the worker
+        future.result()
+  finally:
+    for block in blocks:
+      block.close()
+      block.unlink()
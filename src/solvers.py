@@ -1,7 +1,8 @@
 import numpy as np
-from tqdm import tqdm
 
-from .edo import (hamiltonian, compute_angular_momentum, compute_area_swept)
+from consts import G
+from .kepler import kepler_drift
+from .hooks import RunHooks
 
 def rk2_derivatives_dqdt(edo, qk, pk, dt, bodies):
   k1 = dt * edo(qk, pk, bodies)
@@ -13,18 +14,13 @@ def rk2_derivatives_dpdt(edo, qk, pk, dt, bodies):
   k2 = dt * edo(qk, pk + (dt * k1), bodies)
   return (k1 + k2) / 2.
 
-def heun(dqdt, dpdt, q, p, dt, nt, bodies, energy, angular_momentum, area_swept):
-  for k in tqdm(range(0, nt - 1), desc="heun"):
-    qk, pk = q[k], p[k]
-    #print("rk2 -- iteration:", k, qk)
-    q[k + 1] = qk + rk2_derivatives_dqdt(dqdt, qk, pk, dt, bodies)
-    p[k + 1] = pk + rk2_derivatives_dpdt(dpdt, qk, pk, dt, bodies)
+def heun_step(dqdt, dpdt, qk, pk, dt, bodies):
+  q_next = qk + rk2_derivatives_dqdt(dqdt, qk, pk, dt, bodies)
+  p_next = pk + rk2_derivatives_dpdt(dpdt, qk, pk, dt, bodies)
+  return q_next, p_next
 
-    energy[k + 1] = hamiltonian(q[k+1], p[k+1], bodies)
-    angular_momentum[k + 1] = compute_angular_momentum(q[k+1], p[k+1], bodies)
-    area_swept[k + 1] = area_swept[k] + compute_area_swept(q[k], p[k], q[k+1], p[k+1], bodies)
-
-  return q, p, energy, angular_momentum, area_swept
+def heun(dqdt, dpdt, q, p, dt, nt, bodies, record_every=1, hooks=None):
+  return integrate(heun_step, dqdt, dpdt, q, p, dt, nt, bodies, record_every, hooks)
 
 
 # def rk4_derivatives_dqdt(edo, qk, pk, dt, bodies):
@@ -53,30 +49,361 @@ def heun(dqdt, dpdt, q, p, dt, nt, bodies, energy, angular_momentum, area_swept)
 #   return q, p, energy
 
 
-def euler_symp(dqdt, dpdt, q, p, dt, nt, bodies, energy, angular_momentum, area_swept):
-  for k in tqdm(range(0, nt - 1), desc="euler-symplectic"):
-    qk, pk = q[k], p[k]
-    #print("euler -- iteration:", k, qk)
-    p[k + 1] = pk + dt * dpdt(qk, pk, bodies)
-    q[k + 1] = qk + dt * dqdt(qk, p[k + 1], bodies)
+def euler_symp_step(dqdt, dpdt, qk, pk, dt, bodies):
+  p_next = pk + dt * dpdt(qk, pk, bodies)
+  q_next = qk + dt * dqdt(qk, p_next, bodies)
+  return q_next, p_next
+
+def euler_symp(dqdt, dpdt, q, p, dt, nt, bodies, record_every=1, hooks=None):
+  return integrate(euler_symp_step, dqdt, dpdt, q, p, dt, nt, bodies, record_every, hooks)
+
+
+def stormer_verlet_step(dqdt, dpdt, qk, pk, dt, bodies):
+  p_half = pk + ((dt / 2) * dpdt(qk, pk, bodies))
+  q_next = qk + (dt * dqdt(qk, p_half, bodies))
+  p_next = p_half + ((dt / 2) * dpdt(q_next, p_half, bodies))
+  return q_next, p_next
+
+def stormer_verlet(dqdt, dpdt, q, p, dt, nt, bodies, record_every=1, hooks=None):
+  return integrate(stormer_verlet_step, dqdt, dpdt, q, p, dt, nt, bodies, record_every, hooks)
+
+
+# composition coefficients (Yoshida, 1990)
+# 4th order "triple jump": S4(dt) = S2(w1 dt) o S2(w0 dt) o S2(w1 dt)
+YOSHIDA4 = (1 / (2 - 2 ** (1 / 3)), - 2 ** (1 / 3) / (2 - 2 ** (1 / 3)), 1 / (2 - 2 ** (1 / 3)))
+# 6th order, solution A: S6(dt) = S2(w3 dt) o S2(w2 dt) o S2(w1 dt) o S2(w0 dt) o S2(w1 dt) o S2(w2 dt) o S2(w3 dt)
+YOSHIDA6_W = (-1.17767998417887, 0.235573213359357, 0.784513610477560)
+YOSHIDA6 = YOSHIDA6_W[::-1] + (1 - 2 * sum(YOSHIDA6_W),) + YOSHIDA6_W
+
+def composition_step(weights, dqdt, dpdt, qk, pk, dt, bodies):
+  """
+  Symmetric composition of Stormer-Verlet steps of length w_i * dt.
+  The force at the end of a substep is the one needed by the first half kick of the next substep:
+  it is evaluated once => one force evaluation per substep.
+  """
+  force = dpdt(qk, pk, bodies)
+  for w in weights:
+    p_half = pk + ((w * dt / 2) * force)
+    qk = qk + (w * dt * dqdt(qk, p_half, bodies))
+    force = dpdt(qk, p_half, bodies)
+    pk = p_half + ((w * dt / 2) * force)
+  return qk, pk
+
+def yoshida4_step(dqdt, dpdt, qk, pk, dt, bodies):
+  return composition_step(YOSHIDA4, dqdt, dpdt, qk, pk, dt, bodies)
+
+def yoshida4(dqdt, dpdt, q, p, dt, nt, bodies, record_every=1, hooks=None):
+  return integrate(yoshida4_step, dqdt, dpdt, q, p, dt, nt, bodies, record_every, hooks)
+
+
+def yoshida6_step(dqdt, dpdt, qk, pk, dt, bodies):
+  return composition_step(YOSHIDA6, dqdt, dpdt, qk, pk, dt, bodies)
+
+def yoshida6(dqdt, dpdt, q, p, dt, nt, bodies, record_every=1, hooks=None):
+  return integrate(yoshida6_step, dqdt, dpdt, q, p, dt, nt, bodies, record_every, hooks)
+
+
+def forest_ruth_step(dqdt, dpdt, qk, pk, dt, bodies):
+  """
+  Forest-Ruth: triple jump of the position (drift-kick-drift) form of Stormer-Verlet.
+  """
+  for w in YOSHIDA4:
+    q_half = qk + ((w * dt / 2) * dqdt(qk, pk, bodies))
+    pk = pk + (w * dt * dpdt(q_half, pk, bodies))
+    qk = q_half + ((w * dt / 2) * dqdt(q_half, pk, bodies))
+  return qk, pk
+
+def forest_ruth(dqdt, dpdt, q, p, dt, nt, bodies, record_every=1, hooks=None):
+  return integrate(forest_ruth_step, dqdt, dpdt, q, p, dt, nt, bodies, record_every, hooks)
+
+
+def wisdom_holman_kick(dpdt, r, pj, dt, bodies, B, jacobi_masses, eta, particles=None):
+  """
+  Kick of the interaction hamiltonian H_int = H - H_kepler, in Jacobi momenta.
+  The generalized force of the full hamiltonian is B^T F (F: barycentric forces given by dpdt),
+  from which the Kepler force - G m_i eta_{i-1} r'_i / r'_i^3 is removed.
+
+  :param particles: positions and velocities of the test particles relative to the center of mass of the bodies (r'_0),
+  kicked the same way (per unit mass, around the total mass eta_N)
+  """
+  x = B @ r
+  state = x.reshape(x.shape[:-2] + (-1,))
+  if particles is not None:
+    state = np.concatenate([state, (particles[0] + r[..., :1, :]).reshape(state.shape[:-1] + (-1,))], axis=-1)
+  forces = dpdt(state, None, bodies).reshape(state.shape[:-1] + (-1, 3))
+  force = B.T @ forces[..., :len(bodies), :]
+
+  r_norm = np.linalg.norm(r[..., 1:, :], axis=-1)
+  force[..., 1:, :] += (G * jacobi_masses[1:] * eta[1:] / r_norm ** 3)[..., np.newaxis] * r[..., 1:, :]
+
+  if particles is None:
+    return pj + dt * force, None
+
+  r_particles, v_particles = particles
+  acceleration = forces[..., len(bodies):, :] + (G * eta[-1] / np.linalg.norm(r_particles, axis=-1) ** 3)[..., np.newaxis] * r_particles
+  return pj + dt * force, (r_particles, v_particles + dt * acceleration)
+
+def wisdom_holman_step(dqdt, dpdt, qk, pk, dt, bodies):
+  """
+  Wisdom-Holman map (kick-drift-kick) in Jacobi coordinates, the first body being the central mass (Sun).
+  The Kepler motion of each body around the interior masses is solved analytically (kepler.kepler_drift),
+  only the small interactions between bodies (computed from dpdt) are integrated as kicks.
+  Test particles (after the bodies in the state) orbit the total mass of the bodies, around their center of mass.
+  """
+  A, B, jacobi_masses, eta = bodies.jacobi
+  n = 3 * len(bodies)
+
+  # barycentric => jacobi coordinates
+  r = A @ qk[..., :n].reshape(qk.shape[:-1] + (-1, 3))
+  pj = B.T @ pk[..., :n].reshape(pk.shape[:-1] + (-1, 3))
+
+  particles = None
+  if qk.shape[-1] > n:
+    # relative to the center of mass of the bodies
+    particles = (qk[..., n:].reshape(qk.shape[:-1] + (-1, 3)) - r[..., :1, :], pk[..., n:].reshape(pk.shape[:-1] + (-1, 3)) - pj[..., :1, :] / jacobi_masses[0])
+
+  pj, particles = wisdom_holman_kick(dpdt, r, pj, dt / 2, bodies, B, jacobi_masses, eta, particles)
+
+  # Kepler drift of each jacobi coordinate around the interior mass eta_i
+  # (the center of mass moves in straight line)
+  v = pj / jacobi_masses[:, np.newaxis]
+  r_kepler, v_kepler = kepler_drift(r[..., 1:, :], v[..., 1:, :], G * eta[1:], dt)
+  r = np.concatenate([r[..., :1, :] + dt * v[..., :1, :], r_kepler], axis=-2)
+  pj = np.concatenate([pj[..., :1, :], jacobi_masses[1:, np.newaxis] * v_kepler], axis=-2)
+  if particles is not None:
+    particles = kepler_drift(*particles, G * eta[-1], dt)
+
+  pj, particles = wisdom_holman_kick(dpdt, r, pj, dt / 2, bodies, B, jacobi_masses, eta, particles)
+
+  # jacobi => barycentric coordinates
+  q_next = (B @ r).reshape(r.shape[:-2] + (-1,))
+  p_next = (A.T @ pj).reshape(pj.shape[:-2] + (-1,))
+  if particles is not None:
+    q_next = np.concatenate([q_next, (particles[0] + r[..., :1, :]).reshape(q_next.shape[:-1] + (-1,))], axis=-1)
+    p_next = np.concatenate([p_next, (particles[1] + pj[..., :1, :] / jacobi_masses[0]).reshape(p_next.shape[:-1] + (-1,))], axis=-1)
+  return q_next, p_next
+
+def wisdom_holman_applies(bodies):
+  """
+  The Kepler drifts of wisdom_holman are around the first body: the splitting is only accurate
+  if it holds most of the mass of the system (the Sun first).
+  """
+  return bodies.masses[0] >= 0.9 * bodies.total_mass
+
+def wisdom_holman(dqdt, dpdt, q, p, dt, nt, bodies, record_every=1, hooks=None):
+  return integrate(wisdom_holman_step, dqdt, dpdt, q, p, dt, nt, bodies, record_every, hooks)
+
+
+# Dormand-Prince 5(4) Butcher tableau
+DOPRI_C = (0, 1 / 5, 3 / 10, 4 / 5, 8 / 9, 1, 1)
+DOPRI_A = (
+  (),
+  (1 / 5,),
+  (3 / 40, 9 / 40),
+  (44 / 45, -56 / 15, 32 / 9),
+  (19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729),
+  (9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656),
+  (35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84)
+)
+# 5th order weights (= last row of A: first same as last) and 5th - 4th order weights
+DOPRI_B = DOPRI_A[6] + (0,)
+DOPRI_E = (71 / 57600, 0, -71 / 16695, 71 / 1920, -17253 / 339200, 22 / 525, -1 / 40)
+
+def dormand_prince_step(dqdt, dpdt, qk, pk, dt, bodies, kq1, kp1):
+  """
+  One Dormand-Prince 5(4) step.
+  The last stage is the derivative at the new state: it is the first stage of the next step (FSAL).
+
+  :param kq1, kp1: derivatives at (qk, pk)
+  :return: new state, derivatives at the new state and error estimates of q and p
+  """
+  kq, kp = [kq1], [kp1]
+  for i in range(1, 7):
+    qi = qk + dt * sum(a * k for (a, k) in zip(DOPRI_A[i], kq) if a != 0)
+    pi = pk + dt * sum(a * k for (a, k) in zip(DOPRI_A[i], kp) if a != 0)
+    kq.append(dqdt(qi, pi, bodies))
+    kp.append(dpdt(qi, pi, bodies))
+
+  # 5th order solution (= stage 7)
+  q_error = dt * sum(e * k for (e, k) in zip(DOPRI_E, kq) if e != 0)
+  p_error = dt * sum(e * k for (e, k) in zip(DOPRI_E, kp) if e != 0)
+  return qi, pi, kq[6], kp[6], q_error, p_error
+
+def error_norm(error, y, y_next, tolerance):
+  """
+  Max norm of the error of each body relative to the size of its vector (position or impulsion).
+  """
+  shape = y.shape[:-1] + (-1, 3)
+  scale = tolerance * np.maximum(np.linalg.norm(y.reshape(shape), axis=-1), np.linalg.norm(y_next.reshape(shape), axis=-1))
+  return np.max(np.linalg.norm(error.reshape(shape), axis=-1) / np.maximum(scale, np.finfo(float).tiny))
+
+def dormand_prince(dqdt, dpdt, q0, p0, t0, tN, dt, bodies, tolerance=1e-10, record_every=1, hooks=None):
+  """
+  Adaptive Dormand-Prince 5(4) scheme: the time step is adjusted at each step so that
+  the local error estimate stays below `tolerance` (relative to the size of each body position and impulsion).
+  Small steps are only taken where needed (close approaches, perihelion of eccentric orbits,...).
+
+  :param q0, p0: initial state
+  :param dt: initial time step
+  :param record_every: store one accepted step out of record_every (the final state is always stored)
+  :param hooks: hooks of the run (hooks.RunHooks), only metrics, encounters and events being used:
+  metrics => time spent in dqdt and dpdt, rejected steps,
+  encounters => checked after each accepted step, the run stops there if its action is "stop" (the step size control already refines the encounters),
+  events => checked after each accepted step
+  :return: non-uniform time mesh and the corresponding states
+  :rtype: (ndarray, ndarray, ndarray)
+  """
+  hooks = hooks if hooks is not None else RunHooks()
+  metrics, encounters, events = hooks.metrics, hooks.encounters, hooks.events
+
+  if metrics is not None:
+    dqdt, dpdt = metrics.timed("dqdt", dqdt), metrics.timed("dpdt", dpdt)
+    metrics.start()
+
+  t, qk, pk = t0, q0, p0
+  kq, kp = dqdt(qk, pk, bodies), dpdt(qk, pk, bodies)
+  time, q, p = [t], [qk], [pk]
+
+  if events is not None:
+    events.open()
+
+  n_accepted = 0
+  while t < tN:
+    last = dt >= tN - t
+    h = tN - t if last else dt
+
+    q_next, p_next, kq_next, kp_next, q_error, p_error = dormand_prince_step(dqdt, dpdt, qk, pk, h, bodies, kq, kp)
+    error = max(error_norm(q_error, qk, q_next, tolerance), error_norm(p_error, pk, p_next, tolerance))
+
+    if error <= 1:
+      if events is not None:
+        events.check(t, qk, pk, tN if last else t + h, q_next, p_next)
+      t = tN if last else t + h
+      qk, pk, kq, kp = q_next, p_next, kq_next, kp_next
+      n_accepted += 1
+
+      stop = encounters is not None and encounters.check(t, qk) and encounters.stopped
+      if n_accepted % record_every == 0 or last or stop:
+        time.append(t)
+        q.append(qk)
+        p.append(pk)
+
+      if metrics is not None:
+        metrics.progress(n_accepted)
+      if stop:
+        break
+    elif metrics is not None:
+      metrics.count("rejected steps")
+
+    # standard step size controller (5th order => error ~ h^5)
+    dt = h * min(5., max(0.2, 0.9 * error ** -0.2)) if error > 0 else 5. * h
+
+  if events is not None:
+    events.close()
+  if metrics is not None:
+    metrics.stop(n_accepted)
+
+  return np.array(time), np.array(q), np.array(p)
+
+def integrate(step, dqdt, dpdt, q, p, dt, nt, bodies, record_every=1, hooks=None):
+  """
+  Advance the initial state (q[0], p[0]) nt - 1 times with a one-step scheme
+  and store one state out of `record_every` => q[j] is the state at time j * record_every * dt.
+  Only the state is advanced: conservation diagnostics are computed afterwards on the stored trajectory (see edo.compute_diagnostics),
+  unless a recorder is given.
+
+  :param step: one-step scheme: (dqdt, dpdt, qk, pk, dt, bodies) -> (q_next, p_next)
+  :param q, p: output arrays of length (nt - 1) // record_every + 1
+  :param record_every: stride between two recorded states
+  :param hooks: hooks of the run (hooks.RunHooks):
+  sink => on-disk store holding the output arrays, flushed and checkpointed every sink.chunk_size records
+  (if it holds a checkpoint, the integration continues from it),
+  metrics => time spent in dqdt, dpdt, stores and flushes,
+  recorder => full precision recorder when q and p are stored in a lower precision (float32):
+  the integration starts from its initial state and it gets each recorded state before the down-cast,
+  particles => recorder of the test particles of the system: they are integrated along with the bodies and stored in its own arrays,
+  q and p only holding the bodies,
+  encounters => checked after each step: a step ending in an encounter is redone in substeps (action "refine"),
+  or the run stops at the next recorded state (action "stop"); its state is saved with each checkpoint of the sink,
+  events => checked after each step, the events being found while the run streams (whatever is recorded)
+  :return: q, p (their first recorded states only if the run was stopped)
+  """
+  hooks = hooks if hooks is not None else RunHooks()
+  sink, metrics, recorder, particles, encounters, events = hooks.sink, hooks.metrics, hooks.recorder, hooks.particles, hooks.encounters, hooks.events
+
+  qk, pk, start = q[0], p[0], 1
+  if recorder is not None:
+    qk, pk = recorder.q0, recorder.p0
+  if particles is not None:
+    qk, pk = particles.state(qk, pk)
+  if sink is not None and sink.checkpoint is not None:
+    # resume an interrupted run: the state is the full precision one of the checkpoint => same trajectory as an uninterrupted run
+    qk, pk, start = sink.checkpoint["q"], sink.checkpoint["p"], sink.checkpoint["step"] + 1
+    if recorder is not None:
+      recorder.resume(sink.checkpoint["n_written"], qk[..., :q.shape[-1]])
+    if encounters is not None:
+      encounters.resume(sink.checkpoint)
+  if events is not None:
+    events.open(resume=events.t0 + (start - 1) * dt if start > 1 else None)
+
+  def store(j, qk, pk):
+    if particles is not None:
+      qk, pk = particles.record(j, qk, pk)
+    if recorder is not None:
+      recorder.record(j, qk, pk)
+    q[j], p[j] = qk, pk
+
+  def flush(n_written, state):
+    # diagnostics of the buffered states first, so that the flushed records are complete
+    if recorder is not None:
+      recorder.flush()
+    sink.flush(n_written, state=state, extra=encounters.checkpoint_state() if encounters is not None else None)
+
+  if metrics is not None:
+    # instrumented through wrappers => nothing to pay when metrics is None
+    dqdt, dpdt = metrics.timed("dqdt", dqdt), metrics.timed("dpdt", dpdt)
+    store = metrics.timed("store", store)
+    flush = metrics.timed("flush", flush)
+    metrics.start()
+
+  n_records, last, end = len(q), max(nt - 1, start - 1), nt
+  if encounters is not None and encounters.stopped:
+    # resumed after the run had stopped on an encounter => nothing left to integrate
+    n_records, last, end = sink.checkpoint["n_written"], start - 1, start
+  for k in range(start, end):
+    q_next, p_next = step(dqdt, dpdt, qk, pk, dt, bodies)
+
+    if encounters is not None and encounters.check(encounters.t0 + k * dt, q_next) and encounters.action == "refine":
+      # same step again, in smaller steps
+      q_next, p_next = qk, pk
+      for _ in range(encounters.substeps):
+        q_next, p_next = step(dqdt, dpdt, q_next, p_next, dt / encounters.substeps, bodies)
+    if events is not None:
+      events.check(events.t0 + (k - 1) * dt, qk, pk, events.t0 + k * dt, q_next, p_next)
+    qk, pk = q_next, p_next
+
+    if k % record_every == 0:
+      j = k // record_every
+      store(j, qk, pk)
 
-    energy[k + 1] = hamiltonian(q[k+1], p[k+1], bodies)
-    angular_momentum[k + 1] = compute_angular_momentum(q[k+1], p[k+1], bodies)
-    area_swept[k + 1] = area_swept[k] + compute_area_swept(q[k], p[k], q[k+1], p[k+1], bodies)
+      if metrics is not None:
+        metrics.progress(k - start + 1)
 
-  return q, p, energy, angular_momentum, area_swept
+      if sink is not None and (j + 1) % sink.chunk_size == 0:
+        flush(j + 1, state=(k, qk, pk))
 
+      if encounters is not None and encounters.stopped:
+        n_records, last = j + 1, k
+        break
 
-def stormer_verlet(dqdt, dpdt, q, p, dt, nt, bodies, energy, angular_momentum, area_swept):
-  for k in tqdm(range(0, nt - 1), desc="stormer-verlet"):
-    qk, pk = q[k], p[k]
-    #print("stormer-verlet -- iteration:", k, qk)
-    p_half = pk + ((dt / 2) * dpdt(qk, pk, bodies))
-    q[k + 1] = qk + (dt * dqdt(qk, p_half, bodies))
-    p[k + 1] = p_half + ((dt / 2) * dpdt(q[k + 1], p_half, bodies))
+  if sink is not None:
+    flush(n_records, state=(last, qk, pk))
+  elif recorder is not None:
+    recorder.flush()
+  if events is not None:
+    events.close()
 
-    energy[k + 1] = hamiltonian(q[k+1], p[k+1], bodies)
-    angular_momentum[k + 1] = compute_angular_momentum(q[k+1], p[k+1], bodies)
-    area_swept[k + 1] = area_swept[k] + compute_area_swept(q[k], p[k], q[k+1], p[k+1], bodies)
+  if metrics is not None:
+    metrics.stop(max(last - start + 1, 0))
 
-  return q, p, energy, angular_momentum, area_swept
+  return q[:n_records], p[:n_records]
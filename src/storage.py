@@ -0,0 +1,128 @@
+import os
+import json
+import numpy as np
+from numpy.lib.format import open_memmap
+
+class TrajectorySink():
+  """
+  On-disk store of a trajectory: one raw .npy memmap per recorded array
+  (q, p, energy,...) and a small `metadata.json` header (bodies, dt, units,...).
+
+  The solvers write the recorded states straight into the memmaps and flush them
+  every `chunk_size` records, the header keeping track of how many records are on disk.
+  A crashed run thus still leaves its first `n_written` states readable.
+
+  Along with each flush, the solvers can save a checkpoint (`checkpoint.npz`: step index,
+  full precision state at that step and the state of the detectors of the run) from which an interrupted run is continued (see `resume`).
+  """
+  def __init__(self, directory, fields, metadata, chunk_size=4096, resume=False, dtypes=None):
+    """
+    :param directory: folder of the store (created if it does not exist)
+    :param fields: name and shape of each recorded array => {"q": (n_records, 3N), "energy": (n_records,),...}
+    :param metadata: json serializable description of the run
+    :param chunk_size: number of records between two flushes (and checkpoints)
+    :param resume: reopen the store of an interrupted run with the same metadata instead of starting over
+    :param dtypes: dtype of the arrays stored in another precision than float64 => {"q": np.float32,...}
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    self.directory = directory
+    self.chunk_size = chunk_size
+    # state to continue from => {"step": k, "q": qk, "p": pk}
+    self.checkpoint = self.load_checkpoint(metadata) if resume else None
+    if self.checkpoint is None and os.path.isfile(os.path.join(directory, "checkpoint.npz")):
+      # the store is started over: the checkpoint of a previous run no longer matches it
+      os.remove(os.path.join(directory, "checkpoint.npz"))
+
+    mode = "r+" if self.checkpoint is not None else "w+"
+    dtypes = dtypes or {}
+    self.arrays = {
+      name: open_memmap(os.path.join(directory, f"{name}.npy"), mode=mode, dtype=dtypes.get(name, np.float64), shape=shape)
+      for (name, shape) in fields.items()
+    }
+
+    n_written = self.checkpoint["n_written"] if self.checkpoint is not None else 0
+    self.metadata = dict(metadata, fields=list(fields), chunk_size=chunk_size, n_written=n_written)
+    self.write_metadata()
+
+  def load_checkpoint(self, metadata):
+    """
+    :return: last checkpoint of the store, None if there is none
+    :raise ValueError: the checkpoint was saved by a run with a different configuration
+    """
+    path = os.path.join(self.directory, "checkpoint.npz")
+    if not os.path.isfile(path):
+      return None
+
+    with np.load(path) as checkpoint:
+      checkpoint = dict(checkpoint)
+
+    saved = json.loads(str(checkpoint.pop("metadata")))
+    if saved != json.loads(json.dumps(metadata)):
+      raise ValueError(f"cannot resume from {path}: it was saved by a run with a different configuration")
+
+    checkpoint["step"], checkpoint["n_written"] = int(checkpoint["step"]), int(checkpoint["n_written"])
+    return checkpoint
+
+  def flush(self, n_written, state=None, extra=None):
+    """
+    :param n_written: number of records written so far
+    :param state: step index and state at that step (k, qk, pk) to checkpoint
+    :param extra: other arrays saved with the checkpoint (state of the encounter detector,...) => {name: array}
+    """
+    for array in self.arrays.values():
+      array.flush()
+
+    if state is not None:
+      self.save_checkpoint(n_written, *state, extra=extra)
+
+    self.metadata["n_written"] = n_written
+    self.write_metadata()
+
+  def save_checkpoint(self, n_written, step, qk, pk, extra=None):
+    # the configuration is saved along with the state, a resumed run must use the same one
+    metadata = {key: value for (key, value) in self.metadata.items() if key not in ["fields", "chunk_size", "n_written"]}
+
+    # write then rename so that a checkpoint is never left half written
+    path = os.path.join(self.directory, "checkpoint.npz")
+    with open(f"{path}.tmp", "wb") as f:
+      np.savez(f, **(extra or {}), step=step, n_written=n_written, q=qk, p=pk, metadata=json.dumps(metadata))
+    os.replace(f"{path}.tmp", path)
+
+  def write_metadata(self):
+    # write then rename so that the header is never left half written
+    path = os.path.join(self.directory, "metadata.json")
+    with open(f"{path}.tmp", "w") as f:
+      json.dump(self.metadata, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+def load_trajectory(directory):
+  """
+  Read back a trajectory written by a TrajectorySink.
+
+  :return: metadata and read-only memmaps of each recorded array
+  (limited to the records that were flushed to disk)
+  :rtype: (dict, dict)
+  """
+  with open(os.path.join(directory, "metadata.json")) as f:
+    metadata = json.load(f)
+
+  n_written = metadata["n_written"]
+  arrays = {
+    name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")[:n_written]
+    for name in metadata["fields"]
+  }
+
+  return metadata, arrays
+
+def write_trajectory(directory, arrays, metadata):
+  """
+  Store arrays that are already fully computed (e.g. the output of an adaptive scheme,
+  whose length is only known at the end) in the same layout as a TrajectorySink.
+
+  :param arrays: recorded arrays => {"time": ..., "q": ..., "p": ...} (stored in their own dtype)
+  """
+  sink = TrajectorySink(directory=directory, fields={name: array.shape for (name, array) in arrays.items()}, metadata=metadata, dtypes={name: array.dtype for (name, array) in arrays.items()})
+  for (name, array) in arrays.items():
+    sink.arrays[name][:] = array
+  sink.flush(len(next(iter(arrays.values()))))
@@ -0,0 +1,120 @@
+import queue
+import threading
+import numpy as np
+
+class RingBuffer():
+  """
+  Last `capacity` states of a trajectory (trail of the animation), in a fixed size array.
+  """
+  def __init__(self, capacity, size):
+    """
+    :param capacity: number of states kept
+    :param size: size of a state => 3N
+    """
+    self.data = np.empty((capacity, size))
+    self.capacity = capacity
+    # index of the next state to write and number of states held
+    self.head = 0
+    self.count = 0
+
+  def append(self, state):
+    self.data[self.head] = state
+    self.head = (self.head + 1) % self.capacity
+    self.count = min(self.count + 1, self.capacity)
+
+  def latest(self):
+    """
+    :return: the states held, most recent first
+    :rtype: ndarray
+    """
+    indices = (self.head - 1 - np.arange(self.count)) % self.capacity
+    return self.data[indices]
+
+def trajectory_chunks(step, dqdt, dpdt, q0, p0, t0, dt, nt, bodies, stride=1, chunk_length=12):
+  """
+  Integrate with a one-step scheme and yield the trajectory chunk by chunk,
+  as it is computed (one state out of `stride` steps, `chunk_length` states per chunk).
+
+  :param step: one-step scheme: (dqdt, dpdt, qk, pk, dt, bodies) -> (q_next, p_next)
+  :return: generator of (time, q, p) chunks
+  """
+  qk, pk = q0, p0
+  time, q, p = [t0], [q0], [p0]
+
+  for k in range(1, nt):
+    qk, pk = step(dqdt, dpdt, qk, pk, dt, bodies)
+
+    if k % stride == 0:
+      time.append(t0 + k * dt)
+      q.append(qk)
+      p.append(pk)
+
+      if len(time) == chunk_length:
+        yield np.array(time), np.array(q), np.array(p)
+        time, q, p = [], [], []
+
+  if len(time):
+    yield np.array(time), np.array(q), np.array(p)
+
+def array_chunks(time, q, p, chunk_length=12):
+  """
+  Same as trajectory_chunks for a trajectory that is already computed.
+  """
+  for start in range(0, len(time), chunk_length):
+    yield time[start:start + chunk_length], q[start:start + chunk_length], p[start:start + chunk_length]
+
+class Producer():
+  """
+  Run a generator of chunks on a background thread and hand them over through a bounded queue:
+  the consumer (animation) gets the first chunks right away, and the producer waits whenever
+  it is `max_chunks` ahead, so that memory does not grow with the length of the run.
+  An exception raised by the generator is handed over the same way and re-raised on the consumer side.
+  """
+  def __init__(self, chunks, max_chunks=4):
+    self.queue = queue.Queue(maxsize=max_chunks)
+    self.stopped = threading.Event()
+    self.thread = threading.Thread(target=self.run, args=(chunks,), daemon=True)
+    self.thread.start()
+
+  def run(self, chunks):
+    try:
+      for chunk in chunks:
+        if not self.put(chunk):
+          return
+    except BaseException as e:
+      # the thread would die silently => re-raised by the consumer
+      self.put(e)
+      return
+    # end of the trajectory
+    self.put(None)
+
+  def put(self, item):
+    # wait for room in the queue, unless the consumer is gone
+    while not self.stopped.is_set():
+      try:
+        self.queue.put(item, timeout=0.1)
+        return True
+      except queue.Full:
+        continue
+    return False
+
+  def stop(self):
+    self.stopped.set()
+
+  def get(self, timeout=None):
+    """
+    :param timeout: seconds to wait for the next chunk (None: until it is there)
+    :return: next chunk, None at the end of the trajectory
+    :raise queue.Empty: no chunk within the timeout
+    """
+    chunk = self.queue.get(timeout=timeout)
+    if isinstance(chunk, BaseException):
+      raise chunk
+    return chunk
+
+  def __iter__(self):
+    while True:
+      chunk = self.get()
+      if chunk is None:
+        return
+      yield chunk
@@ -0,0 +1,181 @@
+import csv
+import json
+import time
+import warnings
+import itertools
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib.figure import Figure
+
+from .body import BodySystem
+from .edo import (hamiltonian, compute_angular_momentum, n_body_dqdt, n_body_dpdt)
+from .solvers import (heun, euler_symp, stormer_verlet, yoshida4, yoshida6, forest_ruth, wisdom_holman, dormand_prince, wisdom_holman_applies)
+from .backends import get_backend
+
+# name (same as the --solver of index.py) => solver
+SWEEP_SOLVERS = {
+  "heun": heun,
+  "euler-symplectic": euler_symp,
+  "stormer-verlet": stormer_verlet,
+  "yoshida-4": yoshida4,
+  "yoshida-6": yoshida6,
+  "forest-ruth": forest_ruth,
+  "wisdom-holman": wisdom_holman,
+  "dormand-prince": dormand_prince
+}
+
+# adaptive schemes: swept over their tolerance instead of dt
+ADAPTIVE_SOLVERS = ["dormand-prince"]
+
+COLUMNS = ["bodies", "n_bodies", "horizon", "solver", "dt", "tolerance", "backend", "steps", "wall_time", "steps_per_second", "energy_drift", "angular_momentum_drift"]
+
+def sweep_cells(body_sets, horizons, solvers, time_steps, tolerances, backend="numpy", samples=2000):
+  """
+  Grid of the sweep: body sets x horizons x solvers x time steps (x tolerances for the adaptive schemes,
+  their initial time step being the smallest dt).
+
+  :param body_sets: {"Sun+Jupiter": [Body, Body],...}
+  :param horizons: times of integration (in years)
+  :param samples: number of recorded states of a fixed step run (the drifts are the largest ones among them)
+  :return: one description (picklable) per run
+  :rtype: list
+  """
+  cells = []
+  for ((name, bodies), horizon, solver) in itertools.product(body_sets.items(), horizons, solvers):
+    cell = {"bodies": name, "body_list": bodies, "horizon": horizon, "solver": solver, "backend": backend, "samples": samples}
+    if solver in ADAPTIVE_SOLVERS:
+      cells += [dict(cell, dt=min(time_steps), tolerance=tolerance) for tolerance in tolerances]
+    else:
+      cells += [dict(cell, dt=dt, tolerance=None) for dt in time_steps]
+  return cells
+
+def relative_drifts(q, p, bodies):
+  """
+  Largest relative drift of the energy and of the angular momentum vector from their initial values
+  along a trajectory: max |E(t) - E(0)| / |E(0)| and max ||L(t) - L(0)|| / ||L(0)||.
+  """
+  energy = hamiltonian(q, p, bodies)
+  angular_momentum = compute_angular_momentum(q, p, bodies)
+
+  energy_drift = np.max(np.abs(energy - energy[0])) / np.abs(energy[0])
+  angular_momentum_drift = np.max(np.linalg.norm(angular_momentum - angular_momentum[0], axis=-1)) / np.linalg.norm(angular_momentum[0])
+  return float(energy_drift), float(angular_momentum_drift)
+
+def run_cell(cell):
+  """
+  Integrate one cell of the sweep (worker entry point) and measure it.
+
+  :return: row of the work-precision table (see COLUMNS), None if the solver does not apply to the bodies
+  :rtype: dict
+  """
+  bodies = BodySystem(cell["body_list"])
+  bodies.to_barycentric_frame()
+
+  if cell["solver"] == "wisdom-holman" and not wisdom_holman_applies(bodies):
+    warnings.warn(f"{cell['bodies']}: wisdom-holman skipped, its Kepler drifts need the first body to hold most of the mass (the Sun first)")
+    return None
+
+  dt = cell["dt"]
+  tN = cell["horizon"] * 365.25
+  solver = SWEEP_SOLVERS[cell["solver"]]
+
+  start = time.perf_counter()
+  if cell["tolerance"] is not None:
+    # every accepted step is recorded => number of steps
+    times, q, p = solver(dqdt=n_body_dqdt, dpdt=n_body_dpdt, q0=bodies.q0, p0=bodies.p0, t0=0, tN=tN, dt=dt, bodies=bodies, tolerance=cell["tolerance"])
+    steps = len(times) - 1
+  else:
+    nt = int(tN / dt)
+    record_every = max(1, int(np.ceil((nt - 1) / max(cell["samples"] - 1, 1))))
+    n_records = (nt - 1) // record_every + 1
+
+    q, p = np.zeros((n_records, len(bodies) * 3)), np.zeros((n_records, len(bodies) * 3))
+    q[0], p[0] = bodies.q0, bodies.p0
+    get_backend(cell["backend"]).run(solver=solver, dqdt=n_body_dqdt, dpdt=n_body_dpdt, q=q, p=p, dt=dt, nt=nt, bodies=bodies, record_every=record_every)
+    steps = nt - 1
+  wall_time = time.perf_counter() - start
+
+  energy_drift, angular_momentum_drift = relative_drifts(q, p, bodies)
+  return {
+    "bodies": cell["bodies"],
+    "n_bodies": len(bodies),
+    "horizon": cell["horizon"],
+    "solver": cell["solver"],
+    "dt": dt,
+    "tolerance": cell["tolerance"],
+    "backend": cell["backend"],
+    "steps": steps,
+    "wall_time": wall_time,
+    "steps_per_second": steps / wall_time if wall_time > 0 else None,
+    "energy_drift": energy_drift,
+    "angular_momentum_drift": angular_momentum_drift
+  }
+
+def run_sweep(cells, jobs=1):
+  """
+  Run the cells of a sweep over `jobs` worker processes (one cell per task).
+  The wall times are only comparable with each other if the workers do not compete for the cores (jobs <= cores).
+
+  :return: one row per cell (but the skipped ones), in the order of the cells
+  :rtype: list
+  """
+  if jobs == 1:
+    rows = [run_cell(cell) for cell in cells]
+  else:
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+      rows = list(executor.map(run_cell, cells))
+  return [row for row in rows if row is not None]
+
+def cheapest(rows, budget):
+  """
+  Fastest configuration meeting an accuracy budget, for each body set and horizon.
+
+  :param budget: largest relative energy drift allowed
+  :return: {(bodies, horizon): row or None if no configuration meets the budget}
+  :rtype: dict
+  """
+  best = {}
+  for row in rows:
+    key = (row["bodies"], row["horizon"])
+    best.setdefault(key, None)
+    if row["energy_drift"] <= budget and (best[key] is None or row["wall_time"] < best[key]["wall_time"]):
+      best[key] = row
+  return best
+
+def write_csv(rows, path):
+  with open(path, "w", newline="") as f:
+    writer = csv.DictWriter(f, fieldnames=COLUMNS)
+    writer.writeheader()
+    writer.writerows(rows)
+
+def write_json(rows, path, **metadata):
+  with open(path, "w") as f:
+    json.dump(dict(metadata, results=rows), f, indent=2)
+
+def plot_work_precision(rows, path):
+  """
+  Work-precision diagram: wall time versus relative energy drift of each run (log-log),
+  one subplot per body set and horizon, one line per solver (over its time steps or tolerances).
+  """
+  keys = list(dict.fromkeys((row["bodies"], row["horizon"]) for row in rows))
+  columns = min(len(keys), 2)
+  n_rows = int(np.ceil(len(keys) / columns))
+
+  fig = Figure(figsize=(5 * columns, 4 * n_rows))
+  for (index, (bodies, horizon)) in enumerate(keys):
+    ax = fig.add_subplot(n_rows, columns, index + 1)
+    cells = [row for row in rows if (row["bodies"], row["horizon"]) == (bodies, horizon)]
+
+    for solver in dict.fromkeys(row["solver"] for row in cells):
+      runs = sorted((row for row in cells if row["solver"] == solver), key=lambda row: row["energy_drift"])
+      ax.plot([row["energy_drift"] for row in runs], [row["wall_time"] for row in runs], marker="o", markersize=3, label=solver)
+
+    ax.set_xscale("log")
+    ax.set_yscale("log")
+    ax.set_title(f"{bodies}, {horizon} years", fontsize=10)
+    ax.set_xlabel("max relative energy drift")
+    ax.set_ylabel("wall time (s)")
+    ax.legend(fontsize=7)
+
+  fig.tight_layout()
+  fig.savefig(path)
@@ -0,0 +1,23 @@
+import os
+import sys
+import matplotlib
+import pytest
+
+# no display: figures are only rendered to files
+matplotlib.use("Agg")
+# consts, utils and src are imported from the root of the project
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.body import Body
+from consts import (sun_position0, sun_impulsion0, jupiter_position0, jupiter_impulsion0, saturn_position0, saturn_impulsion0, M_sun, M_jup, M_sat)
+
+@pytest.fixture
+def bodies():
+  """
+  Sun, Jupiter and Saturn (as index.py)
+  """
+  return [
+    Body(name="Sun", initial_positions=sun_position0, initial_impulsions=sun_impulsion0, mass=M_sun, color='gold', marker="o", marker_anim="o", markersize=9),
+    Body(name="Jupiter", initial_positions=jupiter_position0, initial_impulsions=jupiter_impulsion0, mass=M_jup, color='r', marker=",", marker_anim="o-", markersize=8),
+    Body(name="Saturn", initial_positions=saturn_position0, initial_impulsions=saturn_impulsion0, mass=M_sat, color='sandybrown', marker=",", marker_anim="o-", markersize=7)
+  ]
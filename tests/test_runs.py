@@ -0,0 +1,251 @@
+"""
+Invariants of the runs: a resumed, parallel, cached or compiled run gives the same trajectory (and events) as the plain one,
+the Barnes-Hut octree without approximation the same forces as the direct kernel, the events of a Kepler orbit its apsides.
+"""
+import os
+import copy
+import numpy as np
+import pytest
+
+from src.nbody import NBodySimulation
+from src.body import (BodySystem, main_belt)
+# not a test class
+from src.body import TestParticle as Particle
+from src.edo import (n_body_dpdt, compute_area_swept)
+from src.events import EVENT_KINDS
+from src.encounters import (EncounterDetector, CENTRAL_RADIUS)
+from src.sweep import (sweep_cells, run_sweep)
+from src.octree import BarnesHut
+from src.storage import load_trajectory
+from benchmarks.barnes_hut import random_bodies
+from consts import G
+
+# runs of 50 years (their figures folder, slides/figures/50_years, already exists)
+TN = 50 * 365.25
+DT = 10
+
+class Interrupted(Exception):
+  pass
+
+def simulation(bodies, schemes=("stormer-verlet",), **options):
+  # the simulation shifts the initial conditions of its bodies to the barycenter frame
+  sim = NBodySimulation(copy.deepcopy(bodies), 0, TN, DT, dict({"save": False}, **options))
+  sim.solvers = [sim.solvers2[name] for name in schemes]
+  return sim
+
+def run(bodies, schemes=("stormer-verlet",), **options):
+  """
+  :return: the simulation, kept alive as long as its results are used
+  (in the parallel mode, they are views on its shared memory blocks)
+  """
+  sim = simulation(bodies, schemes, **options)
+  sim.simulate()
+  return sim
+
+def interrupted_run(bodies, calls, schemes=("stormer-verlet",), **options):
+  """
+  Run stopped by an exception after `calls` force evaluations (as a killed process), leaving its checkpoints on disk.
+  """
+  sim = simulation(bodies, schemes, **options)
+  count = [0]
+  def dpdt(qk, pk, bodies):
+    count[0] += 1
+    if count[0] > calls:
+      raise Interrupted()
+    return n_body_dpdt(qk, pk, bodies)
+  sim.dpdt = dpdt
+
+  with pytest.raises(Interrupted):
+    sim.simulate()
+  metadata, arrays = load_trajectory(sim.output_dir(sim.solvers[0]["call"]))
+  assert 0 < metadata["n_written"] < sim.n_records
+
+def assert_same(result, other, keys=("q", "p")):
+  for key in keys:
+    assert np.array_equal(result[key], other[key]), key
+
+def assert_same_events(events, other):
+  assert events.keys() == other.keys()
+  for key in events:
+    assert np.array_equal(events[key], other[key]), key
+
+@pytest.mark.parametrize("schemes", [["stormer-verlet"], ["wisdom-holman"]])
+@pytest.mark.parametrize("storage_dtype", ["float64", "float32"])
+def test_resume_is_bit_identical(bodies, tmp_path, schemes, storage_dtype):
+  options = {"schemes": schemes, "storage_dtype": storage_dtype, "checkpoint_every": 50, "record_every": 3}
+  reference = run(bodies, output_dir=str(tmp_path / "reference"), **options).results[0]
+
+  interrupted_run(bodies, 1000, output_dir=str(tmp_path / "run"), **options)
+  resumed = run(bodies, output_dir=str(tmp_path / "run"), resume=True, **options).results[0]
+  assert_same(reference, resumed, ["q", "p", *(["energy"] if storage_dtype == "float32" else [])])
+
+def test_resume_with_test_particles(bodies, tmp_path):
+  system = bodies + main_belt(20, central=bodies[0])
+  options = {"checkpoint_every": 50, "particles_every": 7}
+  reference = run(system, output_dir=str(tmp_path / "reference"), **options).results[0]
+
+  interrupted_run(system, 1000, output_dir=str(tmp_path / "run"), **options)
+  resumed = run(system, output_dir=str(tmp_path / "run"), resume=True, **options).results[0]
+  assert_same(reference, resumed, ["q", "p", "particles_q", "particles_p"])
+
+@pytest.mark.parametrize("calls", [500, 2000, 3000])
+def test_resume_keeps_the_encounters(bodies, tmp_path, calls):
+  # Sun - Jupiter at the start, then Jupiter - Saturn entering and leaving the radius
+  options = {"encounters": "record", "encounter_radius": 5.5, "checkpoint_every": 50}
+  reference = run(bodies, output_dir=str(tmp_path / "reference"), **options).results[0]
+  assert len(reference["encounters"]["time"]) > 2
+
+  interrupted_run(bodies, calls, output_dir=str(tmp_path / "run"), **options)
+  resumed = run(bodies, output_dir=str(tmp_path / "run"), resume=True, **options).results[0]
+  assert_same(reference, resumed)
+  assert_same_events(reference["encounters"], resumed["encounters"])
+
+def test_resume_of_a_stopped_run(bodies, tmp_path):
+  options = {"encounters": "stop", "encounter_radius": 4.6, "checkpoint_every": 50, "output_dir": str(tmp_path)}
+  stopped = run(bodies, **options).results[0]
+  assert len(stopped["encounters"]["time"]) == 1
+  assert len(stopped["q"]) < int(TN / DT)
+
+  # nothing left to integrate
+  resumed = run(bodies, resume=True, **options).results[0]
+  assert_same(stopped, resumed)
+  assert_same_events(stopped["encounters"], resumed["encounters"])
+
+@pytest.mark.parametrize("calls", [500, 3000])
+def test_resume_keeps_the_events(bodies, tmp_path, calls):
+  options = {"events": ["apsides", "conjunctions", "nodes"], "checkpoint_every": 50}
+  reference = run(bodies, output_dir=str(tmp_path / "reference"), **options).results[0]
+
+  interrupted_run(bodies, calls, output_dir=str(tmp_path / "run"), **options)
+  resumed = run(bodies, output_dir=str(tmp_path / "run"), resume=True, **options).results[0]
+  assert_same(reference, resumed)
+  # read back from events.csv up to the checkpoint, found again after it
+  assert_same_events(reference["events"], resumed["events"])
+
+def test_sun_grazing_test_particle(bodies):
+  # comet crossing the Sun at 2 solar radii (the Sun has no Hill radius)
+  comet = Particle(name="comet", initial_positions=[-1., 0.0093, 0.], initial_velocities=[0.1, 0., 0.])
+  system = BodySystem(bodies + [comet])
+  detector = EncounterDetector(system)
+
+  for x in np.linspace(-0.05, 0.05, 11):
+    qk = np.concatenate([system.q0[:len(bodies) * 3], [x, 0.0093, 0.]])
+    detector.check(x, qk)
+
+  events = detector.events
+  assert events["i"].tolist() == [0] and events["j"].tolist() == [len(bodies)]
+  assert events["distance"][0] < CENTRAL_RADIUS
+  assert events["min_distance"][0] == pytest.approx(0.0093)
+
+def test_parallel_equals_serial(bodies, tmp_path):
+  system = bodies + main_belt(5, central=bodies[0])
+  options = {"schemes": ["heun", "stormer-verlet", "dormand-prince"], "events": ["apsides"], "samples": 200}
+  serial = run(system, **options)
+  parallel = run(system, jobs=2, **options)
+  on_disk = run(system, jobs=2, output_dir=str(tmp_path), **options)
+
+  for (result, other, stored) in zip(serial.results, parallel.results, on_disk.results):
+    assert_same(result, other, ["time", "q", "p", "particles_q", "particles_p"])
+    assert_same(result, stored, ["time", "q", "p", "particles_q", "particles_p"])
+    assert_same_events(result["events"], other["events"])
+    assert_same_events(result["events"], stored["events"])
+
+def test_cache_round_trip(bodies, tmp_path):
+  system = bodies + main_belt(5, central=bodies[0])
+  options = {"schemes": ["stormer-verlet", "dormand-prince"], "cache_dir": str(tmp_path), "encounters": "record", "encounter_radius": 5.5, "particles_every": 10}
+  computed = run(system, **options)
+  cached = run(system, **options)
+
+  for (result, other) in zip(computed.results, cached.results):
+    # read back from the cache
+    assert "metrics" not in other and "cache_key" in other
+    assert_same(result, other, ["time", "q", "p", "particles_q", "particles_p"])
+    assert_same_events(result["encounters"], other["encounters"])
+
+  # another stride of the particles is another result
+  other_stride = run(system, **dict(options, particles_every=0))
+  assert other_stride.results[0]["particles_q"].shape == (1, 5, 3)
+
+def test_cache_keeps_the_recorded_diagnostics(bodies, tmp_path):
+  options = {"storage_dtype": "float32", "cache_dir": str(tmp_path)}
+  computed = run(bodies, **options).results[0]
+
+  # full precision diagnostics recorded during the run, read back at another stride
+  cached = run(bodies, diagnostics_every=5, **options)
+  cached.compute_diagnostics()
+  result = cached.results[0]
+  assert "metrics" not in result
+  for key in ["energy", "angular_momentum", "area_swept"]:
+    assert np.array_equal(result[key], computed[key][::5]), key
+    assert result[key].dtype == np.float64, key
+
+def test_sweep_skips_wisdom_holman_without_a_central_mass(bodies):
+  # Jupiter first => no Kepler drift around the Sun
+  body_sets = {"Sun-Jupiter": bodies[:2], "Jupiter-Sun": bodies[1::-1]}
+  cells = sweep_cells(body_sets, [1], ["stormer-verlet", "wisdom-holman"], [10], [])
+  with pytest.warns(UserWarning, match="Jupiter-Sun: wisdom-holman skipped"):
+    rows = run_sweep(cells)
+  assert [(row["bodies"], row["solver"]) for row in rows] == [("Sun-Jupiter", "stormer-verlet"), ("Sun-Jupiter", "wisdom-holman"), ("Jupiter-Sun", "stormer-verlet")]
+
+def test_numba_matches_numpy(bodies):
+  pytest.importorskip("numba")
+  options = {"schemes": ["heun", "euler-symplectic", "stormer-verlet"], "record_every": 3}
+  reference = run(bodies, **options)
+  compiled = run(bodies, backend="numba", **options)
+
+  for (result, other) in zip(reference.results, compiled.results):
+    # same arithmetic up to the order of the force terms
+    assert np.allclose(result["q"], other["q"], rtol=0, atol=1e-9)
+    assert np.allclose(result["p"], other["p"], rtol=1e-9, atol=0)
+
+def test_resume_across_backends(bodies, tmp_path):
+  pytest.importorskip("numba")
+  # nt - 1 = 1825 steps, not a multiple of record_every => the last step is not recorded
+  options = {"checkpoint_every": 50, "record_every": 3}
+  reference = run(bodies, output_dir=str(tmp_path / "reference"), **options)
+  compiled = run(bodies, backend="numba", output_dir=str(tmp_path / "compiled"), **options)
+
+  # interrupted with numpy, finished with numba
+  interrupted_run(bodies, 1000, output_dir=str(tmp_path / "run"), **options)
+  resumed = run(bodies, backend="numba", output_dir=str(tmp_path / "run"), resume=True, **options)
+
+  for sim in [compiled, resumed]:
+    assert np.allclose(reference.results[0]["q"], sim.results[0]["q"], rtol=0, atol=1e-9)
+    # same final checkpoint (step nt - 1) whatever the backend
+    with np.load(tmp_path / "reference" / "stormer_verlet" / "checkpoint.npz") as expected, np.load(os.path.join(sim.output_dir(sim.solvers[0]["call"]), "checkpoint.npz")) as checkpoint:
+      assert checkpoint["step"] == expected["step"] == reference.nt - 1
+      assert checkpoint["n_written"] == expected["n_written"]
+      assert np.allclose(checkpoint["q"], expected["q"], rtol=0, atol=1e-9)
+
+@pytest.mark.parametrize("n", [3, 64, 300])
+def test_barnes_hut_without_approximation_is_direct(n):
+  bodies, q = random_bodies(n, np.random.default_rng(n))
+  # theta = 0 => every cell is opened down to the bodies
+  assert np.allclose(BarnesHut(theta=0.)(q, None, bodies), n_body_dpdt(q, None, bodies), rtol=1e-10, atol=0)
+
+@pytest.mark.parametrize("stride", [1, 10, 45, 80, 100, 170])
+def test_area_swept_of_a_circular_orbit(stride):
+  angles = np.radians(np.arange(0, 361, stride))
+  q = np.stack([2 * np.cos(angles), 2 * np.sin(angles), np.zeros(len(angles))], axis=-1)
+  area = np.sum(compute_area_swept(q[:-1], None, q[1:], None, None))
+  # sector of a circle of radius 2
+  assert area == pytest.approx(2 * angles[-1], rel=1e-12)
+
+def test_apsides_of_a_kepler_orbit(bodies):
+  # Sun - Jupiter alone => Keplerian relative orbit
+  sun, jupiter = bodies[:2]
+  events = run([sun, jupiter], events=["apsides"]).results[0]["events"]
+
+  r = jupiter.initial_positions - sun.initial_positions
+  v = jupiter.initial_impulsions / jupiter.mass - sun.initial_impulsions / sun.mass
+  mu = G * (sun.mass + jupiter.mass)
+  a = 1 / (2 / np.linalg.norm(r) - v @ v / mu)
+  e = np.linalg.norm(np.cross(v, np.cross(r, v)) / mu - r / np.linalg.norm(r))
+  period = 2 * np.pi * np.sqrt(a ** 3 / mu)
+
+  # about 4 orbits => perihelion and aphelion passages alternate every half period
+  assert len(events["time"]) == 9
+  assert np.all(np.abs(np.diff(events["event"])) == 1)
+  assert np.allclose(np.diff(events["time"]), period / 2, rtol=1e-4, atol=0)
+  perihelion = events["event"] == EVENT_KINDS.index("perihelion")
+  assert np.allclose(events["distance"], np.where(perihelion, a * (1 - e), a * (1 + e)), rtol=1e-4, atol=0)
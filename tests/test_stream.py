@@ -0,0 +1,31 @@
+"""
+Hand-over of the animation chunks from the producer thread.
+"""
+import queue
+import threading
+import pytest
+
+from src.stream import Producer
+
+def test_producer_reraises_the_exception_of_its_generator():
+  def chunks():
+    yield 1
+    raise ValueError("integration failed")
+
+  producer = Producer(chunks())
+  with pytest.raises(ValueError, match="integration failed"):
+    assert list(producer) == [1]
+
+def test_producer_does_not_block_the_consumer():
+  ready = threading.Event()
+  def chunks():
+    ready.wait()
+    yield 1
+
+  producer = Producer(chunks())
+  with pytest.raises(queue.Empty):
+    producer.get(timeout=0.01)
+
+  ready.set()
+  assert producer.get(timeout=1) == 1
+  assert producer.get(timeout=1) is None